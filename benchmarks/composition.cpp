@@ -0,0 +1,172 @@
+// Composition profiling throughput for k = 3..7
+// baseline is the previous implementation (std::map index, pow() in the loop, vector<double> per read)
+// simd falls back to the scalar encoder when SSE2 is not available
+//
+// Build
+//   g++ benchmarks/composition.cpp -Wall -o composition -O3
+// Run
+//   ./composition [reads] [read length]
+
+#include <iostream>
+#include <iomanip>
+#include <string>
+#include <vector>
+#include <map>
+#include <cmath>
+#include <random>
+#include <chrono>
+#include "../mbcclr_utils/composition_utils.h"
+
+using namespace std;
+
+class BaselineProfiler
+{
+private:
+    u_int32_t k_size;
+    u_int32_t kmer_count_len = 0;
+    map<u_int32_t, u_int32_t> kmer_inds;
+    vector<u_int32_t> kmer_inds_index;
+
+    u_int64_t rev_comp(u_int64_t x)
+    {
+        u_int64_t res = x;
+
+        res = ((res >> 2 & 0x3333333333333333) | (res & 0x3333333333333333) << 2);
+        res = ((res >> 4 & 0x0F0F0F0F0F0F0F0F) | (res & 0x0F0F0F0F0F0F0F0F) << 4);
+        res = ((res >> 8 & 0x00FF00FF00FF00FF) | (res & 0x00FF00FF00FF00FF) << 8);
+        res = ((res >> 16 & 0x0000FFFF0000FFFF) | (res & 0x0000FFFF0000FFFF) << 16);
+        res = ((res >> 32 & 0x00000000FFFFFFFF) | (res & 0x00000000FFFFFFFF) << 32);
+        res = res ^ 0xAAAAAAAAAAAAAAAA;
+
+        return (res >> (2 * (32 - k_size)));
+    }
+
+public:
+    BaselineProfiler(u_int32_t k_size)
+    {
+        u_int64_t kmer_rc, ind = 0;
+        this->k_size = k_size;
+
+        for (u_int64_t kmer = 0; kmer < (u_int64_t)pow(4, k_size); kmer++)
+        {
+            kmer_rc = rev_comp(kmer);
+
+            if (kmer_inds.find(kmer_rc) != kmer_inds.end())
+            {
+                kmer_inds[kmer] = kmer_inds[kmer_rc];
+            }
+            else
+            {
+                kmer_inds[kmer] = ind;
+                kmer_count_len += 1;
+                ind += 1;
+            }
+        }
+
+        kmer_inds_index.resize(kmer_inds.size());
+
+        for (auto its = kmer_inds.begin(); its != kmer_inds.end(); its++)
+        {
+            kmer_inds_index[its->first] = its->second;
+        }
+    }
+
+    vector<double> count_kmers(string &seq)
+    {
+        vector<double> profile(kmer_count_len, 0);
+        double total = 0;
+        long len = 0;
+        u_int64_t val = 0;
+
+        for (int i = 0; i < (int)seq.length(); i++)
+        {
+            val = (val << 2);
+            val = val & ((u_int64_t)pow(4, k_size) - 1);
+            val += (seq[i] >> 1 & 3);
+            len++;
+
+            if (len == k_size)
+            {
+                len--;
+                profile[kmer_inds_index[val]]++;
+                total++;
+            }
+        }
+
+        for (size_t i = 0; i < profile.size(); i++)
+        {
+            profile[i] /= max(1.0, total);
+        }
+
+        return profile;
+    }
+};
+
+template <typename F>
+double seconds(F f)
+{
+    auto start = chrono::steady_clock::now();
+    f();
+    return chrono::duration<double>(chrono::steady_clock::now() - start).count();
+}
+
+int main(int argc, char **argv)
+{
+    size_t count = argc > 1 ? stoul(argv[1]) : 2000;
+    size_t length = argc > 2 ? stoul(argv[2]) : 10000;
+    mt19937_64 rng(42);
+    const char bases[] = "ACGT";
+    vector<string> reads(count, string(length, 'A'));
+    double mbases = (double)count * length / 1e6;
+    volatile float sink = 0;
+
+    for (string &read : reads)
+    {
+        for (char &c : read)
+        {
+            c = bases[rng() & 3];
+        }
+    }
+
+    cout << "READS " << count << " LENGTH " << length << " (Mbases/s)" << endl;
+    cout << setw(4) << "k" << setw(12) << "baseline" << setw(12) << "scalar" << setw(12) << "simd" << setw(12) << "speedup" << endl;
+
+    for (u_int32_t k = 3; k <= 7; k++)
+    {
+        BaselineProfiler baseline(k);
+        CompositionProfiler profiler(k);
+        vector<u_int8_t> codes(length);
+        vector<u_int32_t> counts(profiler.size());
+
+        double t_baseline = seconds([&] {
+            for (string &read : reads)
+            {
+                sink = sink + baseline.count_kmers(read)[0];
+            }
+        });
+
+        double t_scalar = seconds([&] {
+            for (string &read : reads)
+            {
+                encode_bases_scalar(read.data(), length, codes.data());
+                sink = sink + profiler.count(codes.data(), length, counts.data());
+            }
+        });
+
+        double t_simd = seconds([&] {
+            for (string &read : reads)
+            {
+                encode_bases(read.data(), length, codes.data());
+                sink = sink + profiler.count(codes.data(), length, counts.data());
+            }
+        });
+
+        cout << setw(4) << k << fixed << setprecision(1)
+             << setw(12) << mbases / t_baseline
+             << setw(12) << mbases / t_scalar
+             << setw(12) << mbases / t_simd
+             << setw(11) << t_baseline / t_simd << "x" << endl;
+    }
+
+    return 0;
+}
@@ -0,0 +1,97 @@
+// Thread scaling of 15-mer counting, CAS (line_to_kmer_counts) vs sharded (ShardedKmerCounter)
+//
+// Build
+//   g++ benchmarks/count-scaling.cpp -fopenmp -lpthread -Wall -o count-scaling -lz -O3
+// Run
+//   ./count-scaling [reads] [read length] [max threads]
+
+#include <iostream>
+#include <iomanip>
+#include <string>
+#include <vector>
+#include <random>
+#include <chrono>
+#include <cstring>
+#include <omp.h>
+#include "../mbcclr_utils/kmer_utils.h"
+
+using namespace std;
+
+void random_reads(ReadBatch &reads, size_t count, size_t length)
+{
+    mt19937_64 rng(42);
+    const char bases[] = "ACGT";
+    string read(length, 'A');
+
+    for (size_t i = 0; i < count; i++)
+    {
+        for (char &c : read)
+        {
+            c = bases[rng() & 3];
+        }
+        reads.add(read.data(), read.length());
+    }
+}
+
+double time_cas(ReadBatch &reads, int threads)
+{
+    KmerTable table;
+    auto start = chrono::steady_clock::now();
+
+#pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
+    for (size_t i = 0; i < reads.size(); i++)
+    {
+        line_to_kmer_counts(reads.seq(i), reads.length(i), table);
+    }
+
+    return chrono::duration<double>(chrono::steady_clock::now() - start).count();
+}
+
+double time_sharded(ReadBatch &reads, int threads)
+{
+    KmerTable table;
+    ShardedKmerCounter counter(table, threads);
+    auto start = chrono::steady_clock::now();
+
+    counter.count_batch(reads);
+
+    return chrono::duration<double>(chrono::steady_clock::now() - start).count();
+}
+
+int main(int argc, char **argv)
+{
+    size_t count = argc > 1 ? stoul(argv[1]) : 20000;
+    size_t length = argc > 2 ? stoul(argv[2]) : 10000;
+    int max_threads = argc > 3 ? stoi(argv[3]) : omp_get_max_threads();
+    ReadBatch reads;
+    random_reads(reads, count, length);
+    double bases = (double)count * length;
+    double cas_1 = 0, sharded_1 = 0;
+
+    cout << "READS " << count << " LENGTH " << length << endl;
+    cout << setw(8) << "threads" << setw(12) << "cas(s)" << setw(12) << "speedup" << setw(12) << "sharded(s)" << setw(12) << "speedup" << setw(14) << "Mbases/s" << endl;
+
+    for (int threads = 1; threads <= max_threads; threads *= 2)
+    {
+        double cas = time_cas(reads, threads);
+        double sharded = time_sharded(reads, threads);
+
+        if (threads == 1)
+        {
+            cas_1 = cas;
+            sharded_1 = sharded;
+        }
+
+        cout << setw(8) << threads << fixed << setprecision(3)
+             << setw(12) << cas << setw(12) << cas_1 / cas
+             << setw(12) << sharded << setw(12) << sharded_1 / sharded
+             << setw(14) << bases / sharded / 1e6 << endl;
+
+        if (threads < max_threads && threads * 2 > max_threads)
+        {
+            threads = max_threads / 2;
+        }
+    }
+
+    return 0;
+}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Synthetic long read metagenome with a ground truth file, runs offline (numpy only)
+#
+#   python benchmarks/generate_reads.py -o bench_data -n 20000 -s 8 --length-model ont --error-rate 0.08
+#
+# Species genomes are drawn from species specific trinucleotide frequencies so they
+# differ in composition, abundances follow a log-normal skew and reads come from both strands.
+
+import argparse
+import os
+import numpy as np
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+COMPLEMENT = np.zeros(256, dtype=np.uint8)
+COMPLEMENT[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.frombuffer(b"TGCA", dtype=np.uint8)
+
+
+def make_genome(rng, size, concentration=0.5):
+    # genome as a sequence of trimers drawn from a species specific distribution
+    weights = rng.dirichlet(np.full(64, concentration))
+    trimers = rng.choice(64, size=size // 3 + 1, p=weights)
+    codes = np.stack([trimers >> 4, (trimers >> 2) & 3, trimers & 3], axis=1).ravel()
+
+    return BASES[codes[:size]]
+
+
+def read_lengths(rng, count, model, mean_length, min_length):
+    if model == "pacbio":
+        # HiFi like, narrow gamma
+        lengths = rng.gamma(shape=20.0, scale=mean_length / 20.0, size=count)
+    else:
+        # ONT like, long tailed log-normal
+        sigma = 0.6
+        lengths = rng.lognormal(mean=np.log(mean_length) - sigma ** 2 / 2, sigma=sigma, size=count)
+
+    return np.maximum(lengths.astype(np.int64), min_length)
+
+
+def add_errors(rng, seq, error_rate):
+    # equal parts substitutions, insertions and deletions
+    if error_rate <= 0:
+        return seq
+
+    seq = seq[rng.random(len(seq)) >= error_rate / 3]
+    subs = rng.random(len(seq)) < error_rate / 3
+    seq = seq.copy()
+    seq[subs] = BASES[rng.integers(0, 4, subs.sum())]
+    ins = np.flatnonzero(rng.random(len(seq)) < error_rate / 3)
+
+    return np.insert(seq, ins, BASES[rng.integers(0, 4, len(ins))])
+
+
+def generate(output, reads=10000, species=5, genome_size=1000000, abundance_skew=1.0,
+             length_model="ont", mean_length=6000, min_length=1000, error_rate=0.05, seed=0):
+    """
+    Writes output/reads.fasta, output/ids.txt (species of every read) and output/abundance.tsv.
+    Returns the paths of the reads and the truth file.
+    """
+    rng = np.random.default_rng(seed)
+
+    if not os.path.exists(output):
+        os.makedirs(output)
+
+    genomes = [make_genome(rng, genome_size) for _ in range(species)]
+    abundance = rng.lognormal(0, abundance_skew, species)
+    abundance /= abundance.sum()
+    origin = rng.choice(species, size=reads, p=abundance)
+    lengths = np.minimum(read_lengths(rng, reads, length_model, mean_length, min_length), genome_size)
+
+    reads_path = f"{output}/reads.fasta"
+    truth_path = f"{output}/ids.txt"
+
+    with open(reads_path, "w") as fasta, open(truth_path, "w") as truth:
+        for i, (s, length) in enumerate(zip(origin, lengths)):
+            start = rng.integers(0, genome_size - length + 1)
+            seq = genomes[s][start:start + length]
+
+            if rng.random() < 0.5:
+                seq = COMPLEMENT[seq[::-1]]
+
+            seq = add_errors(rng, seq, error_rate)
+            fasta.write(f">read_{i}\n{seq.tobytes().decode()}\n")
+            truth.write(f"species_{s}\n")
+
+    with open(f"{output}/abundance.tsv", "w") as f:
+        for s in range(species):
+            f.write(f"species_{s}\t{abundance[s]:.6f}\t{(origin == s).sum()}\n")
+
+    return reads_path, truth_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic long read metagenome with ground truth.")
+
+    parser.add_argument('--output', '-o', help="Output directory", type=str, required=True)
+    parser.add_argument('--reads', '-n', help="Number of reads", type=int, default=10000)
+    parser.add_argument('--species', '-s', help="Number of species", type=int, default=5)
+    parser.add_argument('--genome-size', help="Genome size of every species", type=int, default=1000000)
+    parser.add_argument('--abundance-skew', help="Sigma of the log-normal species abundances (0 for even)", type=float, default=1.0)
+    parser.add_argument('--length-model', help="Read length distribution", choices=['ont', 'pacbio'], type=str, default="ont")
+    parser.add_argument('--mean-length', help="Mean read length", type=int, default=6000)
+    parser.add_argument('--min-length', help="Minimum read length", type=int, default=1000)
+    parser.add_argument('--error-rate', help="Per base error rate, split evenly between substitutions, insertions and deletions", type=float, default=0.05)
+    parser.add_argument('--seed', help="Random seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    reads_path, truth_path = generate(args.output, args.reads, args.species, args.genome_size, args.abundance_skew,
+                                      args.length_model, args.mean_length, args.min_length, args.error_rate, args.seed)
+
+    print(f"Reads {reads_path}")
+    print(f"Truth {truth_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# Times and memory profiles every pipeline stage on synthetic data at several sizes and thread counts
+# and scores the binning against the ground truth, so speedups that change results show up.
+#
+# Build the binaries first (sh build.sh), then
+#   python benchmarks/run_benchmarks.py -o bench_runs --sizes 5000 20000 --threads 1 4
+#
+# Results go to <output>/benchmark-results.json, one entry per (size, threads, sketch fraction) run
+# with the run-metrics of every stage, and a summary table is printed. Sketch fractions below 1
+# (--sketch-fractions 1 0.25 0.1) compare the accuracy and speed of sketched coverage histograms.
+
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import Counter
+
+from sklearn.metrics.cluster import adjusted_rand_score
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mbcclr_utils import runners_utils
+from mbcclr_utils import sample_data
+from mbcclr_utils import binner_core
+from mbcclr_utils.telemetry import recorder
+from generate_reads import generate
+
+logger = logging.getLogger('MetaBCC-LR')
+
+
+def score(bins, truth):
+    """
+    Precision (bin purity), recall (species completeness) and ARI over binned reads.
+    """
+    pairs = [(b, t) for b, t in zip(bins, truth) if b != "UnBinned"]
+
+    if len(pairs) == 0:
+        return {"binned": 0.0, "bins": 0, "precision": 0.0, "recall": 0.0, "ari": 0.0}
+
+    counts = Counter(pairs)
+    per_bin = {}
+    per_species = {}
+
+    for (b, t), n in counts.items():
+        per_bin[b] = max(per_bin.get(b, 0), n)
+        per_species[t] = max(per_species.get(t, 0), n)
+
+    return {"binned": round(len(pairs) / len(bins), 4),
+            "bins": len(per_bin),
+            "precision": round(sum(per_bin.values()) / len(pairs), 4),
+            "recall": round(sum(per_species.values()) / len(pairs), 4),
+            "ari": round(adjusted_rand_score([t for _, t in pairs], [b for b, _ in pairs]), 4)}
+
+
+def run(reads_path, truth_path, output, threads, sample_count, sketch_fraction, args):
+    for d in ["profiles", "misc", "images"]:
+        os.makedirs(f"{output}/{d}", exist_ok=True)
+
+    handler = logging.FileHandler(f"{output}/metabcc-lr.log", mode="w")
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    recorder.reset()
+
+    try:
+        # standalone tools, then the fused profiling binary used by the pipeline (same outputs)
+        with recorder.stage("count-kmers"):
+            runners_utils.run_kmers(reads_path, output, args.k_size, threads)
+        with recorder.stage("count-15mers"):
+            runners_utils.run_15mer_counts(reads_path, output, threads, sketch_fraction)
+        with recorder.stage("search-15mers"):
+            runners_utils.run_15mer_vecs(reads_path, output, args.bin_size, args.bin_count, threads)
+        with recorder.stage("profiles"):
+            runners_utils.run_profiles(reads_path, output, args.k_size, args.bin_size, args.bin_count, threads, sketch_fraction=sketch_fraction)
+        with recorder.stage("sample"):
+            sample_data.sample(output, sample_count, truth_path, args.seed)
+        with recorder.stage("binning"):
+            sampled_bins = binner_core.run_binner(output, truth_path, threads, args.sensitivity, args.embedding)
+        with recorder.stage("assign"):
+            runners_utils.run_assign(output, threads)
+        with recorder.stage("reads2bins"):
+            o = recorder.run_tool("reads2bins", [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reads2bins.py"),
+                                                 "-r", reads_path, "-b", f"{output}/final.txt", "-o", f"{output}/bins"])
+            runners_utils.check_proc(o, "Separating reads")
+    finally:
+        logger.removeHandler(handler)
+
+    recorder.write(f"{output}/run-metrics.json", threads=threads)
+
+    with open(f"{output}/run-metrics.json") as f:
+        metrics = json.load(f)
+
+    # bins of the sampled reads straight from the binner, and the final assignment of all reads
+    bins, truth = [], []
+    for name, cluster in sampled_bins.items():
+        labels = cluster.getLabels()
+        bins += [name] * len(labels)
+        truth += labels
+    metrics["sampled_accuracy"] = score(bins, truth)
+    metrics["counts_mb"] = round(os.path.getsize(f"{output}/profiles/15mers-counts") / 2 ** 20, 1)
+    metrics["accuracy"] = score(open(f"{output}/final.txt").read().split(), open(truth_path).read().split())
+
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every MetaBCC-LR stage on synthetic reads.")
+
+    parser.add_argument('--output', '-o', help="Working directory for data and runs", type=str, required=True)
+    parser.add_argument('--sizes', help="Read counts to benchmark", type=int, nargs='+', default=[5000, 20000])
+    parser.add_argument('--threads', '-t', help="Thread counts to benchmark", type=int, nargs='+', default=[1, os.cpu_count()])
+    parser.add_argument('--species', '-s', help="Number of species", type=int, default=5)
+    parser.add_argument('--genome-size', help="Genome size of every species", type=int, default=1000000)
+    parser.add_argument('--abundance-skew', help="Sigma of the log-normal species abundances", type=float, default=1.0)
+    parser.add_argument('--length-model', choices=['ont', 'pacbio'], type=str, default="ont")
+    parser.add_argument('--mean-length', type=int, default=6000)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--k-size', '-k', type=int, default=3)
+    parser.add_argument('--bin-size', '-bs', type=int, default=10)
+    parser.add_argument('--bin-count', '-bc', type=int, default=32)
+    parser.add_argument('--sample-count', '-c', help="Reads sampled for binning, 10%% of the reads by default", type=int, default=0)
+    parser.add_argument('--sensitivity', type=int, default=5)
+    parser.add_argument('--embedding', '-e', choices=['tsne', 'umap', 'song'], type=str, default="tsne")
+    parser.add_argument('--sketch-fractions', help="Coverage sketch fractions to benchmark", type=float, nargs='+', default=[1.0])
+    parser.add_argument('--seed', help="Seed of the data and the read sampling", type=int, default=0)
+
+    args = parser.parse_args()
+
+    logger.setLevel(logging.DEBUG)
+    results = []
+
+    for size in args.sizes:
+        data = f"{args.output}/data-{size}"
+        reads_path, truth_path = f"{data}/reads.fasta", f"{data}/ids.txt"
+
+        if not os.path.isfile(truth_path):
+            print(f"Generating {size} reads in {data}")
+            generate(data, size, args.species, args.genome_size, args.abundance_skew, args.length_model,
+                     args.mean_length, 1000, args.error_rate, args.seed)
+
+        sample_count = args.sample_count if args.sample_count > 0 else max(size // 10, 1)
+
+        for threads in args.threads:
+            for fraction in args.sketch_fractions:
+                print(f"Running {size} reads with {threads} threads, sketch fraction {fraction}")
+                name = f"run-{size}-t{threads}" + (f"-f{fraction}" if fraction < 1 else "")
+                metrics = run(reads_path, truth_path, f"{args.output}/{name}", threads, sample_count, fraction, args)
+                metrics["reads"] = size
+                metrics["sketch_fraction"] = fraction
+                results.append(metrics)
+
+    with open(f"{args.output}/benchmark-results.json", "w") as f:
+        json.dump({"args": vars(args), "runs": results}, f, indent=2)
+
+    stages = [s["name"] for s in results[0]["stages"]] if results else []
+    header = ["reads", "threads", "sketch"] + [f"{s} (s)" for s in stages] + ["peak RSS (MB)", "counts (MB)", "sampled ARI", "binned", "precision", "recall", "ARI"]
+    rows = []
+
+    for r in results:
+        times = {s["name"]: s["wall_s"] for s in r["stages"]}
+        rows.append([r["reads"], r["threads"], r["sketch_fraction"]] + [times.get(s) for s in stages] +
+                    [max(s["peak_rss_mb"] for s in r["stages"]), r["counts_mb"], r["sampled_accuracy"]["ari"]] +
+                    [r["accuracy"][k] for k in ["binned", "precision", "recall", "ari"]])
+
+    print(tabulate(rows, headers=header))
+    print(f"Results written to {args.output}/benchmark-results.json")
+
+
+if __name__ == '__main__':
+    main()
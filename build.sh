@@ -12,10 +12,14 @@ case $1 in
     clang++ mbcclr_utils/search-15mers.cpp -lomp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/search-15mers -I/usr/local/include -L/usr/local/lib -lz -O3
     clang++ mbcclr_utils/count-15mers.cpp -lomp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/count-15mers -I/usr/local/include -L/usr/local/lib -lz -O3
     clang++ mbcclr_utils/coverage-vecs.cpp -lomp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/coverage-vecs -I/usr/local/include -L/usr/local/lib -lz -O3
+    clang++ mbcclr_utils/merge-15mers.cpp -lomp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/merge-15mers -I/usr/local/include -L/usr/local/lib -lz -O3
     echo "BUILDING THE MetaBCC-LR 3 MER COMPUTATIONS"
     clang++ mbcclr_utils/count-kmers.cpp -Wall -lomp -fopenmp -lpthread -o mbcclr_utils/bin/count-kmers -I/usr/local/include -L/usr/local/lib -lz -O3
     echo "BUILDING READ ASSIGNER"
     clang++ mbcclr_utils/assign_bins.cpp -lomp -fopenmp -lpthread -o mbcclr_utils/bin/assign -I/usr/local/include -L/usr/local/lib -lz -O3
+    clang++ mbcclr_utils/classify.cpp -lomp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/classify -I/usr/local/include -L/usr/local/lib -lz -O3
+    echo "BUILDING READ SPLITTER"
+    clang++ mbcclr_utils/split-reads.cpp -lomp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/split-reads -I/usr/local/include -L/usr/local/lib -lz -O3
     echo "BUILD FINISHED"
     ;;
 
@@ -26,10 +30,14 @@ case $1 in
     g++ mbcclr_utils/search-15mers.cpp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/search-15mers -lz -O3
     g++ mbcclr_utils/count-15mers.cpp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/count-15mers -lz -O3
     g++ mbcclr_utils/coverage-vecs.cpp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/coverage-vecs -lz -O3
+    g++ mbcclr_utils/merge-15mers.cpp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/merge-15mers -lz -O3
     echo "BUILDING THE MetaBCC-LR 3 MER COMPUTATIONS"
     g++ mbcclr_utils/count-kmers.cpp -Wall -fopenmp -lpthread -o mbcclr_utils/bin/count-kmers -lz -O3
     echo "BUILDING READ ASSIGNER"
     g++ mbcclr_utils/assign_bins.cpp -fopenmp -lpthread -o mbcclr_utils/bin/assign -lz -O3
+    g++ mbcclr_utils/classify.cpp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/classify -lz -O3
+    echo "BUILDING READ SPLITTER"
+    g++ mbcclr_utils/split-reads.cpp -fopenmp -lpthread -Wall -o mbcclr_utils/bin/split-reads -lz -O3
     echo "BUILD FINISHED"
     ;;
 esac
\ No newline at end of file
@@ -0,0 +1,32 @@
+import argparse
+import os
+
+from mbcclr_utils import profile_io
+
+parser = argparse.ArgumentParser(description='Convert text profiles (3mers/15mers) from older runs into the binary profile format.')
+
+parser.add_argument('--input', '-i', help="Text profile or an output directory of a previous run.", type=str, required=True)
+parser.add_argument('--output', '-o', help="Destination for a single profile. Ignored for output directories (converted in place).", type=str, required=False, default=None)
+
+args = parser.parse_args()
+
+if os.path.isdir(args.input):
+    jobs = []
+
+    for name in ["3mers", "15mers"]:
+        path = f"{args.input}/profiles/{name}"
+
+        if os.path.isfile(path) and not profile_io.is_profile(path):
+            jobs.append((path, path))
+else:
+    jobs = [(args.input, args.output or args.input)]
+
+for src, dst in jobs:
+    if profile_io.is_profile(src):
+        print(f"{src} is already a binary profile")
+        continue
+
+    tmp = dst + ".tmp"
+    rows = profile_io.convert_text_profile(src, tmp)
+    os.replace(tmp, dst)
+    print(f"Converted {src} -> {dst} ({rows} rows)")
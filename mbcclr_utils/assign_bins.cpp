@@ -4,244 +4,125 @@
 #include <iostream>
 #include <vector>
 #include <string>
-#include <cmath>
-#include <valarray>
+#include "io_utils.h"
+#include "profile_utils.h"
+#include "assign_utils.h"
+#include "metrics_utils.h"
 
 using namespace std;
 
-class Bin
-{
-private:
-    valarray<long double> p3mean, p3std, p15mean, p15std;
-    string name;
-public:
-    Bin()
-    {
-        this->name = "UnBinned";
-    }
-
-    Bin(string name)
-    {
-        this->name = name;
-    }
-
-    Bin(string name, valarray<long double> p3mean, valarray<long double> p15mean,  valarray<long double> p3std,  valarray<long double> p15std)
-    {
-        this->name = name;
-        this->p3mean = p3mean;
-        this->p3std = p3std;
-        this->p15mean = p15mean;
-        this->p15std = p15std;
-    }
-
-    string getName()
-    {
-        return this->name;
-    }
-
-    // Implemented using val arrays - left as comment for reference
-    // long double logpdf(long double mu, long double s, long double x)
-    // {
-    //     long double p = -0.5L * powl((x - mu)/s, 2.0L) - log(powl(2.0L * 22.0L / 7.0L, 0.5L) * s);
-        
-    //     return p;
-    // }
-
-
-    long double getProbability15(valarray<long double> p15)
-    {
-        size_t size = p15.size();
-        long double prob = (-0.5L * pow((p15 - this->p15mean)/this->p15std, 2.0L) - log(powl(2.0L * 22.0L / 7.0L, 0.5L) * this->p15std)).sum();
-        
-        return prob;
-    }
-
-    long double getProbability3(valarray<long double> p3)
-    {
-        size_t size = p3.size();
-        long double prob = (-0.5L * pow((p3 - this->p3mean)/this->p3std, 2.0L) - log(powl(2.0L * 22.0L / 7.0L, 0.5L) * this->p3std)).sum();        
-        
-        return prob;
-    }
-
-    void setP3mean(valarray<long double> vals)
-    {
-        this->p3mean = vals;
-    }
-
-    void setP3std(valarray<long double> vals)
-    {
-        this->p3std = vals;
-    }
-
-    void setP15mean(valarray<long double> vals)
-    {
-        this->p15mean = vals;
-    }
-
-    void setP15std(valarray<long double> vals)
-    {
-        this->p15std = vals;
-    }
-};
-
-valarray<long double> lineToVec(string &line)
-{
-    vector<long double> _values;
-    // vector<long double> values;
-    string tmp = "";
-
-    for (int i = 0; i < (int)line.length(); i++)
-    {
-        if ((48 <= int(line[i]) && int(line[i]) <= 57) || line[i] == '.' || line[i] == '+' || line[i] == '-' || line[i] == 'e')
-        {
-            tmp += line[i];
-        }
-        else if (tmp.length() > 0)
-        {
-
-            _values.push_back(stold(tmp));
-            tmp = "";
-        }
-    }
-    if (tmp.length() > 0)
-    {
-        _values.push_back(stold(tmp));
-        tmp = "";
-    }
-
-    valarray<long double> values(_values.data(), _values.size());
-
-    return values;
-}
+// reads handed to a thread at a time
+const size_t CHUNK = 4096;
 
-vector<Bin> getBinsFromFile(string &statsFile)
+// reads dropped by the read filter have no profile, they are written as UnBinned
+// so that the output has one line per input read (kept holds one byte per input read)
+void writeDropped(vector<char> &kept, size_t &kept_pos, string &result)
 {
-    ifstream infile(statsFile);
-    string line;
-    vector<Bin> bins;
-
-    while (getline(infile, line))
+    while (kept_pos < kept.size() && kept[kept_pos] == 0)
     {
-        Bin bin(line);
-        
-        getline(infile, line);
-        bin.setP15mean(lineToVec(line));
-        
-        getline(infile, line);
-        bin.setP3mean(lineToVec(line));
-        
-        getline(infile, line);
-        bin.setP15std(lineToVec(line));
-        
-        getline(infile, line);
-        bin.setP3std(lineToVec(line));
-
-        bins.push_back(bin);
+        result += "UnBinned\n";
+        kept_pos++;
     }
-
-    infile.close();
-
-    return bins;
 }
 
-Bin getBestBin(vector<Bin> &bins, valarray<long double> &p3, valarray<long double> &p15)
+void processLinesBatch(MappedProfile &p3, MappedProfile &p15, u_int64_t start, u_int64_t end, BinModel &bins, ofstream &output, int threads, vector<char> &kept, size_t &kept_pos)
 {
-    Bin bestbin;
-    long double maxProb15 = -INFINITY, maxProb3 = -INFINITY;
-    long double prob15, prob3;
-
-    for (Bin bin: bins)
-    {
-        prob15 = bin.getProbability15(p15);
-        prob3 = bin.getProbability3(p3);
-
-        if (prob15 > maxProb15)
-        {
-            maxProb15 = prob15;
-        }
-
-        if (prob15 == maxProb15 && prob3 > maxProb3)
-        {
-            bestbin = bin;
-            maxProb3 = prob3;
-        }
-    }
-
-    return bestbin;
-}
-
-void processLinesBatch(vector<valarray<long double>> &batch3, vector<valarray<long double>> &batch15, vector<Bin> &bins, string &outputPath, int threads)
-{
-    vector<string> batchAnswers(batch3.size());
+    vector<int> batchAnswers(end - start);
     string result = "";
 
-    #pragma omp parallel for num_threads(threads) schedule(static, threads)
-    for (size_t i = 0; i < batchAnswers.size(); i++)
+    #pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
+    for (u_int64_t i = start; i < end; i += CHUNK)
     {
-        
-        batchAnswers[i] = getBestBin(bins, batch3[i], batch15[i]).getName();
-    }
+        u_int64_t n = min((u_int64_t)CHUNK, end - i);
 
-    ofstream output;
-    output.open(outputPath, ios::out | ios::app);
+        bins.assign(p3.row(i), p15.row(i), n, batchAnswers.data() + (i - start));
+    }
 
     for (size_t i = 0; i < batchAnswers.size(); i++)
     {
-        result += batchAnswers[i];
+        writeDropped(kept, kept_pos, result);
+        result += bins.name(batchAnswers[i]);
         result += "\n";
+        kept_pos++;
     }
 
     output << result;
-
-    batchAnswers.clear();
-    output.close();
 }
 
 int main(int argc, char ** argv)
 {
+    // only --kept is used, reads were filtered when profiling
+    ReadFilter filter = ReadFilter::from_args(argc, argv);
+    // rows assigned at a time
+    MemoryOptions memory = MemoryOptions::from_args(argc, argv);
     string p3 = argv[1];
     string p15 = argv[2];
     string statsFile = argv[3];
     int threads = stoi(argv[4]);
     string outputPath = argv[5];
-    vector<valarray<long double>> batch3;
-    vector<valarray<long double>> batch15;
+    string advice = argc > 6 ? argv[6] : "sequential";
 
-    vector<Bin> bins = getBinsFromFile(statsFile);
+    // the bin statistics and profiles throw on missing, truncated or malformed files
+    try
+    {
+        BinModel bins(statsFile);
 
-    cout << "3 Mers " <<  p3 << endl;
-    cout << "15 Mers " <<  p15 << endl;
-    cout << "Stats " <<  statsFile << endl;
-    cout << "Threads " <<  threads << endl;
+        cout << "3 Mers " <<  p3 << endl;
+        cout << "15 Mers " <<  p15 << endl;
+        cout << "Stats " <<  statsFile << endl;
+        cout << "Threads " <<  threads << endl;
 
-    cout << "Bins size = " << bins.size() << endl;
+        cout << "Bins size = " << bins.size() << endl;
 
+        MappedProfile p3File(p3, advice);
+        MappedProfile p15File(p15, advice);
 
-    ifstream p3File(p3);
-    ifstream p15File(p15);
-    string line;
+        if (p3File.rows() != p15File.rows() || (bins.size() > 0 && (p3File.dims() != bins.dims3 || p15File.dims() != bins.dims15)))
+        {
+            cerr << "Profiles do not match the bin statistics" << endl;
+            return 1;
+        }
 
-    ofstream output;
-    output.open(outputPath, ios::out);
-    output.close();
+        vector<char> kept;
+        size_t kept_pos = 0;
+        string dropped;
 
-    while (getline(p3File, line))
-    {
-        batch3.push_back(lineToVec(line));
-        getline(p15File, line);
-        batch15.push_back(lineToVec(line));
-        
-        if (batch3.size() == 1000000)
+        if (!filter.kept_path.empty())
         {
-            processLinesBatch(batch3, batch15, bins, outputPath, threads);
-            batch3.clear();
-            batch15.clear();
+            ifstream kept_file(filter.kept_path, ios::binary);
+            kept.assign(istreambuf_iterator<char>(kept_file), istreambuf_iterator<char>());
+
+            if ((u_int64_t)count(kept.begin(), kept.end(), 1) != p3File.rows())
+            {
+                cerr << "Kept reads " << filter.kept_path << " do not match the profiles" << endl;
+                return 1;
+            }
+            cout << "Kept " << p3File.rows() << " of " << kept.size() << " reads" << endl;
         }
-    }
-    processLinesBatch(batch3, batch15, bins, outputPath, threads);
 
-    batch3.clear();
-    batch15.clear();
+        ofstream output;
+        output.open(outputPath, ios::out);
 
-}
\ No newline at end of file
+        for (u_int64_t i = 0; i < p3File.rows(); i += memory.chunk_rows)
+        {
+            processLinesBatch(p3File, p15File, i, min(i + memory.chunk_rows, p3File.rows()), bins, output, threads, kept, kept_pos);
+        }
+
+        writeDropped(kept, kept_pos, dropped);
+        output << dropped;
+
+        output.close();
+
+        // reads assigned, no sequence is read here
+        ToolMetrics metrics;
+        metrics.add(p3File.rows(), 0);
+        metrics.write();
+    }
+    catch (const exception &e)
+    {
+        cerr << e.what() << endl;
+        return 1;
+    }
+
+    return 0;
+}
@@ -0,0 +1,168 @@
+#pragma once
+#include <iostream>
+#include <fstream>
+#include <string>
+#include <vector>
+#include <cmath>
+#include <stdexcept>
+#include <algorithm>
+
+using namespace std;
+
+// Gaussian model of every bin, bins x dims row major matrices.
+// Each read is scored as sum(-0.5 * ((x - mu) / s)^2 - log(sqrt(2 pi) s))
+// and assigned to the best coverage bin, ties broken by composition.
+class BinModel
+{
+private:
+    // reads scored per block against all bins
+    static const size_t BLOCK = 128;
+
+    vector<double> p3mean, p3inv, p15mean, p15inv;
+    vector<double> p3lognorm, p15lognorm;
+
+    static vector<double> lineToVec(string &line)
+    {
+        vector<double> values;
+        size_t pos = 0, used;
+
+        while (pos < line.length())
+        {
+            if (isspace(line[pos]))
+            {
+                pos++;
+                continue;
+            }
+            values.push_back(stod(line.substr(pos), &used));
+            pos += used;
+        }
+
+        return values;
+    }
+
+    void add_stats(vector<double> &mean, vector<double> &inv, vector<double> &lognorm, vector<double> mu, vector<double> s, u_int32_t &dims)
+    {
+        double norm = 0;
+
+        if (names.size() == 1)
+        {
+            dims = mu.size();
+        }
+
+        if (mu.size() != dims || s.size() != dims)
+        {
+            throw runtime_error("Inconsistent dimensions for bin " + names.back());
+        }
+
+        for (size_t d = 0; d < dims; d++)
+        {
+            mean.push_back(mu[d]);
+            // zero deviations give inf and the score turns NaN as before
+            inv.push_back(1.0 / s[d]);
+            norm += log(sqrt(2.0 * M_PI) * s[d]);
+        }
+        lognorm.push_back(norm);
+    }
+
+    // scores[r * bins + b] for the reads in x (rows x dims)
+    void score(const float *x, size_t rows, u_int32_t dims, const vector<double> &mean, const vector<double> &inv, const vector<double> &lognorm, double *scores) const
+    {
+        size_t bins = names.size();
+
+        for (size_t b = 0; b < bins; b++)
+        {
+            const double *mu = mean.data() + b * dims;
+            const double *iv = inv.data() + b * dims;
+
+            for (size_t r = 0; r < rows; r++)
+            {
+                const float *xr = x + r * dims;
+                double acc = 0, z;
+
+                for (u_int32_t d = 0; d < dims; d++)
+                {
+                    z = (xr[d] - mu[d]) * iv[d];
+                    acc += z * z;
+                }
+                scores[r * bins + b] = -0.5 * acc - lognorm[b];
+            }
+        }
+    }
+
+public:
+    vector<string> names;
+    u_int32_t dims3 = 0, dims15 = 0;
+
+    // cluster-stats.txt, five lines per bin
+    // name, p15 mean, p3 mean, p15 std, p3 std
+    BinModel(string statsFile)
+    {
+        ifstream infile(statsFile);
+        string name, p15mu, p3mu, p15s, p3s;
+
+        if (!infile)
+        {
+            throw runtime_error("Unable to open " + statsFile);
+        }
+
+        while (getline(infile, name) && getline(infile, p15mu) && getline(infile, p3mu) && getline(infile, p15s) && getline(infile, p3s))
+        {
+            names.push_back(name);
+            add_stats(p15mean, p15inv, p15lognorm, lineToVec(p15mu), lineToVec(p15s), dims15);
+            add_stats(p3mean, p3inv, p3lognorm, lineToVec(p3mu), lineToVec(p3s), dims3);
+        }
+
+        infile.close();
+    }
+
+    size_t size() const
+    {
+        return names.size();
+    }
+
+    // best bin of each read, -1 when no bin has a valid score
+    void assign(const float *p3, const float *p15, size_t rows, int *best) const
+    {
+        size_t bins = names.size();
+        vector<double> scores3(BLOCK * bins), scores15(BLOCK * bins);
+
+        for (size_t start = 0; start < rows; start += BLOCK)
+        {
+            size_t n = min(BLOCK, rows - start);
+
+            score(p15 + start * dims15, n, dims15, p15mean, p15inv, p15lognorm, scores15.data());
+            score(p3 + start * dims3, n, dims3, p3mean, p3inv, p3lognorm, scores3.data());
+
+            for (size_t r = 0; r < n; r++)
+            {
+                double maxProb15 = -INFINITY, maxProb3 = -INFINITY, prob15, prob3;
+                int bestbin = -1;
+
+                // same two level argmax as before, maxProb3 is intentionally
+                // not reset when a better coverage score shows up
+                for (size_t b = 0; b < bins; b++)
+                {
+                    prob15 = scores15[r * bins + b];
+                    prob3 = scores3[r * bins + b];
+
+                    if (prob15 > maxProb15)
+                    {
+                        maxProb15 = prob15;
+                    }
+
+                    if (prob15 == maxProb15 && prob3 > maxProb3)
+                    {
+                        bestbin = b;
+                        maxProb3 = prob3;
+                    }
+                }
+                best[start + r] = bestbin;
+            }
+        }
+    }
+
+    string name(int bin) const
+    {
+        return bin < 0 ? "UnBinned" : names[bin];
+    }
+};
@@ -1,153 +1,203 @@
 import numpy as np
-from sklearn.manifold import TSNE
-from sklearn.cluster import DBSCAN
 from kneed import KneeLocator
-from sklearn.neighbors import NearestNeighbors
+import random
 from random import sample
+from multiprocessing import get_context, current_process
+import queue
+import zlib
+import os
+import shutil
 from sklearn.metrics.cluster import adjusted_rand_score
-import matplotlib
 import logging
 from tabulate import tabulate
-import umap
-from song.song import SONG
 
-matplotlib.use('Agg')
-
-import matplotlib.pyplot as plt
-import seaborn as sns
+from mbcclr_utils import embedding_backend
+from mbcclr_utils import plotting
+from mbcclr_utils.neighbour_index import NeighbourIndex, knee_curve
+from mbcclr_utils.embedding_cache import EmbeddingCache, file_digest
+from mbcclr_utils.telemetry import recorder
 
 logger = logging.getLogger('MetaBCC-LR')
 
-class Read:
-    def __init__(self, i, p3, p15):
-        self.i = i
+# reads scored per chunk when reassigning reads to the sampled clusters
+REASSIGN_CHUNK = 10000
+# clusters with fewer reads than this are reassigned in process
+REASSIGN_POOL_MIN = 200000
+
+# numba (UMAP) threading layers are not fork safe, pools start from a clean server process
+mp_context = get_context("forkserver")
+mp_context.set_forkserver_preload(["mbcclr_utils.binner_core"])
+
+# profiles and embedding cache of the current run, set once per process by init_worker
+shared_profiles = None
+embedding_cache = None
+# upper bound on pool processes for the memory budget, set by run_binner (None for threads)
+max_processes = None
+# how diagnostics figures are produced (plotting.PLOT_MODES), set by run_binner and init_worker
+plot_mode = "inline"
+# PCA before embedding (embedding_backend.PCA_MODES or a component count), set by run_binner and init_worker
+embedding_pca = "off"
+
+def pool_size(processes):
+    return min(processes, max_processes) if max_processes else processes
+
+class Profiles:
+    """
+    Sampled p3/p15 matrices (and truth labels) shared by every cluster of the tree.
+    """
+    def __init__(self, p3, p15, truth=None, digest=None):
         self.p3 = p3
         self.p15 = p15
-        self.embededValue = None
+        self.truth = truth
+        # content hash of the profiles, part of the embedding cache key
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.p3)
 
 class Cluster:
-    def __init__(self, name, embedding):
+    def __init__(self, name, embedding, profiles, reads):
         self.name = name
-        self.reads = []
+        # row indices into the shared profiles
+        self.reads = np.asarray(reads, dtype=np.int64)
         self.sampledReads = None
         self.embedding = embedding
+        self.profiles = profiles
+        self.stats = {}
 
     def sample(self, count = 1000):
-        self.sampledReads = sample(self.reads, count)
+        self.sampledReads = self.reads[sample(range(len(self.reads)), count)]
 
-    def addRead(self, read):
-        self.reads.append(read)
+    def subCluster(self, name, reads):
+        return Cluster(name, self.embedding, self.profiles, reads)
 
     def getDataP3(self):
-        arr = []
-        for read in self.reads:
-            arr.append(read.p3)
-
-        return np.array(arr)
+        return self.profiles.p3[self.reads]
 
     def getDataP15(self):
-        arr = []
-        for read in self.reads:
-            arr.append(read.p15)
-
-        return np.array(arr)
+        return self.profiles.p15[self.reads]
 
     def getDataP3sampled(self):
-        arr = []
-        for read in self.sampledReads:
-            arr.append(read.p3)
-
-        return np.array(arr)
+        return self.profiles.p3[self.sampledReads]
 
     def getDataP15sampled(self):
-        arr = []
-        for read in self.sampledReads:
-            arr.append(read.p15)
-
-        return np.array(arr)
-
-    def embedP15(self):
-        if self.embedding == 'song':
-            return SONG().fit_transform(self.getDataP15())
-        if self.embedding == 'umap':
-            return umap.UMAP().fit_transform(self.getDataP15())
-        return TSNE(n_components=2,
-                    init='pca').fit_transform(self.getDataP15())
-
-    def embedP3(self):
-        if self.embedding == 'song':
-            return SONG().fit_transform(self.getDataP3())
-        if self.embedding == 'umap':
-            return umap.UMAP().fit_transform(self.getDataP3())
-        return TSNE(n_components=2, init='pca').fit_transform(self.getDataP3())
-
-    def embedP15sampled(self):
-        if self.embedding == 'song':
-            return SONG().fit_transform(self.getDataP15sampled())
-        if self.embedding == 'umap':
-            return umap.UMAP().fit_transform(self.getDataP15sampled())
-        return TSNE(n_components=2,
-                    init='pca').fit_transform(self.getDataP15sampled())
-
-    def embedP3sampled(self):
-        if self.embedding == 'song':
-            return SONG().fit_transform(self.getDataP3sampled())
-        if self.embedding == 'umap':
-            return umap.UMAP().fit_transform(self.getDataP3sampled())
-        return TSNE(n_components=2,
-                    init='pca').fit_transform(self.getDataP3sampled())
+        return self.profiles.p15[self.sampledReads]
 
-    def getMeanP15(self):
-        return np.mean(self.getDataP15(), axis=0)
+    def embed(self, profile, reads, threads=1):
+        matrix = self.profiles.p3 if profile == "p3" else self.profiles.p15
+        # only composition profiles are reduced, coverage histograms are narrow
+        settings = embedding_backend.plan(self.embedding, len(reads), matrix.shape[1], embedding_pca if profile == "p3" else "off")
+        key = None
 
-    def getMeanP3(self):
-        return np.mean(self.getDataP3(), axis=0)
+        if embedding_cache is not None:
+            key = embedding_cache.key(embedding_backend.describe(settings), profile, self.profiles.digest, reads)
+            embedded = embedding_cache.get(key)
 
-    def getStdP15(self):
-        return np.std(self.getDataP15(), axis=0)
+            if embedded is not None:
+                logger.debug(f"Using cached {profile} embedding of {self.name}")
+                return embedded
 
-    def getStdP3(self):
-        return np.std(self.getDataP3(), axis=0)
+        embedded = embedding_backend.embed(matrix[reads], self.embedding, threads, settings)
 
-    def getLabels(self):
-        return list(map(lambda r: r.i, self.reads))
+        if key is not None:
+            embedding_cache.put(key, embedded)
 
-    def getProbabilityP3(self, read):
-        x = np.array(read.p3)
-        mu = self.getMeanP3()
-        s = self.getStdP3()
+        return embedded
 
-        p = -0.5 * (((x - mu)/s) ** 2.0) - np.log(((2.0 * np.pi) ** 0.5) * s)
+    def embedP15(self, threads=1):
+        return self.embed("p15", self.reads, threads)
 
-        return np.sum(p)
+    def embedP3(self, threads=1):
+        return self.embed("p3", self.reads, threads)
 
-    def getProbabilityP15(self, read):
-        x = np.array(read.p15)
-        mu = self.getMeanP15()
-        s = self.getStdP15()
+    def embedP15sampled(self, threads=1):
+        return self.embed("p15", self.sampledReads, threads)
 
-        p = -0.5 * ((x - mu)/s ** 2.0) - np.log(((2.0 * np.pi) ** 0.5) * s)
+    def embedP3sampled(self, threads=1):
+        return self.embed("p3", self.sampledReads, threads)
 
-        return np.sum(p)
+    def getStats(self, key):
+        # members never change once a cluster is built, stats are computed once
+        if key not in self.stats:
+            data = self.getDataP3() if key == "p3" else self.getDataP15()
+            self.stats[key] = (np.mean(data, axis=0), np.std(data, axis=0))
+        return self.stats[key]
 
-def plot_cluster(X, Y, title, labels, output):
-    fig = plt.figure(figsize=(10, 10))
-    fig.suptitle(title, fontsize=20)
+    def getMeanP15(self):
+        return self.getStats("p15")[0]
+
+    def getMeanP3(self):
+        return self.getStats("p3")[0]
+
+    def getStdP15(self):
+        return self.getStats("p15")[1]
 
-    if len(labels) == len(X):
-        sns.scatterplot(x=X, y=Y, hue=labels).plot()
+    def getStdP3(self):
+        return self.getStats("p3")[1]
+
+    def getLabels(self):
+        if self.profiles.truth is None:
+            return [0] * len(self.reads)
+        return list(self.profiles.truth[self.reads])
+
+def score_reads(data, mu, s, t):
+    # gaussian log likelihood of every row under one cluster (coverage term kept as originally written)
+    if t == "composition":
+        p = -0.5 * (((data - mu)/s) ** 2.0) - np.log(((2.0 * np.pi) ** 0.5) * s)
+    else:
+        p = -0.5 * ((data - mu)/s ** 2.0) - np.log(((2.0 * np.pi) ** 0.5) * s)
+
+    return np.sum(p, axis=1)
+
+def best_clusters(args):
+    data, means, stds, t = args
+    best = np.full(len(data), -1)
+    maxP = np.full(len(data), float("-inf"))
+
+    # first cluster with the strictly highest score wins, NaN scores never do
+    for n, (mu, s) in enumerate(zip(means, stds)):
+        p = score_reads(data, mu, s, t)
+        better = p > maxP
+        best[better] = n
+        maxP[better] = p[better]
+
+    return best
+
+def reassign_reads(data, means, stds, t, processes=1):
+    """
+    Index of the most likely cluster for every row of data, -1 when none scores.
+    Chunks are scored in a process pool when processes > 1.
+    """
+    chunks = [(data[i:i + REASSIGN_CHUNK], means, stds, t) for i in range(0, len(data), REASSIGN_CHUNK)]
+
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=int)
+
+    # pool workers of the clustering tree cannot start their own pools
+    if processes > 1 and len(chunks) > 1 and not current_process().daemon:
+        p = mp_context.Pool(processes)
+        results = p.map(best_clusters, chunks)
+        p.close()
+        p.join()
     else:
-        sns.scatterplot(x=X, y=Y).plot()
+        results = list(map(best_clusters, chunks))
+
+    return np.concatenate(results)
+
+def plot_cluster(X, Y, title, labels, output):
+    if plot_mode == "off":
+        return
 
-    plt.savefig(f"{output}/images/{title}.png", dpi=200, format="png")
-    plt.close()
+    with recorder.step("plotting"):
+        if plot_mode == "deferred":
+            plotting.save_pending(output, title, "scatter", x=np.asarray(X, dtype=np.float32), y=np.asarray(Y, dtype=np.float32), labels=labels)
+        else:
+            plotting.render_scatter(X, Y, title, labels, output)
 
-def estimate_epsilon(X_embedded, sensitivity, plot_name, output):
-    neigh = NearestNeighbors(n_neighbors=2)
-    nbrs = neigh.fit(X_embedded)
-    distances, indices = nbrs.kneighbors(X_embedded)
-    distances = np.sort(distances, axis=0)
-    distances = distances[int(distances.shape[0]/2):, 1]
+def estimate_epsilon(index, sensitivity, plot_name, output):
+    distances = np.sort(index.nearest_distances())
+    # upper half of the curve, downsampled so the knee costs the same for any node size
+    distances = knee_curve(distances[int(distances.shape[0]/2):])
     i = np.arange(distances.shape[0])
 
     # get the elbow
@@ -158,12 +208,12 @@ def estimate_epsilon(X_embedded, sensitivity, plot_name, output):
                         direction='increasing',
                         interp_method='polynomial')
 
-    if plot_name:
-        plt.figure()
-        plt.plot(distances)
-        kneedle.plot_knee_normalized()
-        plt.savefig(f"{output}/images/{plot_name}.png", dpi=200, format="png")
-        plt.close()
+    if plot_name and plot_mode != "off":
+        with recorder.step("plotting"):
+            if plot_mode == "deferred":
+                plotting.save_pending(output, plot_name, "kneedle", distances=distances)
+            else:
+                plotting.render_kneedle(distances, plot_name, output, kneedle)
 
     return sensitivity * distances[kneedle.knee]
 
@@ -220,32 +270,39 @@ def cluster_reads(cluster, t, sensitivity, threads, output, embedding, ground_tr
         return {cluster.name + "-N": cluster}
     elif len(cluster.reads) > 2000 and sample:
         cluster.sample()
-        if t == "composition":
-            embeddedRoot = cluster.embedP3sampled()
-        else:
-            embeddedRoot = cluster.embedP15sampled()
+        with recorder.step("embedding"):
+            if t == "composition":
+                embeddedRoot = cluster.embedP3sampled(threads)
+            else:
+                embeddedRoot = cluster.embedP15sampled(threads)
     else:
-        if t == "composition":
-            embeddedRoot = cluster.embedP3()
-        else:
-            embeddedRoot = cluster.embedP15()
+        with recorder.step("embedding"):
+            if t == "composition":
+                embeddedRoot = cluster.embedP3(threads)
+            else:
+                embeddedRoot = cluster.embedP15(threads)
     
-    try:
-        eps = estimate_epsilon(embeddedRoot, sensitivity, "Kneedle for " + t  + " " + cluster.name, output)
-    except:
-        logger.error("Unable to locate an epsilon for clustering. Using 0.5")
-        eps = 0.5
+    with recorder.step("epsilon"):
+        # one neighbour index per node, for the epsilon and for DBSCAN
+        index = NeighbourIndex(embeddedRoot, threads)
+
+        try:
+            eps = estimate_epsilon(index, sensitivity, "Kneedle for " + t  + " " + cluster.name, output)
+        except:
+            logger.error("Unable to locate an epsilon for clustering. Using 0.5")
+            eps = 0.5
 
     # eps cannot be zero
     if eps==0:
         eps = 1
 
-    clustering = DBSCAN(eps=eps, n_jobs=threads).fit(embeddedRoot)
+    with recorder.step("dbscan"):
+        clusters = index.dbscan(eps)
     
     if t == "composition":
-        labels = list(map(lambda x: f"{cluster.name}-c-{x+1}", list(clustering.labels_)))
+        labels = list(map(lambda x: f"{cluster.name}-c-{x+1}", list(clusters)))
     else:
-        labels = list(map(lambda x: f"{cluster.name}-x-{x+1}", list(clustering.labels_)))
+        labels = list(map(lambda x: f"{cluster.name}-x-{x+1}", list(clusters)))
 
     if plot:
         plot_cluster(embeddedRoot[:, 0],
@@ -253,92 +310,222 @@ def cluster_reads(cluster, t, sensitivity, threads, output, embedding, ground_tr
                     "Separation by " + t  + " " + cluster.name,
                     labels, output)
 
+    if sample and len(cluster.reads) > 2000:
+        reads = cluster.sampledReads
+    else:
+        reads = cluster.reads
+
     if ground_truth is not None:
-        if sample and len(cluster.reads) > 2000:
-            reads = cluster.sampledReads
-        else:
-            reads = cluster.reads
-        labels1 = list(map(lambda r: r.i, reads))
+        labels1 = list(cluster.profiles.truth[reads])
         if plot:
             plot_cluster(embeddedRoot[:, 0],
                         embeddedRoot[:, 1],
                         "Separation by " + t + " Truth " + cluster.name,
                         labels1, output)
 
-    if sample and len(cluster.reads) > 2000:
-        reads = cluster.sampledReads
-    else:
-        reads = cluster.reads
-    new_clusters = {}
+    members = {}
     
     for cname, read in zip(labels, reads):
         # discard noise
         if "--1" in cname:
             continue
-        if cname not in new_clusters:
-            new_clusters[cname] = Cluster(cname, embedding)
-        new_clusters[cname].addRead(read)
+        if cname not in members:
+            members[cname] = []
+        members[cname].append(read)
+
+    new_clusters = {cname: cluster.subCluster(cname, rows) for cname, rows in members.items()}
 
     # reassign all reads back
     if sample and len(cluster.reads) > 2000:
+        names = list(new_clusters.keys())
+
+        if t == "composition":
+            data = cluster.getDataP3()
+            means = [c.getMeanP3() for c in new_clusters.values()]
+            stds = [c.getStdP3() for c in new_clusters.values()]
+        else:
+            data = cluster.getDataP15()
+            means = [c.getMeanP15() for c in new_clusters.values()]
+            stds = [c.getStdP15() for c in new_clusters.values()]
+
+        processes = threads if len(cluster.reads) >= REASSIGN_POOL_MIN else 1
+        with recorder.step("reassignment"):
+            best = reassign_reads(data, means, stds, t, pool_size(processes))
+        del data
+
+        # clusters keep the order in which their first read appears
+        _, first = np.unique(best, return_index=True)
         new_clustersAllReads = {}
-        reads = cluster.reads
-        for r in reads:
-            maxP = float("-inf")
-            bestC = None
-            for cn, c in new_clusters.items():
-                if t == "composition":
-                    p = c.getProbabilityP3(r)
-                else:
-                    p = c.getProbabilityP15(r)
-                if p > maxP:
-                    maxP = p
-                    bestC = cn
-            
-            if bestC not in new_clustersAllReads:
-                new_clustersAllReads[bestC] = Cluster(bestC, embedding)
-
-            new_clustersAllReads[bestC].addRead(r)
+
+        for b in best[np.sort(first)]:
+            bestC = names[b] if b >= 0 else None
+            new_clustersAllReads[bestC] = cluster.subCluster(bestC, cluster.reads[best == b])
+
         return new_clustersAllReads
     return new_clusters
 
-def cluster_composition(cluster, sensitivity, threads, output, embedding, ground_truth):
-    r1 = cluster_reads(cluster, "composition", sensitivity, threads, output, embedding, ground_truth, True, True)
-    result = {}
+def load_profiles(output, ground_truth):
+    p3 = np.load(f"{output}/profiles/3mers_sampled.npy", mmap_mode='r')
+    p15 = np.load(f"{output}/profiles/15mers_sampled.npy", mmap_mode='r')
+    truth = None
 
-    if len(r1) > 100:
-        for _, c2 in r1.items():
-            r2 = cluster_composition(c2, sensitivity, threads, output, embedding, ground_truth)
-            result.update(r2)
-    else:
-        result.update(r1)
-    
-    return result
+    if ground_truth is not None:
+        truth = np.load(f"{output}/misc/filtered_truth_sampled.npy")
+
+    return Profiles(p3, p15, truth)
+
+def init_worker(output, ground_truth, cache_size=0, digest=None, log_files=(), plots="inline", pca="off"):
+    global shared_profiles, embedding_cache, plot_mode, embedding_pca
+    shared_profiles = load_profiles(output, ground_truth)
+    embedding_cache = None
+    plot_mode = plots
+    embedding_pca = pca
+
+    # pool workers start without the handlers of the driver
+    for log_file in log_files:
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+
+    # and info lines (the embedding of every node) on the console, as the driver logs them
+    if log_files:
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        console.setLevel(logging.INFO)
+        logger.addHandler(console)
+
+    if cache_size > 0:
+        if digest is None:
+            digest = file_digest(f"{output}/profiles/3mers_sampled.npy") + file_digest(f"{output}/profiles/15mers_sampled.npy")
+        shared_profiles.digest = digest
+        embedding_cache = EmbeddingCache(f"{output}/cache/embeddings", cache_size)
+
+def seed_node(name):
+    # every tree node gets its own seed so results do not depend on which process ran it
+    seed = zlib.crc32(str(name).encode())
+    random.seed(seed)
+    np.random.seed(seed)
+
+def split_composition(args):
+    name, reads, sensitivity, threads, output, embedding, ground_truth = args
+    cluster = Cluster(name, embedding, shared_profiles, reads)
+
+    seed_node(name)
+    with recorder.step("composition node"):
+        r1 = cluster_reads(cluster, "composition", sensitivity, threads, output, embedding, ground_truth, True, True)
+
+    # step timings travel back with the result when this runs in a pool worker
+    return [(cname, c.reads) for cname, c in r1.items()], recorder.pop_steps()
+
+def cluster_composition(clusters, sensitivity, threads, output, embedding, ground_truth):
+    """
+    Composition clustering of every coverage cluster.
+    Tree nodes are independent and run in a pool of processes, results are
+    gathered in the depth first order of the recursive version so bin names stay stable.
+    """
+    nodes = []
+    children = {}
+    leaves = {}
+    pending = []
+    # subtrees are spread over up to one process per thread, whatever the number of coverage clusters
+    processes = pool_size(threads)
+
+    def add_node(name, reads):
+        nodes.append((name, reads))
+        pending.append(len(nodes) - 1)
+        return len(nodes) - 1
+
+    def node_args(n, node_threads):
+        name, reads = nodes[n]
+        return (name, reads, sensitivity, node_threads, output, embedding, ground_truth)
+
+    def expand(n, result):
+        r1, steps = result
+        recorder.merge_steps(steps)
+
+        if len(r1) > 100:
+            children[n] = [add_node(cname, reads) for cname, reads in r1]
+        else:
+            leaves[n] = r1
 
-def run_binner(output, ground_truth, threads, sensitivity, embedding):
+    roots = [add_node(c.name, c.reads) for c in clusters]
+
+    if processes <= 1:
+        while pending:
+            n = pending.pop(0)
+            expand(n, split_composition(node_args(n, threads)))
+    else:
+        done = queue.Queue()
+        running = 0
+        cache_size = embedding_cache.max_size if embedding_cache is not None else 0
+        log_files = [h.baseFilename for h in logger.handlers if isinstance(h, logging.FileHandler)]
+        pool = mp_context.Pool(processes, initializer=init_worker,
+                               initargs=(output, ground_truth, cache_size, shared_profiles.digest, log_files, plot_mode, embedding_pca))
+
+        while pending or running:
+            # each node embeds and runs DBSCAN with its share of the threads, split between the
+            # nodes in flight, so a lone root gets them all and its subtrees split them as they appear
+            node_threads = max(1, threads // max(1, min(processes, running + len(pending))))
+
+            while pending:
+                n = pending.pop(0)
+                pool.apply_async(split_composition, (node_args(n, node_threads),),
+                                 callback=lambda result, n=n: done.put((n, result, None)),
+                                 error_callback=lambda e, n=n: done.put((n, None, e)))
+                running += 1
+
+            n, result, error = done.get()
+            running -= 1
+
+            if error is not None:
+                pool.terminate()
+                raise error
+            recorder.external_cpu_s += result[1]["composition node"]["cpu_s"]
+            expand(n, result)
+
+        pool.close()
+        pool.join()
+
+    def collect(n):
+        if n in leaves:
+            return leaves[n]
+        return [r for c in children[n] for r in collect(c)]
+
+    results = []
+
+    for root, cluster in zip(roots, clusters):
+        result = {}
+        for cname, reads in collect(root):
+            result[cname] = cluster.subCluster(cname, reads)
+        results.append(result)
+
+    return results
+
+def run_binner(output, ground_truth, threads, sensitivity, embedding, cache_size=0, processes=None, plots="inline", pca="off"):
+    global max_processes
+    # results do not depend on the number of processes, only memory and speed do
+    max_processes = processes
     sensitivity = 11 - sensitivity
-    p3 = np.load(f"{output}/profiles/3mers_sampled.npy")
-    p15 = np.load(f"{output}/profiles/15mers_sampled.npy")
     output_binning = f"{output}/misc/"
-    
-    if ground_truth is not None:
-        ground_truth = np.load(f"{output}/misc/filtered_truth_sampled.npy")
 
-    cluster_init = Cluster("Root", embedding)
+    # figures of an earlier run that were never rendered
+    if plots == "deferred" and os.path.isdir(plotting.pending_dir(output)):
+        shutil.rmtree(plotting.pending_dir(output), ignore_errors=True)
+
+    # embeddings do not depend on sensitivity, cached ones are reused across runs
+    init_worker(output, ground_truth, cache_size, plots=plots, pca=pca)
     all_species = []
 
     if ground_truth is not None:
-        for p3_row, p15_row, truth_read in zip(p3, p15, ground_truth):
-            all_species.append(truth_read)
-            cluster_init.addRead(Read(truth_read, p3_row, p15_row))
-        all_species = list(set(all_species))
-    else:
-        for p3_row, p15_row in zip(p3, p15):
-            cluster_init.addRead(Read(0, p3_row, p15_row))
+        all_species = list(set(shared_profiles.truth))
+
+    cluster_init = Cluster("Root", embedding, shared_profiles, np.arange(len(shared_profiles)))
 
     stats = open(f"{output_binning}/cluster-stats.txt", "w+")
 
     logger.debug("Clustering using coverage")
+    seed_node(cluster_init.name)
     coverage_based_clusters = cluster_reads(cluster_init, "coverage", sensitivity, threads, output, embedding, ground_truth, False, True)
     logger.debug(f"Identified number of coverage clusters - {len(coverage_based_clusters)}")
 
@@ -351,9 +538,10 @@ def run_binner(output, ground_truth, threads, sensitivity, embedding):
     if sensitivity < 8:
         logger.debug(f"Discarding small clusters (< 500 reads in the sampled set)")
 
-    for _, coverage_based_cluster in coverage_based_clusters.items():
-        composition_based_clusters = cluster_composition(coverage_based_cluster, sensitivity, threads, output, embedding, ground_truth)
-            
+    coverage_based_clusters = list(coverage_based_clusters.values())
+    composition_results = cluster_composition(coverage_based_clusters, sensitivity, threads, output, embedding, ground_truth)
+
+    for coverage_based_cluster, composition_based_clusters in zip(coverage_based_clusters, composition_results):
         final_clusters.update(composition_based_clusters)
 
         for _, composition_based_cluster in composition_based_clusters.items():
@@ -384,3 +572,5 @@ def run_binner(output, ground_truth, threads, sensitivity, embedding):
 
     if ground_truth is not None:
         evaluate_clusters(final_binning_result, all_species)
+
+    return final_binning_result
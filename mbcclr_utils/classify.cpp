@@ -0,0 +1,138 @@
+#include <iostream>
+#include <algorithm>
+#include <omp.h>
+#include <cstdio>
+#include <string>
+#include <vector>
+#include "io_utils.h"
+#include "kmer_utils.h"
+#include "composition_utils.h"
+#include "assign_utils.h"
+#include "metrics_utils.h"
+
+using namespace std;
+
+// reads handed to a thread at a time when assigning
+const size_t CHUNK = 256;
+
+// Assigns reads of a stream to the bins of a saved model, one bin per line in input order.
+// Both profiles of a batch are computed in memory and its bins are flushed before the next batch,
+// so memory is bounded by the batches in flight and a bin is written shortly after its read arrives.
+// Reads dropped by the model's read filter are empty placeholders in their batch, written as UnBinned.
+void classify_batch(ReadBatch &batch, KmerTable &kmers, CompositionProfiler &profiler, BinModel &bins, FILE *output, int threads, long bin_size, int bin_count, ReadFilter &filter)
+{
+    size_t n = batch.size();
+    vector<float> p15(n * bin_count), p3(n * profiler.size());
+    vector<int> best(n);
+    string result = "";
+
+#pragma omp parallel num_threads(threads)
+    {
+#pragma omp for schedule(dynamic, 1)
+        for (size_t i = 0; i < n; i++)
+        {
+            line_to_vec(batch.seq(i), batch.length(i), kmers, bin_size, bin_count, p15.data() + i * bin_count);
+            profiler.count_kmers(batch.seq(i), batch.length(i), p3.data() + i * profiler.size());
+        }
+
+#pragma omp for schedule(dynamic, 1)
+        for (size_t i = 0; i < n; i += CHUNK)
+        {
+            bins.assign(p3.data() + i * profiler.size(), p15.data() + i * bin_count, min(CHUNK, n - i), best.data() + i);
+        }
+    }
+
+    for (size_t i = 0; i < n; i++)
+    {
+        result += filter.active() && batch.length(i) == 0 ? "UnBinned" : bins.name(best[i]);
+        result += "\n";
+    }
+
+    fwrite(result.data(), 1, result.size(), output);
+    fflush(output);
+}
+
+int main(int argc, char **argv)
+{
+    // the read filter of the run that built the model
+    ReadFilter filter = ReadFilter::from_args(argc, argv);
+    filter.placeholders = true;
+    string kmers_file = argv[1];
+    string stats_file = argv[2];
+    int k_size = stoi(argv[3]);
+    int bin_size = stoi(argv[4]);
+    int bin_count = stoi(argv[5]);
+    int threads = stoi(argv[6]);
+    string input_path = argv[7];
+    string output_path = argv[8];
+    u_int64_t batch_bases = stoull(argv[9]);
+
+    // stdout may carry the bins, log lines go to stderr
+    cout.rdbuf(cerr.rdbuf());
+
+    cout << "K-Mer file " << kmers_file << endl;
+    cout << "Stats " << stats_file << endl;
+    cout << "INPUT FILE " << input_path << endl;
+    cout << "OUTPUT FILE " << output_path << endl;
+    cout << "THREADS " << threads << endl;
+    cout << "BATCH BASES " << batch_bases << endl;
+
+    // the count table and bin statistics throw on missing, truncated or malformed files
+    try
+    {
+        KmerTable kmers(kmers_file, "willneed");
+        BinModel bins(stats_file);
+        CompositionProfiler profiler(k_size);
+
+        cout << "Bins size = " << bins.size() << endl;
+
+        if (bins.size() > 0 && (profiler.size() != bins.dims3 || (u_int32_t)bin_count != bins.dims15))
+        {
+            cerr << "Model parameters do not match the bin statistics" << endl;
+            return 1;
+        }
+
+        FILE *output = output_path == "-" ? stdout : fopen(output_path.c_str(), "w");
+
+        if (output == nullptr)
+        {
+            cerr << "Unable to open output " << output_path << endl;
+            return 1;
+        }
+
+        ToolMetrics metrics;
+
+        {
+            // chunks no larger than a batch, zlib waits until a chunk is full
+            ReadPipeline reader(input_path, threads, batch_bases, 4, min(batch_bases, (u_int64_t)1 << 22), filter);
+            ReadBatch *batch;
+
+            while (reader.next(batch))
+            {
+                classify_batch(*batch, kmers, profiler, bins, output, threads, bin_size, bin_count, filter);
+                reader.release(batch);
+            }
+
+            if (reader.error())
+            {
+                cerr << "Error reading " << input_path << endl;
+                return 1;
+            }
+            metrics.add(reader.reads(), reader.bases());
+        }
+
+        if (output != stdout)
+        {
+            fclose(output);
+        }
+
+        metrics.write();
+    }
+    catch (const exception &e)
+    {
+        cerr << e.what() << endl;
+        return 1;
+    }
+
+    return 0;
+}
@@ -0,0 +1,196 @@
+#pragma once
+#include <iostream>
+#include <vector>
+#include <string>
+#include <algorithm>
+#ifdef __SSE2__
+#include <emmintrin.h>
+#endif
+
+using namespace std;
+
+// base codes used for k-mers (A=0, C=1, T=2, G=3) in either case, anything else is invalid
+const u_int8_t BASE_INVALID = 4;
+
+struct BaseCodes
+{
+    u_int8_t table[256];
+
+    BaseCodes()
+    {
+        fill(table, table + 256, BASE_INVALID);
+        table[(int)'A'] = 0;
+        table[(int)'C'] = 1;
+        table[(int)'T'] = 2;
+        table[(int)'G'] = 3;
+        // soft-masked bases
+        table[(int)'a'] = 0;
+        table[(int)'c'] = 1;
+        table[(int)'t'] = 2;
+        table[(int)'g'] = 3;
+    }
+};
+
+const BaseCodes BASE_CODES;
+
+inline void encode_bases_scalar(const char *seq, size_t length, u_int8_t *codes)
+{
+    for (size_t i = 0; i < length; i++)
+    {
+        codes[i] = BASE_CODES.table[(u_int8_t)seq[i]];
+    }
+}
+
+#ifdef __SSE2__
+// 16 bases at a time, ((c >> 1) & 3) for ACGT/acgt and BASE_INVALID otherwise
+inline void encode_bases_simd(const char *seq, size_t length, u_int8_t *codes)
+{
+    const __m128i a = _mm_set1_epi8('A'), c = _mm_set1_epi8('C'), g = _mm_set1_epi8('G'), t = _mm_set1_epi8('T');
+    const __m128i three = _mm_set1_epi8(3), invalid = _mm_set1_epi8(BASE_INVALID), upper = _mm_set1_epi8((char)0xDF);
+    size_t i = 0;
+
+    for (; i + 16 <= length; i += 16)
+    {
+        // case-folded, soft-masked acgt compare equal to ACGT and keep their codes
+        __m128i bases = _mm_and_si128(_mm_loadu_si128((const __m128i *)(seq + i)), upper);
+        __m128i valid = _mm_or_si128(_mm_or_si128(_mm_cmpeq_epi8(bases, a), _mm_cmpeq_epi8(bases, c)),
+                                     _mm_or_si128(_mm_cmpeq_epi8(bases, g), _mm_cmpeq_epi8(bases, t)));
+        // the 16 bit shift leaks into bit 7 of each byte, masked out by three
+        __m128i code = _mm_and_si128(_mm_srli_epi16(bases, 1), three);
+
+        code = _mm_or_si128(_mm_and_si128(valid, code), _mm_andnot_si128(valid, invalid));
+        _mm_storeu_si128((__m128i *)(codes + i), code);
+    }
+
+    encode_bases_scalar(seq + i, length - i, codes + i);
+}
+#endif
+
+inline void encode_bases(const char *seq, size_t length, u_int8_t *codes)
+{
+#ifdef __SSE2__
+    encode_bases_simd(seq, length, codes);
+#else
+    encode_bases_scalar(seq, length, codes);
+#endif
+}
+
+class CompositionProfiler
+{
+private:
+    u_int32_t k_size;
+    u_int64_t mask;
+    u_int32_t kmer_count_len = 0;
+    // canonical profile index of every k-mer
+    vector<u_int32_t> kmer_inds_index;
+
+    u_int64_t rev_comp(u_int64_t x)
+    {
+        u_int64_t res = x;
+
+        res = ((res >> 2 & 0x3333333333333333) | (res & 0x3333333333333333) << 2);
+        res = ((res >> 4 & 0x0F0F0F0F0F0F0F0F) | (res & 0x0F0F0F0F0F0F0F0F) << 4);
+        res = ((res >> 8 & 0x00FF00FF00FF00FF) | (res & 0x00FF00FF00FF00FF) << 8);
+        res = ((res >> 16 & 0x0000FFFF0000FFFF) | (res & 0x0000FFFF0000FFFF) << 16);
+        res = ((res >> 32 & 0x00000000FFFFFFFF) | (res & 0x00000000FFFFFFFF) << 32);
+        res = res ^ 0xAAAAAAAAAAAAAAAA;
+
+        return (res >> (2 * (32 - k_size)));
+    }
+
+    void compute_kmer_inds()
+    {
+        u_int64_t kmer_rc;
+
+        kmer_inds_index.resize(mask + 1);
+
+        // a k-mer shares the index of its reverse complement if that came first
+        for (u_int64_t kmer = 0; kmer <= mask; kmer++)
+        {
+            kmer_rc = rev_comp(kmer);
+
+            if (kmer_rc < kmer)
+            {
+                kmer_inds_index[kmer] = kmer_inds_index[kmer_rc];
+            }
+            else
+            {
+                kmer_inds_index[kmer] = kmer_count_len;
+                kmer_count_len += 1;
+            }
+        }
+    }
+
+public:
+    CompositionProfiler(u_int32_t k_size)
+    {
+        this->k_size = k_size;
+        this->mask = (1ULL << (2 * k_size)) - 1;
+        compute_kmer_inds();
+    }
+
+    // number of values in a profile (canonical k-mers)
+    u_int32_t size()
+    {
+        return kmer_count_len;
+    }
+
+    // number of k-mers including reverse complements
+    u_int64_t total_kmers()
+    {
+        return mask + 1;
+    }
+
+    // integer k-mer counts, the rolling window restarts after a non ACGT base
+    // returns the number of k-mers counted
+    u_int64_t count(const u_int8_t *codes, size_t length, u_int32_t *counts)
+    {
+        u_int64_t total = 0, val = 0;
+        u_int32_t len = 0;
+
+        fill(counts, counts + kmer_count_len, 0);
+
+        for (size_t i = 0; i < length; i++)
+        {
+            if (codes[i] == BASE_INVALID)
+            {
+                val = 0;
+                len = 0;
+                continue;
+            }
+
+            val = ((val << 2) | codes[i]) & mask;
+            len++;
+
+            if (len >= k_size)
+            {
+                counts[kmer_inds_index[val]]++;
+                total++;
+            }
+        }
+
+        return total;
+    }
+
+    void count_kmers(const char *seq, size_t length, float *profile)
+    {
+        // per thread buffers, reused across reads
+        thread_local vector<u_int8_t> codes;
+        thread_local vector<u_int32_t> counts;
+        u_int64_t total;
+
+        if (codes.size() < length)
+        {
+            codes.resize(length);
+        }
+        counts.resize(kmer_count_len);
+
+        encode_bases(seq, length, codes.data());
+        total = count(codes.data(), length, counts.data());
+
+        for (size_t i = 0; i < kmer_count_len; i++)
+        {
+            profile[i] = (double)counts[i] / max((u_int64_t)1, total);
+        }
+    }
+};
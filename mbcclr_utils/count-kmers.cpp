@@ -1,196 +1,35 @@
 #include <iostream>
-#include <map>
+#include <algorithm>
 #include <vector>
 #include <string>
-#include <cmath>
 #include <fstream>
-#include <queue>
-#include <mutex>
-#include <thread>
-#include <condition_variable>
 #include "io_utils.h"
+#include "profile_utils.h"
+#include "composition_utils.h"
+#include "metrics_utils.h"
 
 using namespace std;
 
-uint32_t kmer_count_len = 0;
-map<uint32_t, uint32_t> kmer_inds;
-uint32_t *kmer_inds_index;
-uint32_t k_size;
-queue<string> reads_queue;
-mutex mux;
-condition_variable condition;
-volatile bool terminate_threads;
-
-u_int64_t rev_comp(u_int64_t x)
-{
-    u_int64_t res = x;
-
-    res = ((res >> 2 & 0x3333333333333333) | (res & 0x3333333333333333) << 2);
-    res = ((res >> 4 & 0x0F0F0F0F0F0F0F0F) | (res & 0x0F0F0F0F0F0F0F0F) << 4);
-    res = ((res >> 8 & 0x00FF00FF00FF00FF) | (res & 0x00FF00FF00FF00FF) << 8);
-    res = ((res >> 16 & 0x0000FFFF0000FFFF) | (res & 0x0000FFFF0000FFFF) << 16);
-    res = ((res >> 32 & 0x00000000FFFFFFFF) | (res & 0x00000000FFFFFFFF) << 32);
-    res = res ^ 0xAAAAAAAAAAAAAAAA;
-
-    return (res >> (2 * (32 - k_size)));
-}
-
-void compute_kmer_inds()
-{
-    u_int64_t kmer_rc, ind = 0;
-
-    for (u_int64_t kmer = 0; kmer < (u_int64_t)pow(4, k_size); kmer++)
-    {
-        kmer_rc = rev_comp(kmer);
-
-        if (kmer_inds.find(kmer_rc) != kmer_inds.end())
-        {
-            kmer_inds[kmer] = kmer_inds[kmer_rc];
-        }
-        else
-        {
-            kmer_inds[kmer] = ind;
-            kmer_count_len += 1;
-            ind += 1;
-        }
-    }
-
-    kmer_inds_index = new uint32_t[kmer_inds.size()];
-
-    for (auto its = kmer_inds.begin(); its != kmer_inds.end(); its++)
-    {
-        kmer_inds_index[its->first] = its->second;
-    }
-}
-
-vector<double> count_kmers(string seq)
-{
-    vector<double> profile(kmer_count_len, 0);
-    double total = 0;
-    long len = 0;
-    u_int64_t val = 0;
-
-    for (int i = 0; i < (int)seq.length(); i++)
-    {
-        val = (val << 2);
-        val = val & ((u_int64_t)pow(4, k_size) - 1);
-        val += (seq[i] >> 1 & 3);
-        len++;
-
-        if (len == k_size)
-        {
-            // use val as the kmer for counting
-            len--;
-            profile[kmer_inds_index[val]]++;
-            total++;
-        }
-    }
-
-    for (size_t i = 0; i < profile.size(); i++)
-    {
-        profile[i] /= max(1.0, total);
-    }
-
-    return profile;
-}
-
-void processLinesBatch(vector<string> &linesBatch, string &output_path, int threads)
+void processLinesBatch(ReadBatch &linesBatch, CompositionProfiler &profiler, ProfileWriter &output, int threads)
 {
-    vector<vector<double>> results(linesBatch.size());
-    ofstream output;
-    output.open(output_path, ios::out | ios::app);
-    string o = "";
+    vector<float> results(linesBatch.size() * profiler.size());
 
 #pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
     for (size_t i = 0; i < linesBatch.size(); i++)
     {
-        results[i] = count_kmers(linesBatch[i]);
-    }
-
-    for (size_t i = 0; i < linesBatch.size(); i++)
-    {
-        for (double d : results[i])
-        {
-            o += to_string(d);
-            o += " ";
-        }
-        o += "\n";
+        profiler.count_kmers(linesBatch.seq(i), linesBatch.length(i), results.data() + i * profiler.size());
     }
 
-    output << o;
-    results.clear();
-    output.close();
-}
-
-void off_load_process(string &output, int &threads)
-{
-    string seq;
-    vector<string> batch;
-
-    while (true)
-    {
-        {
-            unique_lock<mutex> lock(mux);
-
-            while (reads_queue.size() > 0)
-            {
-                seq = reads_queue.front();
-                batch.push_back(seq);
-                reads_queue.pop();
-
-                if (batch.size() == 10000)
-                {
-                    break;
-                }
-            }
-        }
-
-        condition.notify_all();
-
-        if (batch.size() > 0)
-        {
-            processLinesBatch(batch, output, threads);
-            batch.clear();
-        }
-
-        {
-            unique_lock<mutex> lock(mux);
-            if (terminate_threads && reads_queue.size() == 0)
-            {
-                break;
-            }
-        }
-    }
-}
-
-void io_thread(string &file_path)
-{
-    SeqReader reader(file_path);
-    Seq seq;
-    int count = 0;
-
-    while (reader.get_seq(seq))
-    {
-        {
-            unique_lock<mutex> lock(mux);
-            condition.wait(lock, [] { return reads_queue.size() < 50000; });
-            reads_queue.push(seq.data);
-        }
-        count++;
-
-        cout << "Loaded Reads " << count << "       \r" << flush;
-    }
-
-    cout << endl;
-
-    terminate_threads = true;
+    output.write_rows(results.data(), linesBatch.size());
 }
 
 int main(int argc, char **argv)
 {
-    vector<string> batch;
     string input_path, output_path;
     int threads;
+    u_int32_t k_size;
+    ReadFilter filter = ReadFilter::from_args(argc, argv);
+    MemoryOptions memory = MemoryOptions::from_args(argc, argv);
 
     input_path = argv[1];
     output_path = argv[2];
@@ -202,18 +41,41 @@ int main(int argc, char **argv)
     cout << "K_SIZE " << k_size << endl;
     cout << "THREADS " << threads << endl;
 
-    compute_kmer_inds();
+    CompositionProfiler profiler(k_size);
 
-    cout << "Profile Size " << kmer_count_len << endl;
-    cout << "Total " << k_size << "-mers " << kmer_inds.size() << endl;
+    cout << "Profile Size " << profiler.size() << endl;
+    cout << "Total " << k_size << "-mers " << profiler.total_kmers() << endl;
 
-    ofstream output(output_path, ios::out);
+    // the profile writer throws when the output cannot be created or written
+    try
+    {
+        ToolMetrics metrics;
+        ProfileWriter output(output_path, profiler.size());
+        ReadPipeline reader(input_path, threads, filter, memory);
+        ReadBatch *batch;
 
-    thread iot(io_thread, ref(input_path));
-    thread process(off_load_process, ref(output_path), ref(threads));
+        while (reader.next(batch))
+        {
+            processLinesBatch(*batch, profiler, output, threads);
+            reader.release(batch);
+        }
 
-    iot.join();
-    process.join();
+        output.close();
+
+        if (reader.error())
+        {
+            cerr << "Error reading " << input_path << endl;
+            return 1;
+        }
+
+        metrics.add(reader.reads(), reader.bases());
+        metrics.write();
+    }
+    catch (const exception &e)
+    {
+        cerr << e.what() << endl;
+        return 1;
+    }
 
     return 0;
-}
\ No newline at end of file
+}
@@ -1,214 +1,141 @@
 #include <iostream>
+#include <algorithm>
+#include <memory>
 #include <omp.h>
 #include <fstream>
 #include <string>
 #include <vector>
-#include <thread>
-#include <queue>
-#include <mutex>
-#include <condition_variable>
-#include <atomic>
 #include "io_utils.h"
 #include "kmer_utils.h"
+#include "profile_utils.h"
+#include "composition_utils.h"
+#include "metrics_utils.h"
 
 using namespace std;
 
-queue<string> reads_queue;
-mutex mux;
-condition_variable condition;
-volatile bool terminate_threads;
-
-void process_batch_count_kmers(vector<string> &batch, vector<atomic<u_int32_t>> &all_kmers, int threads)
+void process_batch_line_vecs(ReadBatch &linesBatch, KmerTable &allKmers, ProfileWriter &output, CompositionProfiler *profiler, ProfileWriter *output_composition, int threads, long bin_size, int bins)
 {
-    vector<vector<u_int64_t>> batch_results(batch.size());
+    vector<float> batchAnswers(linesBatch.size() * bins);
+    vector<float> batchProfiles(profiler ? linesBatch.size() * profiler->size() : 0);
 
 #pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
-    for (size_t i = 0; i < batch.size(); i++)
+    for (size_t i = 0; i < linesBatch.size(); i++)
     {
-        line_to_kmer_counts(batch[i], all_kmers);
-    }
+        line_to_vec(linesBatch.seq(i), linesBatch.length(i), allKmers, bin_size, bins, batchAnswers.data() + i * bins);
 
-    batch_results.clear();
-}
+        // composition is computed while the read is hot in cache
+        if (profiler)
+        {
+            profiler->count_kmers(linesBatch.seq(i), linesBatch.length(i), batchProfiles.data() + i * profiler->size());
+        }
+    }
 
-void process_batch_line_vecs(vector<string> &linesBatch, vector<atomic<u_int32_t>> &allKmers, string &output_path, int threads, long bin_size, int bins)
-{
-    vector<double *> batchAnswers(linesBatch.size());
+    output.write_rows(batchAnswers.data(), linesBatch.size());
 
-#pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
-    for (uint i = 0; i < linesBatch.size(); i++)
+    if (output_composition)
     {
-        batchAnswers[i] = line_to_vec(linesBatch[i], allKmers, bin_size, bins);
+        output_composition->write_rows(batchProfiles.data(), linesBatch.size());
     }
+}
 
-    ofstream output;
-    output.open(output_path, ios::out | ios::app);
-    string results = "";
+int main(int argc, char **argv)
+{
+    ReadFilter filter = ReadFilter::from_args(argc, argv);
+    MemoryOptions memory = MemoryOptions::from_args(argc, argv);
+    u_int64_t slots = sketchSlotsFromArgs(argc, argv);
+    // both passes drop the same reads, the kept mask is written by the second
+    ReadFilter count_filter = filter;
+    count_filter.kept_path = "";
+
+    string input_path = argv[1];
+    string output_path_kmers = argv[2];
+    string output_path_vecs = argv[3];
+    int bin_size = stoi(argv[4]);
+    int bins = stoi(argv[5]);
+    int threads = stoi(argv[6]);
 
-    for (uint i = 0; i < linesBatch.size(); i++)
+    // a fraction of the 15-mers when sketched, the same ones are looked up for the profiles
+    // counted in the count file itself with the disk layout, the second pass reads it back through the page cache
+    // the count table and profile files throw when they cannot be created or written
+    try
     {
-        for (int j = 0; j < bins; j++)
-        {
-            results += to_string(batchAnswers[i][j]);
+        unique_ptr<KmerTable> kmers(memory.disk_counts ? new KmerTable(slots, output_path_kmers) : new KmerTable(slots));
 
-            if (j < bins - 1)
-            {
-                results += " ";
-            }
-        }
+        // reads and bases of the input, counted once although it is read twice
+        ToolMetrics metrics;
 
-        results += "\n";
+        // fused mode, composition profiles are computed in the second pass
+        unique_ptr<CompositionProfiler> profiler;
+        unique_ptr<ProfileWriter> output_composition;
 
-        // releasing pointer memory
-        delete[] batchAnswers[i];
-    }
+        cout << "INPUT FILE " << input_path << endl;
+        cout << "OUTPUT FILE " << output_path_kmers << endl;
+        cout << "THREADS " << threads << endl;
+        cout << "15-MER TABLE SIZE " << kmers->size() << (kmers->sketched() ? " (SKETCHED)" : "") << (memory.disk_counts ? " (ON DISK)" : "") << endl;
 
-    output << results;
-    batchAnswers.clear();
-    output.close();
-}
+        if (argc > 8)
+        {
+            profiler.reset(new CompositionProfiler(stoi(argv[7])));
+            output_composition.reset(new ProfileWriter(argv[8], profiler->size()));
 
-void off_load_process_kmer_counts(vector<atomic<u_int32_t>> &all_kmers, int &threads)
-{
-    string seq;
-    vector<string> batch;
+            cout << "K_SIZE " << argv[7] << endl;
+            cout << "COMPOSITION OUTPUT FILE " << argv[8] << endl;
+        }
 
-    while (true)
-    {
         {
-            unique_lock<mutex> lock(mux);
+            ShardedKmerCounter counter(*kmers, threads, memory.round_bases);
+            ReadPipeline reader(input_path, threads, count_filter, memory);
+            ReadBatch *batch;
 
-            while (reads_queue.size() > 0)
+            while (reader.next(batch))
             {
-                seq = reads_queue.front();
-                batch.push_back(seq);
-                reads_queue.pop();
-
-                if (batch.size() == 10000)
-                {
-                    break;
-                }
+                counter.count_batch(*batch);
+                reader.release(batch);
             }
-        }
-
-        condition.notify_all();
-
-        if (batch.size() > 0)
-        {
-            process_batch_count_kmers(batch, all_kmers, threads);
-            batch.clear();
-        }
 
-        {
-            unique_lock<mutex> lock(mux);
-            if (terminate_threads && reads_queue.size() == 0)
+            if (reader.error())
             {
-                break;
+                cerr << "Error reading " << input_path << endl;
+                return 1;
             }
+            metrics.add(reader.reads(), reader.bases());
         }
-    }
-}
 
-void off_load_process_line_vecs(string &output, vector<atomic<u_int32_t>> &all_kmers, int &threads, long bin_size, int bins)
-{
-    string seq;
-    vector<string> batch;
+        cout << "WRITING TO FILE" << endl;
+        writeKmerFile(output_path_kmers, *kmers);
+        cout << "COUNTING COMPLETED : Output at - " << output_path_kmers << endl;
 
-    while (true)
-    {
+        // second pass over the reads
         {
-            unique_lock<mutex> lock(mux);
+            ProfileWriter output(output_path_vecs, bins);
+            ReadPipeline reader(input_path, threads, filter, memory);
+            ReadBatch *batch;
 
-            while (reads_queue.size() > 0)
+            while (reader.next(batch))
             {
-                seq = reads_queue.front();
-                batch.push_back(seq);
-                reads_queue.pop();
-
-                if (batch.size() == 10000)
-                {
-                    break;
-                }
+                process_batch_line_vecs(*batch, *kmers, output, profiler.get(), output_composition.get(), threads, bin_size, bins);
+                reader.release(batch);
             }
-        }
-
-        condition.notify_all();
 
-        if (batch.size() > 0)
-        {
-            process_batch_line_vecs(batch, all_kmers, output, threads, bin_size, bins);
-            batch.clear();
-        }
-
-        {
-            unique_lock<mutex> lock(mux);
-            if (terminate_threads && reads_queue.size() == 0)
+            if (reader.error())
             {
-                break;
+                cerr << "Error reading " << input_path << endl;
+                return 1;
             }
         }
-    }
-}
-
-void io_thread(string &file_path)
-{
-    SeqReader reader(file_path);
-    Seq seq;
-    int count = 0;
 
-    while (reader.get_seq(seq))
-    {
+        if (output_composition)
         {
-            unique_lock<mutex> lock(mux);
-            condition.wait(lock, []
-                           { return reads_queue.size() < 50000; });
-            reads_queue.push(seq.data);
+            output_composition->close();
         }
-        count++;
-        cout << "Loaded Reads " << count << "       \r" << flush;
-    }
-
-    cout << endl;
-
-    terminate_threads = true;
-}
 
-int main(int argc, char **argv)
-{
-    vector<atomic<u_int32_t>> kmers(1073741824);
-
-    string input_path = argv[1];
-    string output_path_kmers = argv[2];
-    string output_path_vecs = argv[3];
-    int bin_size = stoi(argv[4]);
-    int bins = stoi(argv[5]);
-    int threads = stoi(argv[6]);
-
-    cout << "INPUT FILE " << input_path << endl;
-    cout << "OUTPUT FILE " << output_path_kmers << endl;
-    cout << "THREADS " << threads << endl;
-
-    {
-        thread iot(io_thread, ref(input_path));
-        thread process(off_load_process_kmer_counts, ref(kmers), ref(threads));
-
-        iot.join();
-        process.join();
+        metrics.write();
     }
-
-    cout << "WRITING TO FILE" << endl;
-    writeKmerFile(output_path_kmers, kmers);
-    cout << "COUNTING COMPLETED : Output at - " << output_path_kmers << endl;
-
+    catch (const exception &e)
     {
-        thread iot(io_thread, ref(input_path));
-        thread process(off_load_process_line_vecs, ref(output_path_vecs), ref(kmers), ref(threads), ref(bin_size), ref(bins));
-        
-        iot.join();
-        process.join();
+        cerr << e.what() << endl;
+        return 1;
     }
 
-    kmers.clear();
-
     return 0;
 }
@@ -0,0 +1,84 @@
+import logging
+import numpy as np
+from sklearn.manifold import TSNE
+from sklearn.decomposition import PCA
+
+# optional, FFT accelerated t-SNE
+try:
+    from openTSNE import TSNE as OpenTSNE
+except ImportError:
+    OpenTSNE = None
+
+logger = logging.getLogger('MetaBCC-LR')
+
+# optional PCA before t-SNE/UMAP: off, auto (profiles of k=6/7, 4^k/2 dims or more) or a component count
+PCA_MODES = ["off", "auto"]
+PCA_AUTO_DIMS = 2080
+PCA_COMPONENTS = 50
+# t-SNE switches to FFT interpolation (openTSNE) from this many rows
+FFT_MIN_ROWS = 10000
+
+
+def pca_components(pca, rows, dims):
+    # components of the PCA step, 0 when it is skipped
+    if pca == "off":
+        return 0
+    components = PCA_COMPONENTS if pca == "auto" else int(pca)
+
+    if pca == "auto" and dims < PCA_AUTO_DIMS:
+        return 0
+    # nothing to reduce, or too few rows to fit the components
+    if components >= dims or components >= rows:
+        return 0
+
+    return components
+
+
+def plan(method, rows, dims, pca="off"):
+    """
+    Settings used to embed a rows x dims matrix, also part of the embedding cache key.
+    """
+    components = pca_components(pca, rows, dims) if method != 'song' else 0
+
+    if method == 'tsne':
+        if OpenTSNE is not None and rows >= FFT_MIN_ROWS:
+            algorithm = 'fft'
+        else:
+            algorithm = 'barnes_hut'
+    elif method == 'umap':
+        algorithm = 'nndescent'
+    else:
+        algorithm = 'song'
+
+    return method, algorithm, components
+
+
+def describe(settings):
+    method, algorithm, pca = settings
+    return f"{method}-{algorithm}-pca{pca}"
+
+
+def embed(data, method, threads=1, settings=None):
+    rows, dims = data.shape
+    settings = settings or plan(method, rows, dims)
+    method, algorithm, pca = settings
+
+    logger.info(f"Embedding {rows} x {dims} with {method} ({algorithm}, PCA {pca if pca else 'off'}, threads {threads})")
+
+    if pca:
+        data = PCA(n_components=pca).fit_transform(data)
+
+    # umap and song take several seconds to import, only loaded when used
+    if method == 'song':
+        from song.song import SONG
+        return SONG().fit_transform(data)
+    if method == 'umap':
+        import umap
+        import numba
+        # numba refuses more threads than it was started with
+        return umap.UMAP(n_jobs=min(threads, numba.config.NUMBA_NUM_THREADS), force_approximation_algorithm=True).fit_transform(data)
+    if algorithm == 'fft':
+        # same seeding source as sklearn when random_state is None
+        return np.asarray(OpenTSNE(n_components=2, initialization='pca', negative_gradient_method='fft',
+                                   n_jobs=threads, random_state=np.random.randint(2 ** 31)).fit(data))
+    return TSNE(n_components=2, init='pca', n_jobs=threads).fit_transform(data)
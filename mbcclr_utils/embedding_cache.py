@@ -0,0 +1,92 @@
+import hashlib
+import os
+import logging
+import numpy as np
+
+logger = logging.getLogger('MetaBCC-LR')
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 22), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def random_state_digest():
+    # unseeded runs never hit the cache as the state differs every run
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    h = hashlib.sha1(keys.tobytes())
+    h.update(f"{pos} {has_gauss} {cached_gaussian}".encode())
+
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings stored as .npy files under output/cache/embeddings, named by the hash of
+    method, profile, profile content, numpy random state and cluster membership (in order).
+    Least recently used files are evicted once the directory exceeds max_size bytes.
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, method, profile, digest, reads):
+        h = hashlib.sha1(f"{method} {profile} {digest} {random_state_digest()}".encode())
+        h.update(np.ascontiguousarray(reads, dtype=np.int64).tobytes())
+
+        return h.hexdigest()
+
+    def get(self, key):
+        path = f"{self.path}/{key}.npy"
+
+        try:
+            embedded = np.load(path)
+        except (OSError, ValueError):
+            return None
+
+        # mtime tracks the last use for eviction
+        os.utime(path)
+        return embedded
+
+    def put(self, key, embedded):
+        path = f"{self.path}/{key}.npy"
+        # unique temporary name, pool workers may write at the same time
+        tmp = f"{self.path}/{key}.{os.getpid()}.tmp"
+
+        with open(tmp, "wb") as f:
+            np.save(f, embedded)
+        os.replace(tmp, path)
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+
+        for name in os.listdir(self.path):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                st = os.stat(f"{self.path}/{name}")
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(f"{self.path}/{name}")
+                logger.debug(f"Evicted cached embedding {name}")
+            except OSError:
+                pass
+            total -= size
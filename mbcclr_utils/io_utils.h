@@ -2,18 +2,359 @@
 #include <iostream>
 #include <fstream>
 #include <string>
+#include <vector>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <chrono>
+#include <stdexcept>
+#include <cstdio>
+#include <cstring>
 #include <zlib.h>
+#include <unistd.h>
+#include <omp.h>
 #include "kseq.h"
-
-KSEQ_INIT(gzFile, gzread)
+#include "memory_utils.h"
 
 using namespace std;
 
+// fixed capacity ring buffer shared by a producer and a consumer
+template <typename T>
+class BoundedQueue
+{
+private:
+    vector<T> ring;
+    size_t head = 0, count = 0;
+    bool closed = false;
+    mutex mux;
+    condition_variable not_empty, not_full;
+
+public:
+    BoundedQueue(size_t capacity) : ring(capacity) {}
+
+    void push(T item)
+    {
+        unique_lock<mutex> lock(mux);
+        not_full.wait(lock, [this] { return count < ring.size(); });
+        ring[(head + count) % ring.size()] = item;
+        count++;
+        not_empty.notify_one();
+    }
+
+    // false once the queue is closed and drained
+    bool pop(T &item)
+    {
+        unique_lock<mutex> lock(mux);
+        not_empty.wait(lock, [this] { return count > 0 || closed; });
+
+        if (count == 0)
+        {
+            return false;
+        }
+
+        item = ring[head];
+        head = (head + 1) % ring.size();
+        count--;
+        not_full.notify_one();
+
+        return true;
+    }
+
+    void close()
+    {
+        unique_lock<mutex> lock(mux);
+        closed = true;
+        not_empty.notify_all();
+    }
+};
+
+// decompressed bytes of the input
+class Chunk
+{
+public:
+    vector<char> data;
+    size_t size = 0;
+};
+
+// Decompresses the input on background threads and hands out the plain text
+// in order. BGZF files (bgzip) are inflated block-parallel, everything else
+// (plain text, gzip) goes through zlib on a single dedicated thread.
+// The path "-" reads stdin, which cannot be rewound and always goes through zlib.
+class ChunkStream
+{
+private:
+    FILE *file;
+    gzFile gz = nullptr;
+    int threads;
+    size_t chunk_size;
+    vector<Chunk> chunks;
+    BoundedQueue<Chunk *> filled, empty;
+    Chunk *current = nullptr;
+    size_t pos = 0;
+    bool failed = false;
+    thread producer;
+
+    static bool is_bgzf(const unsigned char *h)
+    {
+        // gzip magic, deflate, FEXTRA set, BC subfield first
+        return h[0] == 31 && h[1] == 139 && h[2] == 8 && (h[3] & 4) && h[12] == 'B' && h[13] == 'C';
+    }
+
+    void produce_gz()
+    {
+        Chunk *chunk;
+        int read;
+
+        while (empty.pop(chunk))
+        {
+            read = gzread(gz, chunk->data.data(), chunk_size);
+
+            if (read <= 0)
+            {
+                int err;
+                // truncated input is only reported through gzerror
+                gzerror(gz, &err);
+                failed = read < 0 || err != Z_OK;
+                empty.push(chunk);
+                break;
+            }
+            chunk->size = read;
+            filled.push(chunk);
+        }
+        filled.close();
+    }
+
+    // reads one BGZF block, returns false at the end of the file
+    bool read_block(vector<unsigned char> &block)
+    {
+        unsigned char header[12];
+        u_int16_t xlen, bsize = 0, slen;
+        size_t offset = 0;
+
+        if (fread(header, 1, 12, file) != 12)
+        {
+            return false;
+        }
+
+        xlen = header[10] | header[11] << 8;
+        block.resize(12 + xlen);
+        memcpy(block.data(), header, 12);
+
+        if (fread(block.data() + 12, 1, xlen, file) != xlen)
+        {
+            throw runtime_error("Truncated BGZF block");
+        }
+
+        // find the BC subfield carrying the block size
+        while (offset + 4 <= xlen)
+        {
+            slen = block[12 + offset + 2] | block[12 + offset + 3] << 8;
+
+            if (block[12 + offset] == 'B' && block[12 + offset + 1] == 'C')
+            {
+                bsize = block[12 + offset + 4] | block[12 + offset + 5] << 8;
+            }
+            offset += 4 + slen;
+        }
+
+        block.resize(bsize + 1);
+
+        if (fread(block.data() + 12 + xlen, 1, bsize + 1 - 12 - xlen, file) != (size_t)(bsize + 1 - 12 - xlen))
+        {
+            throw runtime_error("Truncated BGZF block");
+        }
+
+        return true;
+    }
+
+    static void inflate_block(vector<unsigned char> &block, char *out, size_t out_size)
+    {
+        u_int16_t xlen = block[10] | block[11] << 8;
+        size_t cdata = 12 + xlen;
+        z_stream zs;
+
+        memset(&zs, 0, sizeof(zs));
+        inflateInit2(&zs, -15);
+        zs.next_in = block.data() + cdata;
+        zs.avail_in = block.size() - cdata - 8;
+        zs.next_out = (Bytef *)out;
+        zs.avail_out = out_size;
+
+        int ret = inflate(&zs, Z_FINISH);
+        inflateEnd(&zs);
+
+        if (ret != Z_STREAM_END)
+        {
+            throw runtime_error("Corrupted BGZF block");
+        }
+    }
+
+    void produce_bgzf()
+    {
+        // a chunk is filled with a group of blocks inflated in parallel
+        // at least one block, streaming readers use chunks smaller than a block
+        size_t group = max(chunk_size / 65536, (size_t)1);
+        vector<vector<unsigned char>> blocks(group);
+        vector<size_t> offsets(group + 1);
+        Chunk *chunk;
+        size_t count;
+        bool eof = false;
+
+        try
+        {
+            while (!eof && empty.pop(chunk))
+            {
+                for (count = 0; count < group; count++)
+                {
+                    if (!read_block(blocks[count]))
+                    {
+                        eof = true;
+                        break;
+                    }
+                    vector<unsigned char> &block = blocks[count];
+                    size_t n = block.size();
+                    // ISIZE, uncompressed length
+                    offsets[count + 1] = offsets[count] + (block[n - 4] | block[n - 3] << 8 | block[n - 2] << 16 | (size_t)block[n - 1] << 24);
+                }
+
+                if (chunk->data.size() < offsets[count])
+                {
+                    chunk->data.resize(offsets[count]);
+                }
+
+#pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
+                for (size_t i = 0; i < count; i++)
+                {
+                    inflate_block(blocks[i], chunk->data.data() + offsets[i], offsets[i + 1] - offsets[i]);
+                }
+
+                chunk->size = offsets[count];
+
+                if (chunk->size > 0)
+                {
+                    filled.push(chunk);
+                }
+                else
+                {
+                    empty.push(chunk);
+                }
+            }
+        }
+        catch (exception &e)
+        {
+            cerr << e.what() << endl;
+            failed = true;
+        }
+        filled.close();
+    }
+
+public:
+    ChunkStream(string path, int threads = 1, size_t chunk_size = 1 << 22, size_t depth = 4) : filled(depth), empty(depth)
+    {
+        unsigned char header[14];
+
+        this->threads = max(1, threads);
+        this->chunk_size = chunk_size;
+
+        file = path == "-" ? fdopen(dup(STDIN_FILENO), "rb") : fopen(path.c_str(), "rb");
+
+        if (file == nullptr)
+        {
+            throw runtime_error("Unable to open reads file " + path);
+        }
+
+        chunks.resize(depth);
+
+        for (Chunk &chunk : chunks)
+        {
+            chunk.data.resize(chunk_size);
+            empty.push(&chunk);
+        }
+
+        if (path != "-" && fread(header, 1, 14, file) == 14 && is_bgzf(header))
+        {
+            rewind(file);
+            producer = thread(&ChunkStream::produce_bgzf, this);
+        }
+        else
+        {
+            if (path != "-")
+            {
+                rewind(file);
+            }
+            gz = gzdopen(dup(fileno(file)), "rb");
+            // zlib blocks until its buffer is full, kept no larger than a chunk
+            gzbuffer(gz, min(chunk_size, (size_t)1 << 20));
+            producer = thread(&ChunkStream::produce_gz, this);
+        }
+    }
+
+    ~ChunkStream()
+    {
+        // let the producer finish if the consumer stopped early
+        Chunk *chunk;
+
+        while (filled.pop(chunk))
+        {
+            empty.push(chunk);
+        }
+        producer.join();
+
+        if (gz)
+        {
+            gzclose(gz);
+        }
+        fclose(file);
+    }
+
+    bool error()
+    {
+        return failed;
+    }
+
+    // copies up to len bytes into buf, 0 at the end of the input
+    int read(void *buf, int len)
+    {
+        size_t n;
+
+        while (current == nullptr || pos == current->size)
+        {
+            if (current)
+            {
+                empty.push(current);
+                current = nullptr;
+            }
+            if (!filled.pop(current))
+            {
+                current = nullptr;
+                return 0;
+            }
+            pos = 0;
+        }
+
+        n = min((size_t)len, current->size - pos);
+        memcpy(buf, current->data.data() + pos, n);
+        pos += n;
+
+        return n;
+    }
+};
+
+inline int chunk_stream_read(ChunkStream *stream, void *buf, int len)
+{
+    return stream->read(buf, len);
+}
+
+KSEQ_INIT(ChunkStream *, chunk_stream_read)
+
 class Seq
 {
 public:
     string id;
+    string comment;
     string data;
+    // empty for FASTA records
+    string qual;
 };
 
 // class SeqReader
@@ -130,36 +471,408 @@ public:
 //     }
 // };
 
+// input paths are comma separated, "-" is stdin
+inline vector<string> split_paths(string paths)
+{
+    vector<string> result;
+    size_t start = 0, end;
+
+    while ((end = paths.find(',', start)) != string::npos)
+    {
+        result.push_back(paths.substr(start, end - start));
+        start = end + 1;
+    }
+    result.push_back(paths.substr(start));
+
+    return result;
+}
+
+// reads of one or more files, one after the other
 class SeqReader
 {
 private:
-    gzFile fp;
-    kseq_t *ks;
-    int ret;
+    vector<string> paths;
+    size_t next_path = 0;
+    int threads;
+    ChunkStream *stream = nullptr;
+    kseq_t *ks = nullptr;
+    int ret = 0;
+    bool failed = false;
+
+    void close()
+    {
+        if (stream)
+        {
+            failed = failed || ret < -1 || stream->error();
+            kseq_destroy(ks);
+            delete stream;
+            stream = nullptr;
+        }
+    }
 
 public:
-    SeqReader(string path)
+    SeqReader(string path, int threads = 1)
     {
-        fp = gzopen(path.c_str(), "r");
-        ks = kseq_init(fp);
+        this->paths = split_paths(path);
+        this->threads = threads;
     }
 
     ~SeqReader()
     {
-        kseq_destroy(ks);
-        gzclose(fp);
+        close();
     }
 
     bool get_seq(Seq &seq)
     {
-        if ((ret = kseq_read(ks)) >= 0)
+        while (!failed)
         {
-            // using raw pointers can have unwated side effects
-            // better to copy than debug
-            seq.data = string(ks->seq.s);
-            seq.id = string(ks->name.s);
-            return true;
+            if (stream == nullptr)
+            {
+                if (next_path == paths.size())
+                {
+                    return false;
+                }
+                stream = new ChunkStream(paths[next_path++], threads);
+                ks = kseq_init(stream);
+            }
+
+            if ((ret = kseq_read(ks)) >= 0)
+            {
+                // using raw pointers can have unwated side effects
+                // better to copy than debug (assign reuses the buffers of seq)
+                seq.data.assign(ks->seq.s, ks->seq.l);
+                seq.id.assign(ks->name.s, ks->name.l);
+                // comment and quality buffers are only allocated once seen
+                seq.comment.assign(ks->comment.l ? ks->comment.s : "", ks->comment.l);
+                seq.qual.assign(ks->qual.l ? ks->qual.s : "", ks->qual.l);
+                return true;
+            }
+            close();
         }
         return false;
     }
-};
\ No newline at end of file
+
+    // only meaningful once get_seq returned false
+    bool error()
+    {
+        return failed;
+    }
+};
+
+// Reads dropped or trimmed while parsing, so that no stage spends time on them.
+// Reads shorter than min_length or with more than max_n_fraction of bases other
+// than ACGT are dropped, longer reads are cut to their first max_bases bases.
+class ReadFilter
+{
+public:
+    u_int64_t min_length = 0;
+    double max_n_fraction = 1.0;
+    u_int64_t max_bases = 0;
+    // one byte per input read (1 kept, 0 dropped), written when set
+    string kept_path;
+    // dropped reads stay in their batch as empty reads, for consumers writing one line per input read
+    bool placeholders = false;
+
+    bool active() const
+    {
+        return min_length > 0 || max_n_fraction < 1.0 || max_bases > 0;
+    }
+
+    // bases of the read to keep, 0 drops it
+    size_t keep(const char *seq, size_t length) const
+    {
+        if (length < min_length || length == 0)
+        {
+            return 0;
+        }
+
+        if (max_n_fraction < 1.0)
+        {
+            size_t other = 0;
+
+            for (size_t i = 0; i < length; i++)
+            {
+                other += !(seq[i] == 'A' || seq[i] == 'C' || seq[i] == 'G' || seq[i] == 'T');
+            }
+
+            if (other > max_n_fraction * length)
+            {
+                return 0;
+            }
+        }
+
+        return max_bases > 0 ? min(length, (size_t)max_bases) : length;
+    }
+
+    // takes --min-length, --max-n-fraction, --max-bases and --kept out of argv
+    // so that the positional arguments of a tool stay where they were
+    static ReadFilter from_args(int &argc, char **argv)
+    {
+        ReadFilter filter;
+        int kept = 1;
+
+        for (int i = 1; i < argc; i++)
+        {
+            string arg = argv[i];
+
+            if (i + 1 < argc && arg == "--min-length")
+            {
+                filter.min_length = stoull(argv[++i]);
+            }
+            else if (i + 1 < argc && arg == "--max-n-fraction")
+            {
+                filter.max_n_fraction = stod(argv[++i]);
+            }
+            else if (i + 1 < argc && arg == "--max-bases")
+            {
+                filter.max_bases = stoull(argv[++i]);
+            }
+            else if (i + 1 < argc && arg == "--kept")
+            {
+                filter.kept_path = argv[++i];
+            }
+            else
+            {
+                argv[kept++] = argv[i];
+            }
+        }
+        argc = kept;
+
+        return filter;
+    }
+};
+
+// Reads stored back to back in one arena, batches are recycled so the
+// buffers are allocated once and reused for the whole input
+class ReadBatch
+{
+public:
+    vector<char> arena;
+    vector<u_int64_t> offsets = {0};
+
+    size_t size()
+    {
+        return offsets.size() - 1;
+    }
+
+    u_int64_t bases()
+    {
+        return offsets.back();
+    }
+
+    const char *seq(size_t i)
+    {
+        return arena.data() + offsets[i];
+    }
+
+    size_t length(size_t i)
+    {
+        return offsets[i + 1] - offsets[i];
+    }
+
+    void add(const char *seq, size_t length)
+    {
+        u_int64_t end = offsets.back() + length;
+
+        if (arena.size() < end)
+        {
+            arena.resize(max((size_t)end, arena.size() * 2));
+        }
+        memcpy(arena.data() + offsets.back(), seq, length);
+        offsets.push_back(end);
+    }
+
+    void clear()
+    {
+        offsets.resize(1);
+    }
+};
+
+// Parses reads on a background thread into batches holding about
+// batch_bases bases each. At most depth batches are in flight.
+// Input is decompressed chunk_size bytes at a time, streaming consumers
+// use small batches and chunks so that reads are handed out as they arrive.
+// Several comma separated files are read one after the other, reads are
+// filtered while parsing (see ReadFilter).
+//
+//     ReadPipeline reader(path, threads);
+//     ReadBatch *batch;
+//     while (reader.next(batch))
+//     {
+//         ...
+//         reader.release(batch);
+//     }
+class ReadPipeline
+{
+private:
+    static constexpr chrono::seconds PROGRESS_INTERVAL{2};
+
+    vector<string> paths;
+    int threads;
+    size_t chunk_size;
+    ReadFilter filter;
+    u_int64_t batch_bases;
+    vector<ReadBatch> batches;
+    BoundedQueue<ReadBatch *> filled, empty;
+    u_int64_t total_reads = 0, total_bases = 0, total_dropped = 0;
+    bool failed = false;
+    thread parser;
+
+    void parse()
+    {
+        ReadBatch *batch = nullptr;
+        auto last_report = chrono::steady_clock::now();
+        ofstream kept;
+        size_t length;
+        bool keep;
+        int ret;
+
+        if (!filter.kept_path.empty())
+        {
+            kept.open(filter.kept_path, ios::out | ios::binary | ios::trunc);
+            failed = !kept;
+        }
+
+        for (size_t p = 0; p < paths.size() && !failed; p++)
+        {
+            try
+            {
+                ChunkStream stream(paths[p], threads, chunk_size);
+                kseq_t *ks = kseq_init(&stream);
+
+                while ((ret = kseq_read(ks)) >= 0)
+                {
+                    length = filter.active() ? filter.keep(ks->seq.s, ks->seq.l) : ks->seq.l;
+                    keep = !filter.active() || length > 0;
+
+                    if (kept.is_open())
+                    {
+                        kept.put(keep);
+                    }
+
+                    if (!keep)
+                    {
+                        total_dropped++;
+
+                        if (!filter.placeholders)
+                        {
+                            continue;
+                        }
+                    }
+
+                    if (batch == nullptr)
+                    {
+                        empty.pop(batch);
+                        batch->clear();
+                    }
+
+                    batch->add(ks->seq.s, length);
+                    total_reads += keep;
+                    total_bases += length;
+
+                    if (batch->bases() >= batch_bases)
+                    {
+                        filled.push(batch);
+                        batch = nullptr;
+
+                        // progress at most once per PROGRESS_INTERVAL
+                        if (chrono::steady_clock::now() - last_report >= PROGRESS_INTERVAL)
+                        {
+                            last_report = chrono::steady_clock::now();
+                            cout << "Loaded Reads " << total_reads << "       \r" << flush;
+                        }
+                    }
+                }
+
+                failed = ret < -1 || stream.error();
+                kseq_destroy(ks);
+            }
+            catch (exception &e)
+            {
+                cerr << e.what() << endl;
+                failed = true;
+            }
+        }
+
+        if (batch != nullptr)
+        {
+            filled.push(batch);
+        }
+
+        cout << "Loaded Reads " << total_reads;
+        if (filter.active())
+        {
+            cout << " (dropped " << total_dropped << ")";
+        }
+        cout << endl;
+
+        kept.close();
+        filled.close();
+    }
+
+public:
+    ReadPipeline(string path, int threads = 1, u_int64_t batch_bases = 1 << 25, size_t depth = 4, size_t chunk_size = 1 << 22, ReadFilter filter = ReadFilter()) : filled(depth), empty(depth)
+    {
+        this->paths = split_paths(path);
+        this->threads = threads;
+        this->chunk_size = chunk_size;
+        this->filter = filter;
+        this->batch_bases = batch_bases;
+        batches.resize(depth);
+
+        for (ReadBatch &batch : batches)
+        {
+            empty.push(&batch);
+        }
+
+        parser = thread(&ReadPipeline::parse, this);
+    }
+
+    // batch sizes of the memory options (see MemoryOptions)
+    ReadPipeline(string path, int threads, ReadFilter filter, MemoryOptions memory = MemoryOptions()) : ReadPipeline(path, threads, memory.batch_bases, memory.queue_depth, 1 << 22, filter) {}
+
+    ~ReadPipeline()
+    {
+        ReadBatch *batch;
+
+        while (filled.pop(batch))
+        {
+            empty.push(batch);
+        }
+        parser.join();
+    }
+
+    // blocks until the next batch is parsed, false at the end of the input
+    bool next(ReadBatch *&batch)
+    {
+        return filled.pop(batch);
+    }
+
+    // hands the batch back for reuse
+    void release(ReadBatch *batch)
+    {
+        empty.push(batch);
+    }
+
+    // only meaningful once next() returned false
+    bool error()
+    {
+        return failed;
+    }
+
+    u_int64_t reads()
+    {
+        return total_reads;
+    }
+
+    u_int64_t bases()
+    {
+        return total_bases;
+    }
+
+    // reads removed by the filter
+    u_int64_t dropped()
+    {
+        return total_dropped;
+    }
+};
@@ -1,12 +1,55 @@
 #pragma once
 #include <iostream>
 #include <vector>
+#include <algorithm>
 #include <atomic>
 #include <fstream>
 #include <string>
+#include <omp.h>
+#include <cstdlib>
+#include <cstring>
+#include <stdexcept>
+#include "mmap_utils.h"
+#include "io_utils.h"
 
 using namespace std;
 
+// 15-mers are counted on canonical form. Since k is odd the middle base of a
+// k-mer and its reverse complement always differ in the high bit (A/C vs G/T),
+// picking the orientation with A/C in the middle and dropping that bit gives a
+// dense index over 4^15 / 2 canonical k-mers.
+const u_int64_t KMER_MASK = 1073741823;
+const u_int64_t KMER_TABLE_SIZE = 536870912;
+const u_int64_t KMER_MIDDLE_BIT = 1 << 15;
+
+// Sketched tables (FracMinHash) keep the k-mers whose hash falls below a fraction
+// of the hash range. The hash is a permutation of the canonical index, so a kept
+// k-mer is counted at its hash and the table shrinks to the kept fraction.
+// Counting and lookups share the table and therefore the same sample of k-mers.
+
+// counts saturate, line_to_vec never needs more than bin_size * bins
+typedef u_int16_t kmer_count_t;
+const kmer_count_t KMER_COUNT_MAX = 65535;
+
+// count file layout (little endian)
+//   magic[8]   "MBCCKMER"
+//   version    u_int32_t
+//   k_size     u_int32_t
+//   size       u_int64_t (number of counters, fewer than the full table when sketched)
+//   width      u_int64_t (bytes per counter)
+//   counts     kmer_count_t[size]
+const char KMER_FILE_MAGIC[8] = {'M', 'B', 'C', 'C', 'K', 'M', 'E', 'R'};
+const u_int32_t KMER_FILE_VERSION = 1;
+
+struct KmerFileHeader
+{
+    char magic[8];
+    u_int32_t version;
+    u_int32_t k_size;
+    u_int64_t size;
+    u_int64_t width;
+};
+
 inline u_int64_t revComp(u_int64_t x, size_t sizeKmer = 15)
 {
     u_int64_t res = x;
@@ -21,11 +64,245 @@ inline u_int64_t revComp(u_int64_t x, size_t sizeKmer = 15)
     return (res >> (2 * (32 - sizeKmer)));
 }
 
-inline double *line_to_vec(string &line, vector<atomic<u_int32_t>> &allKmers, long bin_size, int bins)
+inline u_int64_t canonicalIndex(u_int64_t kmer)
+{
+    if (kmer & KMER_MIDDLE_BIT)
+    {
+        kmer = revComp(kmer);
+    }
+
+    return ((kmer >> 16) << 15) | (kmer & (KMER_MIDDLE_BIT - 1));
+}
+
+// invertible mix of a canonical index, odd multipliers and xor shifts modulo the table size
+inline u_int64_t sketchHash(u_int64_t index)
+{
+    const u_int64_t mask = KMER_TABLE_SIZE - 1;
+
+    index = (index * 0x9E3779B1) & mask;
+    index ^= index >> 15;
+    index = (index * 0x85EBCA77) & mask;
+    index ^= index >> 13;
+    index = (index * 0xC2B2AE3D) & mask;
+    index ^= index >> 16;
+
+    return index;
+}
+
+// counters of a table keeping this fraction of the 15-mers
+inline u_int64_t sketchSlots(double fraction)
+{
+    if (!(fraction > 0 && fraction <= 1))
+    {
+        throw runtime_error("Sketch fraction must be within (0, 1]");
+    }
+
+    return max((u_int64_t)(fraction * KMER_TABLE_SIZE), (u_int64_t)1);
+}
+
+// strips --sketch-fraction from argv, counters of the table to count into
+inline u_int64_t sketchSlotsFromArgs(int &argc, char **argv)
+{
+    u_int64_t slots = KMER_TABLE_SIZE;
+    int kept = 1;
+
+    for (int i = 1; i < argc; i++)
+    {
+        string arg = argv[i];
+
+        if (i + 1 < argc && arg == "--sketch-fraction")
+        {
+            slots = sketchSlots(stod(argv[++i]));
+        }
+        else
+        {
+            argv[kept++] = argv[i];
+        }
+    }
+    argc = kept;
+
+    return slots;
+}
+
+class KmerTable
+{
+private:
+    kmer_count_t *counts;
+    u_int64_t slots;
+    MappedFile *mapped = nullptr;
+    // count file the table is counted in (disk layout)
+    string backing_path;
+
+public:
+    // slots below KMER_TABLE_SIZE give a sketched table, see sketchSlots
+    KmerTable(u_int64_t slots = KMER_TABLE_SIZE) : slots(slots)
+    {
+        if (slots == 0 || slots > KMER_TABLE_SIZE)
+        {
+            throw runtime_error("Invalid 15-mer table size");
+        }
+
+        // calloc hands out zeroed pages lazily, untouched k-mers cost nothing
+        counts = (kmer_count_t *)calloc(slots, sizeof(kmer_count_t));
+
+        if (counts == nullptr)
+        {
+            throw runtime_error("Unable to allocate the 15-mer count table");
+        }
+    }
+
+    // counted in place in a new count file at path instead of anonymous memory
+    // writeKmerFile to the same path only flushes it
+    KmerTable(u_int64_t slots, string path) : slots(slots), backing_path(path)
+    {
+        KmerFileHeader *header;
+
+        if (slots == 0 || slots > KMER_TABLE_SIZE)
+        {
+            throw runtime_error("Invalid 15-mer table size");
+        }
+
+        mapped = new MappedFile(path, sizeof(KmerFileHeader) + slots * sizeof(kmer_count_t));
+        header = (KmerFileHeader *)mapped->writable_data();
+
+        memcpy(header->magic, KMER_FILE_MAGIC, sizeof(KMER_FILE_MAGIC));
+        header->version = KMER_FILE_VERSION;
+        header->k_size = 15;
+        header->size = slots;
+        header->width = sizeof(kmer_count_t);
+
+        counts = (kmer_count_t *)(mapped->writable_data() + sizeof(KmerFileHeader));
+    }
+
+    // read only view of a count file written by writeKmerFile
+    // concurrent processes mapping the same file share one page cache copy
+    KmerTable(string filename, string advice = "willneed")
+    {
+        const KmerFileHeader *header;
+
+        mapped = new MappedFile(filename, advice);
+        header = (const KmerFileHeader *)mapped->data();
+
+        if (mapped->size() < sizeof(KmerFileHeader) || memcmp(header->magic, KMER_FILE_MAGIC, sizeof(KMER_FILE_MAGIC)) != 0)
+        {
+            delete mapped;
+            throw runtime_error("Not a 15-mer count file " + filename);
+        }
+
+        if (header->version != KMER_FILE_VERSION || header->size == 0 || header->size > KMER_TABLE_SIZE || header->width != sizeof(kmer_count_t) || mapped->size() < sizeof(KmerFileHeader) + header->size * sizeof(kmer_count_t))
+        {
+            delete mapped;
+            throw runtime_error("Incompatible 15-mer count file " + filename);
+        }
+
+        // a sketched file is looked up with the sketch it was counted with
+        slots = header->size;
+        counts = (kmer_count_t *)(mapped->data() + sizeof(KmerFileHeader));
+    }
+
+    ~KmerTable()
+    {
+        if (mapped)
+        {
+            delete mapped;
+        }
+        else
+        {
+            free(counts);
+        }
+    }
+
+    KmerTable(const KmerTable &) = delete;
+    KmerTable &operator=(const KmerTable &) = delete;
+
+    u_int64_t size()
+    {
+        return slots;
+    }
+
+    bool sketched()
+    {
+        return slots < KMER_TABLE_SIZE;
+    }
+
+    // count file the table lives in, empty for tables in memory or mapped read only
+    string backing()
+    {
+        return backing_path;
+    }
+
+    bool sync()
+    {
+        return mapped == nullptr || mapped->sync();
+    }
+
+    // counter of a canonical index, false if the k-mer is not in the sketch
+    inline bool slot(u_int64_t index, u_int64_t &counter)
+    {
+        if (slots == KMER_TABLE_SIZE)
+        {
+            counter = index;
+            return true;
+        }
+        counter = sketchHash(index);
+
+        return counter < slots;
+    }
+
+    kmer_count_t *data()
+    {
+        return counts;
+    }
+
+    // saturating increment, safe to call from many threads
+    // not available on tables mapped read only from a file
+    inline void add(u_int64_t kmer)
+    {
+        u_int64_t index;
+
+        if (!slot(canonicalIndex(kmer), index))
+        {
+            return;
+        }
+
+        kmer_count_t *counter = counts + index;
+        kmer_count_t oval = __atomic_load_n(counter, __ATOMIC_RELAXED);
+
+        // CAS
+        while (oval < KMER_COUNT_MAX && !__atomic_compare_exchange_n(counter, &oval, oval + 1, true, __ATOMIC_RELAXED, __ATOMIC_RELAXED))
+        {
+        };
+    }
+
+    // saturating increment of a counter (see slot)
+    // the caller must be the only writer of this counter
+    inline void increment(u_int64_t index)
+    {
+        counts[index] += counts[index] < KMER_COUNT_MAX;
+    }
+
+    // count of a k-mer, false if the k-mer is not in the sketch
+    inline bool get(u_int64_t kmer, kmer_count_t &count)
+    {
+        u_int64_t index;
+
+        if (!slot(canonicalIndex(kmer), index))
+        {
+            return false;
+        }
+        count = counts[index];
+
+        return true;
+    }
+};
+
+// coverage histogram of a read, written to counts[0, bins)
+// over the k-mers of the sketch when the table is sketched
+inline void line_to_vec(const char *line, size_t length, KmerTable &allKmers, long bin_size, int bins, float *counts)
 {
-    double *counts = new double[bins];
     long sum = 0, count, pos, len = 0;
     u_int64_t val = 0;
+    kmer_count_t kmer_count;
 
     // to avoid garbage memory
     for (int i = 0; i < bins; i++)
@@ -33,7 +310,7 @@ inline double *line_to_vec(string &line, vector<atomic<u_int32_t>> &allKmers, lo
         counts[i] = 0;
     }
 
-    for (size_t i = 0; i < line.length(); i++)
+    for (size_t i = 0; i < length; i++)
     {
         if (!(line[i] == 'A' || line[i] == 'C' || line[i] == 'G' || line[i] == 'T'))
         {
@@ -43,7 +320,7 @@ inline double *line_to_vec(string &line, vector<atomic<u_int32_t>> &allKmers, lo
         }
 
         val = (val << 2);
-        val = val & 1073741823;
+        val = val & KMER_MASK;
         val += (line[i] >> 1 & 3);
         len++;
 
@@ -51,8 +328,11 @@ inline double *line_to_vec(string &line, vector<atomic<u_int32_t>> &allKmers, lo
         {
             // use val as the kmer for counting
             len--;
-            count = allKmers[(long)val];
-            count = count < 2 ? 0: count;
+            if (!allKmers.get(val, kmer_count))
+            {
+                continue;
+            }
+            count = kmer_count < 2 ? 0: kmer_count;
             pos = (count / bin_size) - 1;
 
             if (count <= bin_size)
@@ -75,49 +355,79 @@ inline double *line_to_vec(string &line, vector<atomic<u_int32_t>> &allKmers, lo
     {
         for (int i = 0; i < bins; i++)
         {
-            counts[i] /= sum;
-            if (counts[i] < 1e-4)
-            {
-                counts[i] = 0;
-            }
+            double fraction = (double)counts[i] / sum;
+            counts[i] = fraction < 1e-4 ? 0 : fraction;
         }
     }
-
-    return counts;
 }
 
-inline void writeKmerFile(string filename, vector<atomic<u_int32_t>> &kmers)
+inline void writeKmerFile(string filename, KmerTable &kmers)
 {
     ofstream output;
-    output.open(filename, ios::out);
-    u_int64_t size = kmers.size();
-    output.write(reinterpret_cast<char const*>(&size), sizeof(size));
-    output.write(reinterpret_cast<char const*>(kmers.data()), kmers.size() * sizeof(kmers[0]));
+    KmerFileHeader header;
+
+    // counted in place (disk layout), the file only needs flushing
+    if (kmers.backing() == filename)
+    {
+        if (!kmers.sync())
+        {
+            throw runtime_error("Unable to write " + filename);
+        }
+        return;
+    }
+
+    memcpy(header.magic, KMER_FILE_MAGIC, sizeof(KMER_FILE_MAGIC));
+    header.version = KMER_FILE_VERSION;
+    header.k_size = 15;
+    header.size = kmers.size();
+    header.width = sizeof(kmer_count_t);
+
+    output.open(filename, ios::out | ios::binary);
+
+    if (!output)
+    {
+        throw runtime_error("Unable to write " + filename);
+    }
+
+    output.write(reinterpret_cast<char const *>(&header), sizeof(header));
+    output.write(reinterpret_cast<char const *>(kmers.data()), kmers.size() * sizeof(kmer_count_t));
     output.close();
+
+    // a full disk fails the writes or the final flush
+    if (!output)
+    {
+        throw runtime_error("Unable to write " + filename);
+    }
 }
 
-inline vector<atomic<u_int32_t>> readKmerFile(string filename)
+// adds the counts of other to total, saturating at KMER_COUNT_MAX
+// saturated partial sums add up to the saturated count of the whole input
+// both tables must use the same sketch
+inline void addKmerTable(KmerTable &total, KmerTable &other, int threads)
 {
-    ifstream input;
-    u_int64_t size;
-    input.open(filename);
-
-    input.read(reinterpret_cast<char*>(&size), sizeof(size));
-    vector<atomic<u_int32_t>> kmers(size);
+    kmer_count_t *into = total.data();
+    const kmer_count_t *from = other.data();
+    u_int64_t size = total.size();
 
-    input.read(reinterpret_cast<char*>(kmers.data()), kmers.size() * sizeof(kmers[0]));
-    input.close();
+    if (other.size() != size)
+    {
+        throw runtime_error("15-mer count tables were counted with different sketch fractions");
+    }
 
-    return kmers;
+#pragma omp parallel for num_threads(threads) schedule(static)
+    for (u_int64_t i = 0; i < size; i++)
+    {
+        u_int32_t sum = (u_int32_t)into[i] + from[i];
+        into[i] = sum < KMER_COUNT_MAX ? sum : KMER_COUNT_MAX;
+    }
 }
 
-inline void line_to_kmer_counts(string &line, vector<atomic<u_int32_t>> &all_kmers)
+inline void line_to_kmer_counts(const char *line, size_t length, KmerTable &all_kmers)
 {
     long len = 0;
-    u_int64_t val = 0, rev = 0;
-    u_int32_t oval;
+    u_int64_t val = 0;
 
-    for (size_t i = 0; i < line.length(); i++)
+    for (size_t i = 0; i < length; i++)
     {
         if (!(line[i] == 'A' || line[i] == 'C' || line[i] == 'G' || line[i] == 'T'))
         {
@@ -127,30 +437,127 @@ inline void line_to_kmer_counts(string &line, vector<atomic<u_int32_t>> &all_kme
         }
 
         val = (val << 2);
-        val = val & 1073741823;
+        val = val & KMER_MASK;
         val += (line[i] >> 1 & 3);
         len++;
 
         if (len == 15)
         {
             // use val as the kmer for counting
+            // both strands share one canonical counter
             len--;
-            // record original value from index
-            oval = all_kmers[val];
-            
-            // CAS
-            while (!all_kmers[val].compare_exchange_weak(oval, oval + 1))
+            all_kmers.add(val);
+        }
+    }
+}
+
+// Counts 15-mers without atomics. Each thread scatters the canonical indices
+// of its reads into per-partition buffers (partitioned by the index prefix),
+// then every partition is merged into its own slice of the table by a single
+// thread. Reads are consumed in rounds so that the buffers stay bounded.
+class ShardedKmerCounter
+{
+private:
+    KmerTable &table;
+    int threads;
+    u_int64_t round_bases;
+    // buckets[thread][partition]
+    vector<vector<vector<u_int32_t>>> buckets;
+
+    static const int PARTITION_BITS = 10;
+    static const int PARTITIONS = 1 << PARTITION_BITS;
+    // counters of the table split into PARTITIONS ranges
+    int partition_shift = 0;
+
+    void scatter(const char *line, size_t length, vector<vector<u_int32_t>> &local)
+    {
+        long len = 0;
+        u_int64_t val = 0, index;
+
+        for (size_t i = 0; i < length; i++)
+        {
+            if (!(line[i] == 'A' || line[i] == 'C' || line[i] == 'G' || line[i] == 'T'))
             {
-            };
-
-            // reverse complement recording
-            rev = revComp(val);
-            oval = all_kmers[rev];
-            
-            // CAS
-            while (!all_kmers[rev].compare_exchange_weak(oval, oval + 1))
+                val = 0;
+                len = 0;
+                continue;
+            }
+
+            val = (val << 2);
+            val = val & KMER_MASK;
+            val += (line[i] >> 1 & 3);
+            len++;
+
+            if (len == 15)
             {
-            };
+                len--;
+                if (table.slot(canonicalIndex(val), index))
+                {
+                    local[index >> partition_shift].push_back(index);
+                }
+            }
         }
     }
-}
+
+    void count_round(ReadBatch &batch, size_t start, size_t end)
+    {
+#pragma omp parallel num_threads(threads)
+        {
+            vector<vector<u_int32_t>> &local = buckets[omp_get_thread_num()];
+
+#pragma omp for schedule(dynamic, 1)
+            for (size_t i = start; i < end; i++)
+            {
+                scatter(batch.seq(i), batch.length(i), local);
+            }
+
+            // implicit barrier, every partition is now owned by one thread
+#pragma omp for schedule(dynamic, 1)
+            for (int p = 0; p < PARTITIONS; p++)
+            {
+                for (int t = 0; t < threads; t++)
+                {
+                    for (u_int32_t index : buckets[t][p])
+                    {
+                        table.increment(index);
+                    }
+                    buckets[t][p].clear();
+                }
+            }
+        }
+    }
+
+public:
+    // round_bases bounds the scatter buffers to about 4 * round_bases bytes
+    ShardedKmerCounter(KmerTable &table, int threads, u_int64_t round_bases = 1 << 26) : table(table)
+    {
+        this->threads = threads;
+        this->round_bases = round_bases;
+        buckets.resize(threads, vector<vector<u_int32_t>>(PARTITIONS));
+
+        while ((table.size() - 1) >> partition_shift >= (u_int64_t)PARTITIONS)
+        {
+            partition_shift++;
+        }
+    }
+
+    void count_batch(ReadBatch &batch)
+    {
+        size_t start = 0, end = 0;
+        u_int64_t bases;
+
+        while (start < batch.size())
+        {
+            bases = 0;
+
+            while (end < batch.size() && (end == start || bases + batch.length(end) <= round_bases))
+            {
+                bases += batch.length(end);
+                end++;
+            }
+
+            count_round(batch, start, end);
+            start = end;
+        }
+    }
+};
@@ -0,0 +1,146 @@
+import logging
+
+logger = logging.getLogger('MetaBCC-LR')
+
+MB = 1 << 20
+
+# Estimates behind the plan. Sizes are resident bytes, measured on Linux with t-SNE.
+# the driver with numpy, the binner and its libraries loaded, resident during every stage
+DRIVER_BYTES = 256 * MB
+# native tool code, decompression chunks and BGZF work buffers
+TOOL_BYTES = 64 * MB
+# full 15-mer count table, 2^29 saturating u16 counters
+TABLE_SLOTS = 1 << 29
+# binner fixed cost, per sampled read (embedding, neighbour graph, DBSCAN) and per pool worker
+# (workers share the preloaded modules with the forkserver, only their own pages count)
+BINNER_BYTES = 64 * MB
+SAMPLED_READ_BYTES = 16 << 10
+WORKER_BYTES = 64 * MB
+# per assigned read, its bin and its output line
+ASSIGN_ROW_BYTES = 16
+# batches are sized by bases, profiles of a batch by reads, assumed no shorter than this
+READ_LENGTH = 1000
+
+# native defaults, the plan never goes above them
+BATCH_BASES = 1 << 25
+QUEUE_DEPTH = 4
+ROUND_BASES = 1 << 26
+CHUNK_ROWS = 1000000
+# and never below these
+MIN_BATCH_BASES = 1 << 20
+MIN_QUEUE_DEPTH = 2
+MIN_ROUND_BASES = 1 << 20
+MIN_CHUNK_ROWS = 10000
+
+
+def composition_dims(k_size):
+    # canonical k-mers, palindromes (even k only) counted once
+    return (4 ** k_size + (4 ** (k_size // 2) if k_size % 2 == 0 else 0)) // 2
+
+
+def mb(size):
+    return f"{size / MB:.0f} MB"
+
+
+class MemoryPlan:
+    """
+    Buffer sizes of every stage for a memory budget (bytes, None for the defaults).
+    Read batches, the queue of parsed batches and the 15-mer counting rounds are sized
+    by bases. The count table stays in memory when it fits next to them, otherwise
+    it is counted in its file and paged by the kernel (slower, but reclaimable).
+    Sampled rows are gathered and profile rows assigned in chunks that fit.
+    The binner pool is limited to the workers that fit next to the sampled reads.
+    ValueError is raised with an estimate when a stage cannot fit the budget.
+    """
+    def __init__(self, budget, threads, k_size=3, bin_count=32, sketch_fraction=1.0):
+        self.budget = budget
+        self.threads = threads
+        self.dims = composition_dims(k_size) + bin_count
+        self.table_bytes = max(int(sketch_fraction * TABLE_SLOTS), 1) * 2
+
+        self.batch_bases = BATCH_BASES
+        self.queue_depth = QUEUE_DEPTH
+        self.round_bases = ROUND_BASES
+        self.disk_counts = False
+        self.chunk_rows = CHUNK_ROWS
+        self.sample_rows = CHUNK_ROWS
+
+        if budget is None:
+            return
+
+        fixed = DRIVER_BYTES + TOOL_BYTES
+
+        # the table in memory with buffers as large as fit, then counted in its file
+        if not self.fit_buffers(budget - fixed - self.table_bytes):
+            self.disk_counts = True
+
+            if not self.fit_buffers(budget - fixed):
+                need = fixed + self.buffer_bytes(MIN_BATCH_BASES, MIN_QUEUE_DEPTH, MIN_ROUND_BASES)
+                raise ValueError(f"Memory budget {mb(budget)} is too small to profile reads, it needs at least {mb(need)} "
+                                 f"(driver {mb(DRIVER_BYTES)}, native tool {mb(TOOL_BYTES)}, read buffers {mb(need - fixed)} "
+                                 f"with the 15-mer table on disk)")
+
+        rows = max(budget - fixed, 0) // ASSIGN_ROW_BYTES
+        self.chunk_rows = int(min(max(rows, MIN_CHUNK_ROWS), CHUNK_ROWS))
+
+        # a gathered chunk and its copy in the sampled output
+        rows = max(budget - DRIVER_BYTES, 0) // (self.dims * 4 * 2)
+        self.sample_rows = int(min(max(rows, MIN_CHUNK_ROWS), CHUNK_ROWS))
+
+    def buffer_bytes(self, batch_bases, queue_depth, round_bases):
+        # batches in flight, plus the counting scatter (first pass) or the profiles of a batch (second pass)
+        profile_bytes = batch_bases * self.dims * 4 // READ_LENGTH
+        return queue_depth * batch_bases + max(8 * round_bases, profile_bytes)
+
+    def fit_buffers(self, available):
+        """
+        Largest read buffers within available bytes, False if even the smallest do not fit.
+        """
+        for depth in range(QUEUE_DEPTH, MIN_QUEUE_DEPTH - 1, -1):
+            scale = min(1.0, available / self.buffer_bytes(BATCH_BASES, depth, ROUND_BASES))
+            batch_bases = max(int(BATCH_BASES * scale), MIN_BATCH_BASES)
+            round_bases = max(int(ROUND_BASES * scale), MIN_ROUND_BASES)
+
+            if self.buffer_bytes(batch_bases, depth, round_bases) <= available:
+                self.batch_bases, self.queue_depth, self.round_bases = batch_bases, depth, round_bases
+                return True
+
+        return False
+
+    def native_args(self):
+        # flags of the native tools (MemoryOptions), nothing without a budget
+        if self.budget is None:
+            return []
+
+        args = ["--batch-bases", str(self.batch_bases), "--queue-depth", str(self.queue_depth),
+                "--round-bases", str(self.round_bases), "--chunk-rows", str(self.chunk_rows)]
+
+        return args + ["--disk-counts"] if self.disk_counts else args
+
+    def binner_processes(self, sample_count):
+        """
+        Pool workers of the binner that fit next to sample_count sampled reads, None without a budget.
+        """
+        if self.budget is None:
+            return None
+
+        base = DRIVER_BYTES + BINNER_BYTES + sample_count * (SAMPLED_READ_BYTES + self.dims * 4)
+        # every worker loads the sampled profiles
+        worker = WORKER_BYTES + sample_count * self.dims * 4
+
+        if base > self.budget:
+            raise ValueError(f"Memory budget {mb(self.budget)} is too small to bin {sample_count} sampled reads, "
+                             f"it needs at least {mb(base)} (driver {mb(DRIVER_BYTES)}, binner {mb(base - DRIVER_BYTES)}). "
+                             f"Sample fewer reads or raise the budget.")
+
+        # a single process bins in the driver, a pool adds its workers
+        return int(max(min((self.budget - base) // worker, self.threads), 1))
+
+    def describe(self):
+        if self.budget is None:
+            return "no memory budget, default buffer sizes"
+
+        return (f"budget {mb(self.budget)}: read batches {mb(self.batch_bases)} x {self.queue_depth}, "
+                f"counting rounds {mb(self.round_bases)}, 15-mer table ({mb(self.table_bytes)}) "
+                f"{'on disk' if self.disk_counts else 'in memory'}, assign chunks {self.chunk_rows} rows, "
+                f"sample chunks {self.sample_rows} rows")
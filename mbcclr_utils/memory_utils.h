@@ -0,0 +1,63 @@
+#pragma once
+#include <string>
+#include <algorithm>
+#include <sys/types.h>
+
+using namespace std;
+
+// Buffer sizes of the native tools. The driver plans them for a memory budget
+// (--max-memory) and passes them as flags, the defaults are used otherwise.
+class MemoryOptions
+{
+public:
+    // bases per read batch and batches parsed ahead of the consumer
+    u_int64_t batch_bases = 1 << 25;
+    size_t queue_depth = 4;
+    // bases scattered per 15-mer counting round, 4 bytes of buffer per base
+    u_int64_t round_bases = 1 << 26;
+    // count the 15-mers in the mapped output file instead of anonymous memory,
+    // the page cache can then write back and drop counters under memory pressure
+    bool disk_counts = false;
+    // profile rows assigned at a time
+    u_int64_t chunk_rows = 1000000;
+
+    // strips the memory flags from argv
+    static MemoryOptions from_args(int &argc, char **argv)
+    {
+        MemoryOptions options;
+        int kept = 1;
+
+        for (int i = 1; i < argc; i++)
+        {
+            string arg = argv[i];
+
+            if (i + 1 < argc && arg == "--batch-bases")
+            {
+                options.batch_bases = max(stoull(argv[++i]), 1ULL);
+            }
+            else if (i + 1 < argc && arg == "--queue-depth")
+            {
+                options.queue_depth = max(stoul(argv[++i]), 1UL);
+            }
+            else if (i + 1 < argc && arg == "--round-bases")
+            {
+                options.round_bases = max(stoull(argv[++i]), 1ULL);
+            }
+            else if (i + 1 < argc && arg == "--chunk-rows")
+            {
+                options.chunk_rows = max(stoull(argv[++i]), 1ULL);
+            }
+            else if (arg == "--disk-counts")
+            {
+                options.disk_counts = true;
+            }
+            else
+            {
+                argv[kept++] = argv[i];
+            }
+        }
+        argc = kept;
+
+        return options;
+    }
+};
@@ -0,0 +1,72 @@
+#include <iostream>
+#include <omp.h>
+#include <string>
+#include "kmer_utils.h"
+#include "metrics_utils.h"
+
+using namespace std;
+
+// sums 15-mer count files of read shards into one table
+// usage: merge-15mers <output> <threads> <counts> [<counts> ...]
+int main(int argc, char **argv)
+{
+    // the merged table can be summed in the output file itself
+    MemoryOptions memory = MemoryOptions::from_args(argc, argv);
+    // sized by the first shard, every shard must use the same sketch
+    KmerTable *kmers = nullptr;
+
+    string output_path = argv[1];
+    int threads = stoi(argv[2]);
+
+    cout << "OUTPUT FILE " << output_path << endl;
+    cout << "THREADS " << threads << endl;
+
+    ToolMetrics metrics;
+
+    for (int i = 3; i < argc; i++)
+    {
+        cout << "MERGING " << argv[i] << endl;
+
+        try
+        {
+            // every page is read once, front to back
+            KmerTable shard(argv[i], "sequential");
+
+            if (kmers == nullptr)
+            {
+                kmers = memory.disk_counts ? new KmerTable(shard.size(), output_path) : new KmerTable(shard.size());
+            }
+            addKmerTable(*kmers, shard, threads);
+        }
+        catch (const exception &e)
+        {
+            cerr << e.what() << endl;
+            return 1;
+        }
+    }
+
+    cout << "WRITING TO FILE" << endl;
+
+    if (kmers == nullptr)
+    {
+        cerr << "No count files to merge" << endl;
+        return 1;
+    }
+
+    try
+    {
+        writeKmerFile(output_path, *kmers);
+    }
+    catch (const exception &e)
+    {
+        cerr << e.what() << endl;
+        return 1;
+    }
+    delete kmers;
+
+    cout << "COMPLETED : Output at - " << output_path << endl;
+
+    metrics.write();
+
+    return 0;
+}
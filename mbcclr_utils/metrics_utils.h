@@ -0,0 +1,62 @@
+#pragma once
+#include <iostream>
+#include <fstream>
+#include <sstream>
+#include <string>
+#include <cstdlib>
+
+using namespace std;
+
+// Counters of a native tool, appended as one JSON line to the file named by MBCC_METRICS
+// (set by the driver, which measures time and memory itself). Nothing is written without it.
+class ToolMetrics
+{
+private:
+    u_int64_t total_reads = 0, total_bases = 0;
+
+    // bytes passed through read/write system calls, mapped files are not included
+    static void io_counters(u_int64_t &rchar, u_int64_t &wchar)
+    {
+        ifstream io("/proc/self/io");
+        string key;
+        u_int64_t value;
+
+        rchar = wchar = 0;
+
+        while (io >> key >> value)
+        {
+            if (key == "rchar:")
+            {
+                rchar = value;
+            }
+            else if (key == "wchar:")
+            {
+                wchar = value;
+            }
+        }
+    }
+
+public:
+    void add(u_int64_t reads, u_int64_t bases)
+    {
+        total_reads += reads;
+        total_bases += bases;
+    }
+
+    void write()
+    {
+        const char *path = getenv("MBCC_METRICS");
+        u_int64_t rchar, wchar;
+
+        if (path == nullptr)
+        {
+            return;
+        }
+
+        io_counters(rchar, wchar);
+
+        ofstream out(path, ios::app);
+        out << "{\"reads\": " << total_reads << ", \"bases\": " << total_bases
+            << ", \"bytes_read\": " << rchar << ", \"bytes_written\": " << wchar << "}" << endl;
+    }
+};
@@ -0,0 +1,130 @@
+#pragma once
+#include <iostream>
+#include <string>
+#include <stdexcept>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+using namespace std;
+
+// read only memory mapping of a whole file
+// advice is one of normal, random, sequential, willneed or populate
+// populate prefaults every page before returning (Linux only, willneed elsewhere)
+// a file can also be created with a given length and mapped for writing
+class MappedFile
+{
+private:
+    void *mapping = MAP_FAILED;
+    size_t length = 0;
+
+public:
+    // creates (or truncates) path as length zero bytes, mapped read/write
+    // written pages reach the file without an explicit write, sync() flushes them
+    MappedFile(string path, size_t length) : length(length)
+    {
+        int fd = open(path.c_str(), O_RDWR | O_CREAT | O_TRUNC, 0644);
+
+        if (fd < 0 || ftruncate(fd, length) != 0)
+        {
+            if (fd >= 0)
+            {
+                close(fd);
+            }
+            throw runtime_error("Unable to create " + path);
+        }
+
+        mapping = mmap(nullptr, length, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        close(fd);
+
+        if (mapping == MAP_FAILED)
+        {
+            throw runtime_error("Unable to memory map " + path);
+        }
+    }
+
+    MappedFile(string path, string advice = "normal")
+    {
+        int fd = open(path.c_str(), O_RDONLY);
+        int flags = MAP_SHARED;
+        struct stat st;
+
+        if (fd < 0 || fstat(fd, &st) != 0)
+        {
+            throw runtime_error("Unable to open " + path);
+        }
+
+        length = st.st_size;
+
+#ifdef MAP_POPULATE
+        if (advice == "populate")
+        {
+            flags |= MAP_POPULATE;
+        }
+#endif
+
+        if (length > 0)
+        {
+            mapping = mmap(nullptr, length, PROT_READ, flags, fd, 0);
+        }
+        close(fd);
+
+        if (length > 0 && mapping == MAP_FAILED)
+        {
+            throw runtime_error("Unable to memory map " + path);
+        }
+
+        if (length > 0)
+        {
+            if (advice == "random")
+            {
+                madvise(mapping, length, MADV_RANDOM);
+            }
+            else if (advice == "sequential")
+            {
+                madvise(mapping, length, MADV_SEQUENTIAL);
+            }
+            else if (advice == "willneed" || advice == "populate")
+            {
+                madvise(mapping, length, MADV_WILLNEED);
+            }
+            else if (advice != "normal")
+            {
+                throw runtime_error("Unknown mmap advice " + advice);
+            }
+        }
+    }
+
+    ~MappedFile()
+    {
+        if (mapping != MAP_FAILED)
+        {
+            munmap(mapping, length);
+        }
+    }
+
+    MappedFile(const MappedFile &) = delete;
+    MappedFile &operator=(const MappedFile &) = delete;
+
+    const char *data()
+    {
+        return (const char *)mapping;
+    }
+
+    // only for files mapped for writing
+    char *writable_data()
+    {
+        return (char *)mapping;
+    }
+
+    bool sync()
+    {
+        return mapping == MAP_FAILED || msync(mapping, length, MS_SYNC) == 0;
+    }
+
+    size_t size()
+    {
+        return length;
+    }
+};
@@ -0,0 +1,119 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# the k-distance curve is downsampled to this many points before locating its knee
+KNEE_POINTS = 2000
+# cells within two cells of another, each pair once
+CELL_OFFSETS = [(dx, dy) for dx in range(3) for dy in range(-2, 3) if dx > 0 or dy > 0]
+
+
+class NeighbourIndex:
+    """
+    KD-tree over the 2-D embedding of a tree node, built once and used for both
+    the k-distance curve (epsilon estimation) and the DBSCAN region queries.
+    """
+    def __init__(self, points, threads=1):
+        self.tree = cKDTree(np.asarray(points, dtype=np.float64))
+        self.threads = threads
+
+    def __len__(self):
+        return self.tree.n
+
+    def nearest_distances(self):
+        # distance of every point to its nearest other point
+        distances, _ = self.tree.query(self.tree.data, k=2, workers=self.threads)
+        return distances[:, 1]
+
+    def dbscan(self, eps, min_samples=5):
+        """
+        Labels of DBSCAN(eps, min_samples), the same as sklearn's: clusters numbered by their
+        first core point, border points in the first cluster reaching them, noise -1.
+        Points are put in a grid of cells with a diagonal of eps. Cells with min_samples points
+        are core without a region query and their cores are connected without comparing them,
+        so dense nodes cost close to linear time instead of their number of neighbour pairs.
+        """
+        points = self.tree.data
+        labels = np.full(self.tree.n, -1, dtype=np.int64)
+
+        # just under eps / sqrt(2), any two points of a cell are neighbours
+        side = eps / np.sqrt(2) * (1 - 1e-9)
+        origin = points.min(axis=0)
+        cells = np.floor((points - origin) / side).astype(np.int64)
+        # two empty rows either side, offsets never wrap into the next column
+        rows = int(cells[:, 1].max()) + 5
+        keys = cells[:, 0] * rows + cells[:, 1] + 2
+        _, cell_of, cell_sizes = np.unique(keys, return_inverse=True, return_counts=True)
+
+        core = cell_sizes[cell_of.ravel()] >= min_samples
+        # regions of the other points, kept for the border points
+        sparse = np.flatnonzero(~core)
+        regions = self.tree.query_ball_point(points[sparse], eps, workers=self.threads)
+        lengths = np.fromiter(map(len, regions), dtype=np.int64, count=sparse.size)
+        core[sparse] = lengths >= min_samples
+
+        cores = np.flatnonzero(core)
+        if cores.size == 0:
+            return labels
+
+        # cells holding cores, connected when a core of one is within eps of a core of the other
+        core_keys = keys[cores]
+        cell_keys, core_cell = np.unique(core_keys, return_inverse=True)
+        core_cell = core_cell.ravel()
+        # cores of other cells are further than eps along the third axis, so a nearest core
+        # query at the height of a cell only finds the cores of that cell
+        height = np.arange(cell_keys.size) * 4.0 * eps
+        cell_tree = cKDTree(np.column_stack([points[cores], height[core_cell]]))
+        # position within its cell in cell sides, to skip cells out of reach
+        local = (points[cores] - origin) / side - cells[cores]
+        reach = (eps / side) ** 2
+
+        components = np.arange(cell_keys.size)
+        sources = targets = np.empty(0, dtype=np.int64)
+
+        for dx, dy in CELL_OFFSETS:
+            target_keys = core_keys + dx * rows + dy
+            target = np.minimum(np.searchsorted(cell_keys, target_keys), cell_keys.size - 1)
+            gap = np.maximum(0, np.maximum(np.array([dx, dy]) - local, local - np.array([dx, dy]) - 1))
+            query = np.flatnonzero((cell_keys[target] == target_keys) & ((gap ** 2).sum(axis=1) <= reach) &
+                                   (components[core_cell] != components[target]))
+
+            if query.size == 0:
+                continue
+
+            distances, _ = cell_tree.query(np.column_stack([points[cores[query]], height[target[query]]]),
+                                           k=1, distance_upper_bound=np.nextafter(eps, np.inf), workers=self.threads)
+            linked = query[distances <= eps]
+            sources = np.concatenate([sources, core_cell[linked]])
+            targets = np.concatenate([targets, target[linked]])
+
+            graph = coo_matrix((np.ones(sources.size, dtype=np.int8), (sources, targets)), shape=(cell_keys.size, cell_keys.size))
+            _, components = connected_components(graph, directed=False)
+
+        # clusters numbered by their first core point, the order DBSCAN expands them in
+        core_components = components[core_cell]
+        first = np.full(components.max() + 1, self.tree.n)
+        np.minimum.at(first, core_components, cores)
+        order = np.empty_like(first)
+        order[np.argsort(first)] = np.arange(first.size)
+        labels[cores] = order[core_components]
+
+        # border points join the first cluster with a core within eps
+        border = np.flatnonzero(lengths < min_samples)
+        if border.size:
+            neighbours = np.concatenate([np.asarray(regions[i], dtype=np.int64) for i in border])
+            clusters = np.where(core[neighbours], labels[neighbours], first.size)
+            # every region holds the point itself
+            nearest = np.minimum.reduceat(clusters, np.concatenate([[0], np.cumsum(lengths[border])[:-1]]))
+            labels[sparse[border]] = np.where(nearest < first.size, nearest, -1)
+
+        return labels
+
+
+def knee_curve(distances, points=KNEE_POINTS):
+    # evenly spaced points of a sorted curve, the curve itself when it is short
+    if distances.shape[0] <= points:
+        return distances
+
+    return distances[np.linspace(0, distances.shape[0] - 1, points).round().astype(np.int64)]
@@ -0,0 +1,128 @@
+import glob
+import os
+import subprocess
+import sys
+import logging
+import numpy as np
+from multiprocessing import get_context
+from kneed import KneeLocator
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+logger = logging.getLogger('MetaBCC-LR')
+
+# inline renders figures while binning, deferred saves their data to images/pending
+# to be rendered later (mbcclr-plot or a background renderer), off skips them
+PLOT_MODES = ["inline", "deferred", "off"]
+
+
+def pending_dir(output):
+    return f"{output}/images/pending"
+
+
+def render_scatter(X, Y, title, labels, output):
+    fig = plt.figure(figsize=(10, 10))
+    fig.suptitle(title, fontsize=20)
+
+    if len(labels) == len(X):
+        sns.scatterplot(x=X, y=Y, hue=labels).plot()
+    else:
+        sns.scatterplot(x=X, y=Y).plot()
+
+    plt.savefig(f"{output}/images/{title}.png", dpi=200, format="png")
+    plt.close()
+
+
+def render_kneedle(distances, title, output, kneedle=None):
+    # the knee is located again from the distances when rendering deferred figures
+    if kneedle is None:
+        kneedle = KneeLocator(np.arange(distances.shape[0]), distances, S=1.0, curve='convex', direction='increasing', interp_method='polynomial')
+
+    plt.figure()
+    plt.plot(distances)
+    kneedle.plot_knee_normalized()
+    plt.savefig(f"{output}/images/{title}.png", dpi=200, format="png")
+    plt.close()
+
+
+def save_pending(output, title, kind, **arrays):
+    """
+    Data of a figure in images/pending/<title>.npz, renamed into place once complete.
+    Labels are stored as codes into their distinct names.
+    """
+    os.makedirs(pending_dir(output), exist_ok=True)
+    path = f"{pending_dir(output)}/{title}.npz"
+    tmp = f"{path}.{os.getpid()}.tmp"
+
+    if "labels" in arrays:
+        names, codes = np.unique(np.asarray(arrays.pop("labels"), dtype=str), return_inverse=True)
+        arrays["label_names"] = names
+        arrays["label_codes"] = codes.astype(np.int32)
+
+    with open(tmp, "wb") as f:
+        np.savez(f, kind=kind, title=title, **arrays)
+    os.replace(tmp, path)
+
+
+def render_file(args):
+    output, path = args
+    # claimed by renaming, concurrent renderers skip figures taken by another
+    claimed = f"{path}.{os.getpid()}.render"
+
+    try:
+        os.rename(path, claimed)
+    except OSError:
+        return False
+
+    with np.load(claimed) as data:
+        kind, title = str(data["kind"]), str(data["title"])
+
+        if kind == "scatter":
+            labels = list(data["label_names"][data["label_codes"]]) if "label_codes" in data else []
+            render_scatter(data["x"], data["y"], title, labels, output)
+        else:
+            render_kneedle(data["distances"], title, output)
+
+    os.remove(claimed)
+
+    return True
+
+
+def render_pending(output, processes=1):
+    """
+    Renders every deferred figure of output into output/images, returns the number rendered.
+    """
+    paths = sorted(glob.glob(f"{pending_dir(output)}/*.npz"))
+
+    if processes > 1 and len(paths) > 1:
+        with get_context("forkserver").Pool(processes) as pool:
+            rendered = sum(pool.map(render_file, [(output, path) for path in paths], chunksize=1))
+    else:
+        rendered = sum(render_file((output, path)) for path in paths)
+
+    try:
+        os.rmdir(pending_dir(output))
+    except OSError:
+        pass
+
+    return rendered
+
+
+def render_in_background(output):
+    """
+    Starts a detached renderer of the deferred figures, logging to images/render.log.
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_root] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+
+    with open(f"{output}/images/render.log", "w") as log:
+        subprocess.Popen([sys.executable, "-m", "mbcclr_utils.plotting", output], stdout=log, stderr=log,
+                         stdin=subprocess.DEVNULL, env=env, start_new_session=True)
+
+
+if __name__ == '__main__':
+    print(f"Rendered {render_pending(sys.argv[1])} figures")
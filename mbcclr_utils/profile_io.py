@@ -0,0 +1,80 @@
+import numpy as np
+import logging
+
+logger = logging.getLogger('MetaBCC-LR')
+
+# must match profile_utils.h
+PROFILE_MAGIC = b"MBCCPROF"
+PROFILE_VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('dims', '<u4'), ('rows', '<u8'), ('reserved', '<u8')])
+
+
+def is_profile(path):
+    with open(path, "rb") as f:
+        return f.read(len(PROFILE_MAGIC)) == PROFILE_MAGIC
+
+
+def read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+
+    if len(header) == 0 or header['magic'][0] != PROFILE_MAGIC:
+        raise ValueError(f"{path} is not a binary profile. Convert text profiles using convert_profiles.py")
+    if header['version'][0] != PROFILE_VERSION:
+        raise ValueError(f"Unsupported profile version {header['version'][0]} in {path}")
+
+    return int(header['dims'][0]), int(header['rows'][0])
+
+
+def open_profile(path):
+    """Memory map a binary profile as a read only (rows, dims) float32 array."""
+    dims, rows = read_header(path)
+
+    if rows == 0:
+        return np.zeros((0, dims), dtype=np.float32)
+
+    return np.memmap(path, dtype=np.float32, mode='r', offset=HEADER_DTYPE.itemsize, shape=(rows, dims))
+
+
+def write_profile(path, data):
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = PROFILE_MAGIC
+    header['version'] = PROFILE_VERSION
+    header['rows'], header['dims'] = data.shape
+
+    with open(path, "wb") as f:
+        header.tofile(f)
+        data.tofile(f)
+
+
+def convert_text_profile(text_path, profile_path):
+    """Convert a whitespace separated text profile into the binary format, one line at a time."""
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = PROFILE_MAGIC
+    header['version'] = PROFILE_VERSION
+    rows = 0
+    dims = None
+
+    with open(text_path) as text, open(profile_path, "wb") as f:
+        header.tofile(f)
+
+        for line in text:
+            row = np.array(line.split(), dtype=np.float32)
+
+            if len(row) == 0:
+                continue
+            if dims is None:
+                dims = len(row)
+            elif len(row) != dims:
+                raise ValueError(f"Line {rows + 1} of {text_path} has {len(row)} values, expected {dims}")
+            row.tofile(f)
+            rows += 1
+
+        header['dims'] = dims or 0
+        header['rows'] = rows
+        f.seek(0)
+        header.tofile(f)
+
+    logger.debug(f"Converted {rows} rows of {dims} values from {text_path}")
+
+    return rows
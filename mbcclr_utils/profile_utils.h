@@ -0,0 +1,122 @@
+#pragma once
+#include <iostream>
+#include <fstream>
+#include <string>
+#include <vector>
+#include <cstring>
+#include <stdexcept>
+#include "mmap_utils.h"
+
+using namespace std;
+
+// Binary profile layout (little endian)
+//   magic[8]   "MBCCPROF"
+//   version    u_int32_t
+//   dims       u_int32_t
+//   rows       u_int64_t
+//   reserved   u_int64_t
+//   data       float32[rows * dims] (row major)
+const char PROFILE_MAGIC[8] = {'M', 'B', 'C', 'C', 'P', 'R', 'O', 'F'};
+const u_int32_t PROFILE_VERSION = 1;
+
+struct ProfileHeader
+{
+    char magic[8];
+    u_int32_t version;
+    u_int32_t dims;
+    u_int64_t rows;
+    u_int64_t reserved;
+};
+
+static_assert(sizeof(ProfileHeader) == 32, "profile header must be 32 bytes");
+
+class ProfileWriter
+{
+private:
+    ofstream output;
+    ProfileHeader header;
+
+public:
+    ProfileWriter(string path, u_int32_t dims)
+    {
+        memcpy(header.magic, PROFILE_MAGIC, sizeof(PROFILE_MAGIC));
+        header.version = PROFILE_VERSION;
+        header.dims = dims;
+        header.rows = 0;
+        header.reserved = 0;
+
+        output.open(path, ios::out | ios::binary | ios::trunc);
+
+        if (!output)
+        {
+            throw runtime_error("Unable to open profile for writing " + path);
+        }
+        output.write(reinterpret_cast<char const *>(&header), sizeof(header));
+    }
+
+    ~ProfileWriter()
+    {
+        close();
+    }
+
+    u_int32_t dims()
+    {
+        return header.dims;
+    }
+
+    void write_rows(const float *data, size_t rows)
+    {
+        output.write(reinterpret_cast<char const *>(data), rows * header.dims * sizeof(float));
+        header.rows += rows;
+    }
+
+    void close()
+    {
+        if (output.is_open())
+        {
+            // row count is only known at the end
+            output.seekp(0, ios::beg);
+            output.write(reinterpret_cast<char const *>(&header), sizeof(header));
+            output.close();
+        }
+    }
+};
+
+// read only memory mapped profile, rows are used in place
+class MappedProfile
+{
+private:
+    MappedFile file;
+    const ProfileHeader *header;
+
+public:
+    MappedProfile(string path, string advice = "sequential") : file(path, advice)
+    {
+        header = (const ProfileHeader *)file.data();
+
+        if (file.size() < sizeof(ProfileHeader) || memcmp(header->magic, PROFILE_MAGIC, sizeof(PROFILE_MAGIC)) != 0)
+        {
+            throw runtime_error("Not a binary profile (convert text profiles with convert_profiles.py) " + path);
+        }
+
+        if (file.size() < sizeof(ProfileHeader) + header->rows * header->dims * sizeof(float))
+        {
+            throw runtime_error("Truncated profile " + path);
+        }
+    }
+
+    u_int32_t dims()
+    {
+        return header->dims;
+    }
+
+    u_int64_t rows()
+    {
+        return header->rows;
+    }
+
+    const float *row(u_int64_t i)
+    {
+        return (const float *)(file.data() + sizeof(ProfileHeader)) + i * header->dims;
+    }
+};
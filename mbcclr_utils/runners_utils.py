@@ -1,11 +1,13 @@
-import pickle
 import os
+import json
+import shutil
 from Bio import SeqIO
 from tqdm import tqdm
 import logging
 import sys
 
 from mbcclr_utils import scan_dsk
+from mbcclr_utils.telemetry import recorder
 
 logger = logging.getLogger('MetaBCC-LR')
 
@@ -38,38 +40,159 @@ def run_filter(reads_path, output, ids=None):
                 output_fasta_file.write(f">{record.id}\n{str(record.seq)}\n")
     output_fasta_file.close()
     
-def run_assign(output, threads):
-    cmd = f"""{os.path.dirname(__file__)}/bin/assign "{output}/profiles/3mers" "{output}/profiles/15mers" "{output}/misc/cluster-stats.txt" {threads} {output}/final.txt """
-    o = os.system(cmd)
+def filter_args(min_length=0, max_n_fraction=1.0, max_bases=0):
+    # read filter flags of the native tools, nothing when every filter is off
+    args = []
+
+    if min_length > 0:
+        args += ["--min-length", str(min_length)]
+    if max_n_fraction < 1.0:
+        args += ["--max-n-fraction", str(max_n_fraction)]
+    if max_bases > 0:
+        args += ["--max-bases", str(max_bases)]
+
+    return args
+
+def sketch_args(sketch_fraction=1.0):
+    # 15-mer counters kept when counting, lookups follow the table they are given
+    return ["--sketch-fraction", str(sketch_fraction)] if sketch_fraction < 1.0 else []
+
+def kept_args(profiles):
+    # reads dropped by the filter are written as UnBinned, one line per input read
+    return ["--kept", f"{profiles}/kept-reads"] if os.path.isfile(f"{profiles}/kept-reads") else []
+
+def run_assign(output, threads, mmap_advice="sequential", memory=()):
+    args = [f"{os.path.dirname(__file__)}/bin/assign", f"{output}/profiles/3mers", f"{output}/profiles/15mers", f"{output}/misc/cluster-stats.txt", str(threads), f"{output}/final.txt", mmap_advice] + kept_args(f"{output}/profiles") + list(memory)
+    o = recorder.run_tool("assign", args)
     check_proc(o, "Assigning reads")    
 
-def run_kmers(reads_path, output, k_size, threads):
+def run_kmers(reads_path, output, k_size, threads, memory=()):
     if not os.path.isdir(f"{output}/profiles"):
         os.makedirs(f"{output}/profiles")
 
-    cmd = f""""{os.path.dirname(__file__)}/bin/count-kmers" "{reads_path}" "{output}/profiles/3mers" {k_size} {threads}"""
-    logger.debug("CMD::" + cmd)
-    o = os.system(cmd)
+    args = [f"{os.path.dirname(__file__)}/bin/count-kmers", reads_path, f"{output}/profiles/3mers", str(k_size), str(threads)] + list(memory)
+    o = recorder.run_tool("count-kmers", args)
     check_proc(o, "Counting Trimers")
 
-def run_15mer_counts(reads_path, output, threads):
+def run_15mer_counts(reads_path, output, threads, sketch_fraction=1.0, memory=()):
     if not os.path.isdir(f"{output}/profiles"):
         os.makedirs(f"{output}/profiles")
 
-    cmd = f""""{os.path.dirname(__file__)}/bin/count-15mers" "{reads_path}" "{output}/profiles/15mers-counts" {threads}"""
-    logger.debug("CMD::" + cmd)
-    o = os.system(cmd)
+    args = [f"{os.path.dirname(__file__)}/bin/count-15mers", reads_path, f"{output}/profiles/15mers-counts", str(threads)] + sketch_args(sketch_fraction) + list(memory)
+    o = recorder.run_tool("count-15mers", args)
     check_proc(o, "Counting 15-mers")
 
-def run_15mer_vecs(reads_path, output, bin_size, bins, threads):
+def run_15mer_vecs(reads_path, output, bin_size, bins, threads, mmap_advice="willneed", memory=()):
     if not os.path.isdir(f"{output}/profiles"):
         os.makedirs(f"{output}/profiles")
     
-    cmd = f""""{os.path.dirname(__file__)}/bin/search-15mers" "{output}/profiles/15mers-counts" "{reads_path}" "{output}/profiles/15mers" {bin_size} {bins} {threads}"""
-    logger.debug("CMD::" + cmd)
-    o = os.system(cmd)
+    args = [f"{os.path.dirname(__file__)}/bin/search-15mers", f"{output}/profiles/15mers-counts", reads_path, f"{output}/profiles/15mers", str(bin_size), str(bins), str(threads), mmap_advice] + list(memory)
+    o = recorder.run_tool("search-15mers", args)
     check_proc(o, "Counting 15-mer profiles")
 
+def run_profiles(reads_path, output, k_size, bin_size, bins, threads, filters=(), sketch_fraction=1.0, memory=()):
+    # counts 15-mers in the first pass, composition and coverage profiles in the second
+    if not os.path.isdir(f"{output}/profiles"):
+        os.makedirs(f"{output}/profiles")
+
+    # counts are renamed into place, a saved model linking the previous table keeps it
+    args = [f"{os.path.dirname(__file__)}/bin/coverage-vecs", reads_path, f"{output}/profiles/15mers-counts.tmp", f"{output}/profiles/15mers", str(bin_size), str(bins), str(threads), str(k_size), f"{output}/profiles/3mers"] + sketch_args(sketch_fraction) + list(memory)
+    if filters:
+        args += list(filters) + ["--kept", f"{output}/profiles/kept-reads"]
+    o = recorder.run_tool("coverage-vecs", args)
+    check_proc(o, "Computing composition and coverage profiles")
+    os.replace(f"{output}/profiles/15mers-counts.tmp", f"{output}/profiles/15mers-counts")
+
+# sharded runs, every path is explicit as shards live in their own directories
+def run_shard_counts(reads_path, counts_path, threads, filters=(), sketch_fraction=1.0, memory=()):
+    args = [f"{os.path.dirname(__file__)}/bin/count-15mers", reads_path, counts_path, str(threads)] + list(filters) + sketch_args(sketch_fraction) + list(memory)
+    o = recorder.run_tool("count-15mers", args)
+    check_proc(o, "Counting 15-mers")
+
+def run_merge_counts(counts_paths, merged_path, threads, memory=()):
+    # written next to the destination and renamed, shards never map a partial table
+    args = [f"{os.path.dirname(__file__)}/bin/merge-15mers", f"{merged_path}.tmp", str(threads)] + list(counts_paths) + list(memory)
+    o = recorder.run_tool("merge-15mers", args)
+    check_proc(o, "Merging 15-mer counts")
+    os.replace(f"{merged_path}.tmp", merged_path)
+
+def run_shard_profiles(reads_path, counts_path, shard_path, k_size, bin_size, bins, threads, mmap_advice="willneed", filters=(), memory=()):
+    args = [f"{os.path.dirname(__file__)}/bin/search-15mers", counts_path, reads_path, f"{shard_path}/15mers", str(bin_size), str(bins), str(threads), mmap_advice, str(k_size), f"{shard_path}/3mers"] + list(memory)
+    if filters:
+        args += list(filters) + ["--kept", f"{shard_path}/kept-reads"]
+    elif os.path.exists(f"{shard_path}/kept-reads"):
+        # mask of an earlier filtered run
+        os.remove(f"{shard_path}/kept-reads")
+    o = recorder.run_tool("search-15mers", args)
+    check_proc(o, "Computing composition and coverage profiles")
+
+def run_shard_assign(shard_path, stats_path, threads, mmap_advice="sequential", memory=()):
+    args = [f"{os.path.dirname(__file__)}/bin/assign", f"{shard_path}/3mers", f"{shard_path}/15mers", stats_path, str(threads), f"{shard_path}/final.txt", mmap_advice] + kept_args(shard_path) + list(memory)
+    o = recorder.run_tool("assign", args)
+    check_proc(o, "Assigning reads")
+
+def run_split_reads(reads_path, bins_path, output_dir, threads, gzip_level=0, max_open_files=256):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    args = [f"{os.path.dirname(__file__)}/bin/split-reads", reads_path, bins_path, output_dir, str(threads), str(gzip_level), str(max_open_files)]
+    o = recorder.run_tool("split-reads", args)
+    check_proc(o, "Separating reads into bins")
+
+# saved models, everything needed to assign new reads without recounting or reclustering
+MODEL_VERSION = 1
+
+def save_model(output, k_size, bin_size, bins, min_length=0, max_n_fraction=1.0, max_bases=0):
+    model = f"{output}/model"
+    if not os.path.isdir(model):
+        os.makedirs(model)
+
+    # the count table is large, linked when the filesystem allows it (it is only ever replaced, never rewritten)
+    if os.path.exists(f"{model}/15mers-counts"):
+        os.remove(f"{model}/15mers-counts")
+    try:
+        os.link(f"{output}/profiles/15mers-counts", f"{model}/15mers-counts")
+    except OSError:
+        shutil.copyfile(f"{output}/profiles/15mers-counts", f"{model}/15mers-counts")
+    shutil.copyfile(f"{output}/misc/cluster-stats.txt", f"{model}/cluster-stats.txt")
+
+    with open(f"{output}/misc/cluster-stats.txt") as f:
+        bin_names = f.read().split("\n")[0::5]
+
+    with open(f"{model}/model.json", "w") as f:
+        json.dump({"version": MODEL_VERSION,
+                   "k_size": k_size,
+                   "bin_size": bin_size,
+                   "bin_count": bins,
+                   # reads are filtered and trimmed as they were when the model was built
+                   "filters": {"min_length": min_length, "max_n_fraction": max_n_fraction, "max_bases": max_bases},
+                   "bins": [name for name in bin_names if name]}, f, indent=2)
+
+    return model
+
+def load_model(model):
+    if not os.path.isfile(f"{model}/model.json"):
+        raise ValueError(f"{model} is not a MetaBCC-LR model (no model.json)")
+
+    with open(f"{model}/model.json") as f:
+        params = json.load(f)
+
+    if params.get("version") != MODEL_VERSION:
+        raise ValueError(f"Unsupported model version {params.get('version')} in {model}")
+
+    for name in ["15mers-counts", "cluster-stats.txt"]:
+        if not os.path.isfile(f"{model}/{name}"):
+            raise ValueError(f"Model {model} has no {name}")
+
+    return params
+
+def run_classify(model, params, reads_path, output_path, threads, batch_bases):
+    # models saved before filters were recorded were built from unfiltered reads
+    filters = filter_args(**params.get("filters", {}))
+    args = [f"{os.path.dirname(__file__)}/bin/classify", f"{model}/15mers-counts", f"{model}/cluster-stats.txt", str(params["k_size"]), str(params["bin_size"]), str(params["bin_count"]), str(threads), reads_path, output_path, str(batch_bases)] + filters
+    o = recorder.run_tool("classify", args)
+    check_proc(o, "Classifying reads")
+
 # depprecated
 def run_dsk(output, max_memory, threads):
     logger.debug("Running DSK")
@@ -79,17 +202,6 @@ def run_dsk(output, max_memory, threads):
     check_proc(o, "Running DSK")
     scan_dsk.scan_dsk(f"{output}/misc/DSK/filtered_reads.h5", threads, f"{output}/misc/DSK/")
 
-def checkpoint(new_checkpoints, path):
-    pickle.dump(new_checkpoints, open(path, "wb+"))
-
-def load_checkpoints(path):
-    if not os.path.isfile(path):
-        data = {}
-        data['completed'] = set()
-        return data
-    else:
-        return pickle.load(open(path, "rb"))
-
 def check_proc(ret, name=""):
     if ret != 0:
         if name!= "": logger.error(f"Error in step: {name}")
@@ -1,33 +1,114 @@
+import os
 import random
 import numpy as np
 import logging
 
+from mbcclr_utils import profile_io
+
 logger = logging.getLogger('MetaBCC-LR')
 
-def sample(output, sample_count, ground_truth):
-    p3_data = np.loadtxt(f"{output}/profiles/3mers", dtype=float)
-    p15_data = np.loadtxt(f"{output}/profiles/15mers", dtype=float)
+def read_truth(ground_truth, idx_chosen):
+    # streams the truth file, only the labels of sampled reads are kept
+    chosen = iter(idx_chosen)
+    next_idx = next(chosen, None)
+    labels = []
 
-    logger.debug(f"3mer data shape {str(p3_data.shape)}")
-    logger.debug(f"15mer data shape {str(p15_data.shape)}")
+    with open(ground_truth) as truth:
+        for n, line in enumerate(truth):
+            if next_idx is None:
+                break
+            if n == next_idx:
+                labels.append(line.strip())
+                next_idx = next(chosen, None)
 
-    if ground_truth is not None:
-        ground_truth = np.array(open(ground_truth).read().strip().split('\n'))
-        logger.debug(f"Ground truth data shape {str(ground_truth.shape)}")
+    if next_idx is not None:
+        raise ValueError(f"Ground truth has fewer lines than the profiled reads ({ground_truth})")
+
+    return np.array(labels)
+
+def read_indices(profiles, rows, idx):
+    """
+    Input read indices of the profile rows idx, reads dropped by the read filter
+    have no profile. Returns the indices and the number of input reads.
+    """
+    if not os.path.isfile(f"{profiles}/kept-reads"):
+        return idx, rows
+
+    # one byte per input read, 1 if it was kept
+    kept = np.fromfile(f"{profiles}/kept-reads", dtype=np.uint8)
+    kept_idx = np.flatnonzero(kept)
+
+    if len(kept_idx) != rows:
+        raise ValueError(f"Kept reads of {profiles} do not match the profiles")
+
+    return kept_idx[idx], len(kept)
+
+def gather(parts, idx_parts, path, chunk_rows):
+    """
+    Rows idx_parts[i] of every profile in parts, saved to path as one .npy.
+    Rows are copied chunk_rows at a time into the memory mapped output.
+    """
+    rows = sum(len(idx) for idx in idx_parts)
+
+    if rows == 0:
+        np.save(path, np.zeros((0, parts[0].shape[1]), dtype=parts[0].dtype))
+        return
+
+    sampled = np.lib.format.open_memmap(path, mode="w+", dtype=parts[0].dtype, shape=(rows, parts[0].shape[1]))
+    pos = 0
+
+    for part, idx in zip(parts, idx_parts):
+        for start in range(0, len(idx), chunk_rows):
+            chunk = part[idx[start:start + chunk_rows]]
+            sampled[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+
+    sampled.flush()
+    del sampled
+
+def sample(output, sample_count, ground_truth, seed=None, profile_dirs=None, chunk_rows=1000000):
+    # profiles of a single run, or of every shard (in read order) when gathering a sharded run
+    profile_dirs = profile_dirs or [f"{output}/profiles"]
+    p3_parts = [profile_io.open_profile(f"{d}/3mers") for d in profile_dirs]
+    p15_parts = [profile_io.open_profile(f"{d}/15mers") for d in profile_dirs]
+
+    for d, p3, p15 in zip(profile_dirs, p3_parts, p15_parts):
+        if len(p3) != len(p15):
+            raise ValueError(f"Composition and coverage profiles of {d} have different read counts")
+        logger.debug(f"3mer data shape {str(p3.shape)}")
+        logger.debug(f"15mer data shape {str(p15.shape)}")
+
+    offsets = np.cumsum([0] + [len(p3) for p3 in p3_parts])
+    total = int(offsets[-1])
 
     if sample_count <= 0:
-        sample_count = int(len(p3_data)/100)
-    
-    logger.debug(f"Sampling count {sample_count}")
+        sample_count = int(total/100)
 
-    idx_chosen = random.sample(range(len(p3_data)), sample_count)
+    if sample_count > total:
+        logger.warning(f"Sample count {sample_count} is larger than the number of reads, using all {total} reads")
+        sample_count = total
+    
+    logger.debug(f"Sampling count {sample_count} (seed {seed})")
 
-    p3_sampled = p3_data[idx_chosen]
-    p15_sampled = p15_data[idx_chosen]
+    # indices only, O(sample_count) memory; sorted so that the memory mapped profiles are read front to back
+    rng = random.Random(seed)
+    idx_chosen = np.array(sorted(rng.sample(range(total), sample_count)), dtype=np.int64)
+    bounds = np.searchsorted(idx_chosen, offsets)
+    idx_parts = [idx_chosen[bounds[i]:bounds[i + 1]] - offsets[i] for i in range(len(profile_dirs))]
 
-    np.save(f"{output}/profiles/3mers_sampled.npy", p3_sampled)
-    np.save(f"{output}/profiles/15mers_sampled.npy", p15_sampled)
+    gather(p3_parts, idx_parts, f"{output}/profiles/3mers_sampled.npy", chunk_rows)
+    gather(p15_parts, idx_parts, f"{output}/profiles/15mers_sampled.npy", chunk_rows)
 
     if ground_truth is not None:
-        ground_truth_sampled = ground_truth[idx_chosen]
+        # the ground truth has a line per input read
+        idx_reads = []
+        read_offset = 0
+
+        for i, d in enumerate(profile_dirs):
+            idx, reads = read_indices(d, len(p3_parts[i]), idx_parts[i])
+            idx_reads.append(idx + read_offset)
+            read_offset += reads
+
+        ground_truth_sampled = read_truth(ground_truth, np.concatenate(idx_reads))
+        logger.debug(f"Ground truth sampled shape {str(ground_truth_sampled.shape)}")
         np.save(f"{output}/misc/filtered_truth_sampled.npy", ground_truth_sampled)
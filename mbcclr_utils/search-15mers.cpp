@@ -1,157 +1,119 @@
 #include <iostream>
+#include <algorithm>
 #include <omp.h>
 #include <fstream>
 #include <string>
 #include <vector>
-#include <atomic>
-#include <thread>
-#include <mutex>
-#include <queue>
-#include <condition_variable>
 #include "io_utils.h"
 #include "kmer_utils.h"
+#include "profile_utils.h"
+#include "composition_utils.h"
+#include "metrics_utils.h"
 
 using namespace std;
 
-queue<string> reads_queue;
-mutex mux;
-condition_variable condition;
-volatile bool terminate_threads;
-
-void processLinesBatch(vector<string> &linesBatch, vector<atomic<u_int32_t>> &allKmers, string &output_path, int threads, long bin_size, int bins)
+void processLinesBatch(ReadBatch &linesBatch, KmerTable &allKmers, ProfileWriter &output, CompositionProfiler *profiler, ProfileWriter *output_composition, int threads, long bin_size, int bins)
 {
-    vector<double *> batchAnswers(linesBatch.size());
+    vector<float> batchAnswers(linesBatch.size() * bins);
+    vector<float> batchProfiles(profiler ? linesBatch.size() * profiler->size() : 0);
 
 #pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
-    for (uint i = 0; i < linesBatch.size(); i++)
+    for (size_t i = 0; i < linesBatch.size(); i++)
     {
-        batchAnswers[i] = line_to_vec(linesBatch[i], allKmers, bin_size, bins);
-    }
-
-    ofstream output;
-    output.open(output_path, ios::out | ios::app);
-    string results = "";
+        line_to_vec(linesBatch.seq(i), linesBatch.length(i), allKmers, bin_size, bins, batchAnswers.data() + i * bins);
 
-    for (uint i = 0; i < linesBatch.size(); i++)
-    {
-        for (int j = 0; j < bins; j++)
+        if (profiler)
         {
-            results += to_string(batchAnswers[i][j]);
-
-            if (j < bins - 1)
-            {
-                results += " ";
-            }
+            profiler->count_kmers(linesBatch.seq(i), linesBatch.length(i), batchProfiles.data() + i * profiler->size());
         }
-
-        results += "\n";
-
-        // releasing pointer memory
-        delete[] batchAnswers[i];
     }
 
-    output << results;
-    batchAnswers.clear();
-    output.close();
-}
+    output.write_rows(batchAnswers.data(), linesBatch.size());
 
-void off_load_process(string &output, vector<atomic<u_int32_t>> &all_kmers, int &threads, long bin_size, int bins)
-{
-    string seq;
-    vector<string> batch;
-
-    while (true)
+    if (output_composition)
     {
-        {
-            unique_lock<mutex> lock(mux);
-
-            while (reads_queue.size() > 0)
-            {
-                seq = reads_queue.front();
-                batch.push_back(seq);
-                reads_queue.pop();
-
-                if (batch.size() == 10000)
-                {
-                    break;
-                }
-            }
-        }
-
-        condition.notify_all();
-
-        if (batch.size() > 0)
-        {
-            processLinesBatch(batch, all_kmers, output, threads, bin_size, bins);
-            batch.clear();
-        }
-
-        {
-            unique_lock<mutex> lock(mux);
-            if (terminate_threads && reads_queue.size() == 0)
-            {
-                break;
-            }
-        }
+        output_composition->write_rows(batchProfiles.data(), linesBatch.size());
     }
 }
 
-void io_thread(string &file_path)
+int main(int argc, char **argv)
 {
-    SeqReader reader(file_path);
-    Seq seq;
-    int count = 0;
+    ReadFilter filter = ReadFilter::from_args(argc, argv);
+    MemoryOptions memory = MemoryOptions::from_args(argc, argv);
+    string kmers_file = argv[1];
+    cout << "K-Mer file " << kmers_file << endl;
 
-    while (reader.get_seq(seq))
+    // pages are faulted in on demand (or prefetched depending on the advice)
+    string advice = argc > 7 ? argv[7] : "willneed";
+    cout << "MAPPING KMERS (" << advice << ")" << endl;
+    // the count table and outputs throw on missing, truncated or unwritable files
+    try
     {
-        {
-            unique_lock<mutex> lock(mux);
-            condition.wait(lock, [] { return reads_queue.size() < 50000; });
-            reads_queue.push(seq.data);
-        }
-        count++;
-        cout << "Loaded Reads " << count << "       \r" << flush;
-    }
+        KmerTable kmers(kmers_file, advice);
 
-    cout << endl;
+        cout << "FINISHED MAPPING KMERS" << endl;
 
-    terminate_threads = true;
-}
+        string input_path = argv[2];
+        string output_path = argv[3];
+        int bin_size = stoi(argv[4]);
+        int bins = stoi(argv[5]);
+        int threads = stoi(argv[6]);
 
-int main(int argc, char **argv)
-{
-    vector<string> batch;
-    string kmers_file = argv[1];
-    cout << "K-Mer file " << kmers_file << endl;
+        cout << "INPUT FILE " << input_path << endl;
+        cout << "OUTPUT FILE " << output_path << endl;
+        cout << "THREADS " << threads << endl;
+        cout << "BIN WIDTH " << bin_size << endl;
+        cout << "BINS IN HIST " << bins << endl;
 
-    cout << "LOADING KMERS TO RAM" << endl;
-    vector<atomic<u_int32_t>> kmers = readKmerFile(kmers_file);
+        // composition profiles in the same pass, used by sharded runs against a merged count table
+        CompositionProfiler *profiler = nullptr;
+        ProfileWriter *output_composition = nullptr;
 
-    cout << "FINISHED LOADING KMERS TO RAM " << endl;
+        if (argc > 9)
+        {
+            profiler = new CompositionProfiler(stoi(argv[8]));
+            output_composition = new ProfileWriter(argv[9], profiler->size());
 
-    string input_path = argv[2];
-    string output_path = argv[3];
-    int bin_size = stoi(argv[4]);
-    int bins = stoi(argv[5]);
-    int threads = stoi(argv[6]);
+            cout << "K_SIZE " << argv[8] << endl;
+            cout << "COMPOSITION OUTPUT FILE " << argv[9] << endl;
+        }
 
-    cout << "INPUT FILE " << input_path << endl;
-    cout << "OUTPUT FILE " << output_path << endl;
-    cout << "THREADS " << threads << endl;
-    cout << "BIN WIDTH " << bin_size << endl;
-    cout << "BINS IN HIST " << bins << endl;
+        ToolMetrics metrics;
+        ProfileWriter output(output_path, bins);
+        ReadPipeline reader(input_path, threads, filter, memory);
+        ReadBatch *batch;
 
-    ofstream output(output_path, ios::out);
+        while (reader.next(batch))
+        {
+            processLinesBatch(*batch, kmers, output, profiler, output_composition, threads, bin_size, bins);
+            reader.release(batch);
+        }
+
+        output.close();
 
-    thread iot(io_thread, ref(input_path));
-    thread process(off_load_process, ref(output_path), ref(kmers), ref(threads), ref(bin_size), ref(bins));
+        if (profiler)
+        {
+            output_composition->close();
+            delete output_composition;
+            delete profiler;
+        }
 
-    iot.join();
-    process.join();
+        if (reader.error())
+        {
+            cerr << "Error reading " << input_path << endl;
+            return 1;
+        }
 
-    kmers.clear();
+        cout << "COMPLETED : Output at - " << output_path << endl;
 
-    cout << "COMPLETED : Output at - " << output_path << endl;
+        metrics.add(reader.reads(), reader.bases());
+        metrics.write();
+    }
+    catch (const exception &e)
+    {
+        cerr << e.what() << endl;
+        return 1;
+    }
 
     return 0;
 }
@@ -0,0 +1,243 @@
+#include <iostream>
+#include <fstream>
+#include <algorithm>
+#include <omp.h>
+#include <cstdio>
+#include <string>
+#include <vector>
+#include <list>
+#include <unordered_map>
+#include <zlib.h>
+#include "io_utils.h"
+#include "metrics_utils.h"
+
+using namespace std;
+
+// records are buffered per bin and written once this much is buffered in total
+const size_t ROUND_BYTES = 1 << 26;
+
+// reads of one bin
+class BinOutput
+{
+public:
+    string path;
+    string buffer;
+    string packed;
+    FILE *file = nullptr;
+    bool created = false;
+    list<BinOutput *>::iterator position;
+};
+
+// Keeps at most max_open bin files open, the least recently written one is
+// closed first and reopened for appending when its bin shows up again.
+class FilePool
+{
+private:
+    size_t max_open;
+    list<BinOutput *> open_files;
+
+public:
+    FilePool(size_t max_open) : max_open(max(max_open, (size_t)1)) {}
+
+    ~FilePool()
+    {
+        for (BinOutput *bin : open_files)
+        {
+            fclose(bin->file);
+        }
+    }
+
+    FILE *get(BinOutput &bin)
+    {
+        if (bin.file)
+        {
+            open_files.splice(open_files.end(), open_files, bin.position);
+            return bin.file;
+        }
+
+        if (open_files.size() >= max_open)
+        {
+            BinOutput *oldest = open_files.front();
+            fclose(oldest->file);
+            oldest->file = nullptr;
+            open_files.pop_front();
+        }
+
+        bin.file = fopen(bin.path.c_str(), bin.created ? "ab" : "wb");
+
+        if (bin.file == nullptr)
+        {
+            throw runtime_error("Unable to open " + bin.path);
+        }
+        bin.created = true;
+        bin.position = open_files.insert(open_files.end(), &bin);
+
+        return bin.file;
+    }
+};
+
+// one gzip member, members written back to back form a valid gzip file
+void gzip_member(const string &data, string &packed, int level)
+{
+    z_stream zs = {};
+
+    deflateInit2(&zs, level, Z_DEFLATED, 31, 8, Z_DEFAULT_STRATEGY);
+    packed.resize(deflateBound(&zs, data.size()));
+
+    zs.next_in = (Bytef *)data.data();
+    zs.avail_in = data.size();
+    zs.next_out = (Bytef *)&packed[0];
+    zs.avail_out = packed.size();
+
+    deflate(&zs, Z_FINISH);
+    packed.resize(zs.total_out);
+    deflateEnd(&zs);
+}
+
+// compresses the buffered bins in parallel and writes them one at a time
+void flush(vector<BinOutput *> &pending, FilePool &pool, int level, int threads)
+{
+    if (level > 0)
+    {
+#pragma omp parallel for num_threads(threads) schedule(dynamic, 1)
+        for (size_t i = 0; i < pending.size(); i++)
+        {
+            gzip_member(pending[i]->buffer, pending[i]->packed, level);
+        }
+    }
+
+    for (BinOutput *bin : pending)
+    {
+        const string &data = level > 0 ? bin->packed : bin->buffer;
+        FILE *file = pool.get(*bin);
+
+        if (fwrite(data.data(), 1, data.size(), file) != data.size())
+        {
+            throw runtime_error("Unable to write " + bin->path);
+        }
+        bin->buffer.clear();
+        bin->packed.clear();
+    }
+    pending.clear();
+}
+
+int main(int argc, char **argv)
+{
+    string reads_path = argv[1];
+    string bins_path = argv[2];
+    string output_dir = argv[3];
+    int threads = stoi(argv[4]);
+    int level = stoi(argv[5]);
+    size_t max_open = stoul(argv[6]);
+
+    cout << "INPUT FILE " << reads_path << endl;
+    cout << "BINS FILE " << bins_path << endl;
+    cout << "OUTPUT DIRECTORY " << output_dir << endl;
+    cout << "THREADS " << threads << endl;
+    cout << "GZIP LEVEL " << level << endl;
+    cout << "MAX OPEN FILES " << max_open << endl;
+
+    ToolMetrics metrics;
+    u_int64_t reads = 0, bases = 0;
+
+    try
+    {
+        SeqReader reader(reads_path, threads);
+        ifstream bins_file(bins_path);
+        unordered_map<string, BinOutput> bins;
+        vector<BinOutput *> pending;
+        FilePool pool(max_open);
+        size_t buffered = 0;
+        string bin_id, extension;
+        Seq seq;
+
+        if (!bins_file)
+        {
+            throw runtime_error("Unable to open bins file " + bins_path);
+        }
+
+        while (reader.get_seq(seq))
+        {
+            if (!getline(bins_file, bin_id))
+            {
+                throw runtime_error("Bins file has fewer lines than the reads file");
+            }
+
+            // same as strip()
+            bin_id.erase(0, bin_id.find_first_not_of(" \t\r\n"));
+            bin_id.erase(bin_id.find_last_not_of(" \t\r\n") + 1);
+
+            // FASTQ is passed through with qualities, format of the first record
+            if (extension.empty())
+            {
+                extension = seq.qual.empty() ? ".fasta" : ".fastq";
+                extension += level > 0 ? ".gz" : "";
+            }
+
+            BinOutput &bin = bins[bin_id];
+
+            if (bin.path.empty())
+            {
+                bin.path = output_dir + "/" + bin_id + extension;
+            }
+
+            if (bin.buffer.empty())
+            {
+                pending.push_back(&bin);
+            }
+
+            size_t before = bin.buffer.size();
+            bin.buffer += seq.qual.empty() ? '>' : '@';
+            bin.buffer += seq.id;
+            // FASTA headers are the read id alone, as the old reads2bins.py wrote them
+            if (!seq.qual.empty() && !seq.comment.empty())
+            {
+                bin.buffer += ' ';
+                bin.buffer += seq.comment;
+            }
+            bin.buffer += '\n';
+            bin.buffer += seq.data;
+            bin.buffer += '\n';
+            if (!seq.qual.empty())
+            {
+                bin.buffer += "+\n";
+                bin.buffer += seq.qual;
+                bin.buffer += '\n';
+            }
+            buffered += bin.buffer.size() - before;
+
+            reads++;
+            bases += seq.data.size();
+
+            if (buffered >= ROUND_BYTES)
+            {
+                flush(pending, pool, level, threads);
+                buffered = 0;
+            }
+        }
+
+        if (reader.error())
+        {
+            throw runtime_error("Error reading " + reads_path);
+        }
+
+        if (getline(bins_file, bin_id) && !bin_id.empty())
+        {
+            throw runtime_error("Bins file has more lines than the reads file");
+        }
+
+        flush(pending, pool, level, threads);
+
+        cout << "WROTE " << reads << " READS TO " << bins.size() << " BINS" << endl;
+    }
+    catch (const exception &e)
+    {
+        cerr << e.what() << endl;
+        return 1;
+    }
+
+    metrics.add(reads, bases);
+    metrics.write();
+
+    return 0;
+}
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import logging
+
+from mbcclr_utils.embedding_cache import file_digest
+
+logger = logging.getLogger('MetaBCC-LR')
+
+TOOL_VERSION = "2.0"
+
+
+def input_fingerprint(path, sample_bytes=1 << 20):
+    # size, mtime and both ends of the file, hashing a whole long read run costs as much as profiling it
+    if path is None:
+        return None
+
+    st = os.stat(path)
+    h = hashlib.sha1(f"{st.st_size} {st.st_mtime_ns}".encode())
+
+    with open(path, "rb") as f:
+        h.update(f.read(sample_bytes))
+        f.seek(max(st.st_size - sample_bytes, 0))
+        h.update(f.read(sample_bytes))
+
+    return h.hexdigest()
+
+
+def code_digest(paths):
+    # native binaries and python modules a stage runs, rebuilt or edited code gives new keys
+    h = hashlib.sha1(TOOL_VERSION.encode())
+
+    for path in paths:
+        h.update(file_digest(path).encode())
+
+    return h.hexdigest()
+
+
+def link_file(src, dst):
+    # renamed into place, nothing ever writes through to the linked copy
+    tmp = f"{dst}.{os.getpid()}.link"
+
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class StageCache:
+    """
+    Stage outputs stored under output/cache/stages/<stage>-<key>, keyed by the hash of
+    the stage name and its parameters (input fingerprints, upstream keys, code digests).
+    Entries hold hard links to the stage outputs, so variants of a stage sit side by side
+    and the one in use is linked back into the output directory. Least recently used
+    entries are evicted once the directory exceeds max_size bytes.
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, stage, **params):
+        return hashlib.sha1(json.dumps([stage, params], sort_keys=True).encode()).hexdigest()
+
+    def entry(self, stage, key):
+        return f"{self.path}/{stage}-{key}"
+
+    @staticmethod
+    def clear(output, files):
+        # stage outputs are removed, not overwritten, before a stage runs
+        # so that cached entries sharing their inodes are never rewritten
+        for name in files:
+            if os.path.exists(f"{output}/{name}"):
+                os.remove(f"{output}/{name}")
+
+    def restore(self, stage, key, output):
+        """
+        Links the files of a cached entry into the output directory. False if there is none,
+        files linked before a failure are removed again so that the stage never writes into them.
+        """
+        entry = self.entry(stage, key)
+        linked = []
+
+        try:
+            with open(f"{entry}/manifest.json") as f:
+                manifest = json.load(f)
+            for name in manifest["files"]:
+                os.makedirs(os.path.dirname(f"{output}/{name}"), exist_ok=True)
+                link_file(f"{entry}/{name}", f"{output}/{name}")
+                linked.append(name)
+        except (OSError, ValueError, KeyError):
+            self.clear(output, linked)
+            return False
+
+        # mtime tracks the last use for eviction
+        os.utime(entry)
+        logger.debug(f"Restored {stage} outputs from {entry}")
+
+        return True
+
+    def store(self, stage, key, output, files, params, keep=()):
+        """
+        Links the stage outputs (relative to the output directory) into a new entry.
+        Entries named in keep (the ones the current run uses) are never evicted.
+        """
+        entry = self.entry(stage, key)
+        tmp = f"{entry}.{os.getpid()}.tmp"
+
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+
+        files = [name for name in files if os.path.exists(f"{output}/{name}")]
+
+        for name in files:
+            os.makedirs(os.path.dirname(f"{tmp}/{name}"), exist_ok=True)
+            link_file(f"{output}/{name}", f"{tmp}/{name}")
+
+        # written last, entries without a manifest are incomplete
+        with open(f"{tmp}/manifest.json", "w") as f:
+            json.dump({"stage": stage, "params": params, "files": files, "created": time.time()}, f, indent=2)
+
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.replace(tmp, entry)
+
+        self.evict(set(keep) | {entry})
+
+    def evict(self, keep=()):
+        entries = []
+
+        for name in os.listdir(self.path):
+            entry = f"{self.path}/{name}"
+
+            if not os.path.isfile(f"{entry}/manifest.json"):
+                continue
+            size = 0
+            for root, _, names in os.walk(entry):
+                size += sum(os.path.getsize(f"{root}/{n}") for n in names)
+            entries.append((os.stat(entry).st_mtime, size, entry))
+
+        # entries in use count towards the limit but stay
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            if entry in keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            logger.debug(f"Evicted cached stage {os.path.basename(entry)}")
+            total -= size
@@ -0,0 +1,177 @@
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger('MetaBCC-LR')
+
+# native tools append one JSON line of counters to this file
+METRICS_ENV = "MBCC_METRICS"
+
+
+def io_counters():
+    # bytes passed through read/write system calls (Linux only)
+    counters = {}
+
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        return None
+
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+def cpu_time(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def exit_code(status):
+    # wait status as Popen reports it, negative signal numbers for killed tools
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return status
+
+
+def rates(entry, wall):
+    for key in ("reads", "bases"):
+        if entry.get(key) is not None and wall > 0:
+            entry[f"{key}_per_s"] = round(entry[key] / wall, 1)
+
+
+class Recorder:
+    """
+    Collects metrics of driver stages, native tool runs and binner steps for run-metrics.json.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stages = []
+        self.tools = []
+        self.steps = {}
+        # CPU time of processes that are not our direct children (forkserver pool workers)
+        self.external_cpu_s = 0.0
+
+    @contextmanager
+    def stage(self, name, **counters):
+        start = time.perf_counter()
+        self_start = resource.getrusage(resource.RUSAGE_SELF)
+        children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        external_start = self.external_cpu_s
+        tools_start = len(self.tools)
+        io_start = io_counters()
+        entry = {"name": name}
+        entry.update(counters)
+
+        try:
+            yield entry
+        finally:
+            wall = time.perf_counter() - start
+            self_end = resource.getrusage(resource.RUSAGE_SELF)
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            io_end = io_counters()
+            cpu = cpu_time(self_end) - cpu_time(self_start) + cpu_time(children_end) - cpu_time(children_start)
+
+            entry["wall_s"] = round(wall, 3)
+            entry["cpu_s"] = round(cpu + self.external_cpu_s - external_start, 3)
+            # the driver's ru_maxrss only grows, so this is its peak so far, or the largest tool run in the stage
+            entry["peak_rss_mb"] = max([round(self_end.ru_maxrss / 1024, 1)] + [tool["peak_rss_mb"] for tool in self.tools[tools_start:]])
+            if io_start is not None and io_end is not None:
+                entry["bytes_read"] = io_end[0] - io_start[0]
+                entry["bytes_written"] = io_end[1] - io_start[1]
+            rates(entry, wall)
+            self.stages.append(entry)
+            logger.debug(f"Stage {name}: {entry['wall_s']}s wall, {entry['cpu_s']}s CPU, {entry['peak_rss_mb']}MB peak RSS")
+
+    @contextmanager
+    def step(self, name):
+        # binner steps run many times, only totals are kept
+        start = time.perf_counter()
+        cpu_start = cpu_time(resource.getrusage(resource.RUSAGE_SELF))
+
+        try:
+            yield
+        finally:
+            step = self.steps.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            step["calls"] += 1
+            step["wall_s"] += time.perf_counter() - start
+            step["cpu_s"] += cpu_time(resource.getrusage(resource.RUSAGE_SELF)) - cpu_start
+
+    def pop_steps(self):
+        steps = self.steps
+        self.steps = {}
+        return steps
+
+    def merge_steps(self, steps):
+        for name, other in steps.items():
+            step = self.steps.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            for key in step:
+                step[key] += other[key]
+
+    def run_tool(self, name, args):
+        """
+        Runs a native tool and records its own wall/CPU time, peak RSS and counters.
+        Returns the exit code.
+        """
+        fd, metrics_path = tempfile.mkstemp(prefix="mbcc-metrics-")
+        os.close(fd)
+        env = dict(os.environ)
+        env[METRICS_ENV] = metrics_path
+
+        logger.debug("CMD::" + " ".join(f'"{a}"' for a in args))
+
+        start = time.perf_counter()
+        try:
+            proc = subprocess.Popen(args, env=env)
+        except OSError as e:
+            os.remove(metrics_path)
+            logger.error(f"Unable to run {args[0]}: {e}")
+            return 1
+
+        _, status, usage = os.wait4(proc.pid, 0)
+        # already reaped, keep Popen from waiting again
+        proc.returncode = exit_code(status)
+        wall = time.perf_counter() - start
+
+        entry = {"name": name,
+                 "tool": os.path.basename(args[0]),
+                 "exit_code": proc.returncode,
+                 "wall_s": round(wall, 3),
+                 "cpu_s": round(cpu_time(usage), 3),
+                 "peak_rss_mb": round(usage.ru_maxrss / 1024, 1)}
+
+        try:
+            with open(metrics_path) as f:
+                for line in f:
+                    entry.update(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        os.remove(metrics_path)
+
+        rates(entry, wall)
+        self.tools.append(entry)
+
+        return proc.returncode
+
+    def write(self, path, **info):
+        report = dict(info)
+        report["stages"] = self.stages
+        report["tools"] = self.tools
+        report["binner_steps"] = {name: {"calls": step["calls"],
+                                         "wall_s": round(step["wall_s"], 3),
+                                         "cpu_s": round(step["cpu_s"], 3)} for name, step in self.steps.items()}
+
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+recorder = Recorder()
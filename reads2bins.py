@@ -1,50 +1,22 @@
 import argparse
-import os
-from Bio import SeqIO
-import gzip
+import logging
+
+from mbcclr_utils import runners_utils
 
 parser = argparse.ArgumentParser(description='Separate reads in to bins.')
 
-parser.add_argument('--reads', '-r', type=str, required=True)
+parser.add_argument('--reads', '-r', help="Reads binned, several files in the order given to mbcclr", type=str, nargs='+', required=True)
 parser.add_argument('--bins', '-b', type=str, required=True)
 parser.add_argument('--output', '-o' ,type=str, required=True)
+parser.add_argument('--threads', '-t', help="Threads used to decompress the reads and compress the bins", type=int, default=8)
+parser.add_argument('--gzip', '-z', help="Compress the bins with this gzip level (1-9), 0 for plain text", type=int, choices=range(10), default=0)
+parser.add_argument('--max-open-files', help="Bin files kept open at a time", type=int, default=256)
 
 args = parser.parse_args()
 
-readsPath = args.reads
-readBinsPath = args.bins
-
-if 'gz' in readsPath.lower() or 'zip' in readsPath.lower():
-    readsType = readsPath.split(".")[-2].lower()
-else:
-    readsType = readsPath.split(".")[-1].lower()
-
-if readsType in ["fasta", "fna", "fa"]:
-    readsType = "fasta"
-else:
-    readsType = "fastq"
-
-if not os.path.exists(args.output):
-    os.makedirs(args.output)
-
-outputDir = args.output + "/"
-outFiles = {}
-bins = open(readBinsPath)
-
-if 'gz' in readsPath.lower() or 'zip' in readsPath.lower():
-    input_file = gzip.open(readsPath, "rt")
-else:
-    input_file = readsPath
-
-for record, bin_id in zip(SeqIO.parse(input_file, readsType), open(readBinsPath)):
-    bin_id = bin_id.strip().split("\n")[-1]
-    bpath = f"{outputDir}/{bin_id}.fasta"
-
-    if bpath not in outFiles:
-        outFiles[bpath] = open(bpath, "w+")
-
-    outFiles[bpath].write(f">{str(record.id)}\n{str(record.seq)}\n")
+logger = logging.getLogger('MetaBCC-LR')
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler())
 
-for k, f in outFiles.items():
-    f.close()
-bins.close()
\ No newline at end of file
+# FASTA/FASTQ (optionally gzipped) is detected from the content, FASTQ qualities are kept
+runners_utils.run_split_reads(",".join(args.reads), args.bins, args.output, max(args.threads, 1), args.gzip, args.max_open_files)
@@ -47,7 +47,7 @@ setuptools.setup(
     package_data=package_data,
     data_files=data_files,
     include_package_data=True,
-    scripts=['mbcclr'],
+    scripts=['mbcclr', 'mbcclr-shard', 'mbcclr-classify', 'mbcclr-plot'],
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         "Programming Language :: Python :: 3",
@@ -0,0 +1,34 @@
+import os
+import random
+import subprocess
+
+import numpy as np
+import pytest
+
+from mbcclr_utils.profile_io import open_profile
+
+COUNT_KMERS = os.path.join(os.path.dirname(__file__), "..", "mbcclr_utils", "bin", "count-kmers")
+
+pytestmark = pytest.mark.skipif(not os.path.exists(COUNT_KMERS), reason="native tools are not built (sh build.sh)")
+
+
+def composition(tmp_path, reads, k_size):
+    fasta = tmp_path / "reads.fasta"
+    fasta.write_text("".join(f">r{i}\n{seq}\n" for i, seq in enumerate(reads)))
+    subprocess.run([COUNT_KMERS, str(fasta), str(tmp_path / "3mers"), str(k_size), "1"], check=True, capture_output=True)
+
+    return np.array(open_profile(str(tmp_path / "3mers")))
+
+
+@pytest.mark.parametrize("k_size", [3, 5])
+def test_soft_masked_bases_profile_as_upper_case(tmp_path, k_size):
+    rng = random.Random(7)
+    # long enough for the vector path and its scalar tail, with an N breaking the window
+    read = "".join(rng.choice("ACGT") for _ in range(1003)) + "N" + "".join(rng.choice("ACGT") for _ in range(37))
+    masked = "".join(c.lower() if 200 <= i < 700 or i % 7 == 0 else c for i, c in enumerate(read))
+
+    profiles = composition(tmp_path, [read, masked, read.lower()], k_size)
+
+    assert profiles[0].sum() > 0
+    np.testing.assert_array_equal(profiles[1], profiles[0])
+    np.testing.assert_array_equal(profiles[2], profiles[0])